@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+"""triscord.actionlog unit tests."""
+
+import os
+
+import arrow
+
+from triscord import actionlog as unit
+
+
+def _raw_actions(board_index, count, start='2017-01-01'):
+    """Returns count chronological raw actions, one per day."""
+
+    return [
+        {
+            'id': '{:02d}{:022d}'.format(board_index, index),
+            'type': 'commentCard',
+            'date': arrow.get(start).shift(days=index).isoformat(),
+        }
+        for index in range(count)
+    ]
+
+
+def test_append_scan(tmpdir):
+    """Asserts that logged actions are scanned back chronologically, per board and date."""
+
+    action_log = unit.ActionLog(tmpdir.join('log').strpath, segment_size=256)
+    first, second = _raw_actions(1, 10), _raw_actions(2, 10)
+
+    assert action_log.append('AAAAAAAA', first[:5]) == 5
+    assert action_log.append('BBBBBBBB', second) == 10
+    assert action_log.append('AAAAAAAA', first) == 5
+
+    assert len(action_log.segments()) > 1
+    assert list(action_log.scan('AAAAAAAA')) == first
+    assert list(action_log.scan('BBBBBBBB', since='2017-01-03', until='2017-01-05')) \
+        == second[2:4]
+    assert len(list(action_log.scan())) == 20
+
+
+def test_get(tmpdir):
+    """Asserts that actions are found back by id."""
+
+    action_log = unit.ActionLog(tmpdir.join('log').strpath, segment_size=256)
+    actions = _raw_actions(1, 10)
+    action_log.append('AAAAAAAA', actions)
+
+    assert action_log.get(actions[7]['id']) == actions[7]
+    assert action_log.get('ffffffffffffffffffffffff') is None
+
+    # Ids matching within other index columns are skipped
+    action_log.append(actions[2]['id'], [dict(actions[0], id='ffffffffffffffffffffffff')])
+    assert action_log.get(actions[2]['id']) == actions[2]
+
+
+def test_recent_ids(mocker, tmpdir):
+    """Asserts that actions logged by a previous instance are not logged again.
+
+    Only the RECENT_IDS latest ids are remembered, older duplicates being left to compaction
+    and skipped by scans.
+    """
+
+    actions = _raw_actions(1, 3)
+    unit.ActionLog(tmpdir.join('log').strpath).append('AAAAAAAA', actions)
+
+    action_log = unit.ActionLog(tmpdir.join('log').strpath)
+    assert action_log.append('AAAAAAAA', actions) == 0
+    assert list(action_log.scan()) == actions
+
+    mocker.patch('triscord.actionlog.RECENT_IDS', 2)
+    action_log = unit.ActionLog(tmpdir.join('log').strpath)
+    assert action_log.append('AAAAAAAA', actions) == 1
+    assert list(action_log.scan()) == actions
+
+
+def test_torn_index(tmpdir):
+    """Asserts that a partially written index record is ignored."""
+
+    action_log = unit.ActionLog(tmpdir.join('log').strpath)
+    actions = _raw_actions(1, 3)
+    action_log.append('AAAAAAAA', actions)
+    with open(tmpdir.join('log', '0000000000.idx').strpath, 'ab') as index_file:
+        index_file.write(b'\1\2\3')
+
+    assert list(action_log.scan()) == actions
+
+
+def test_compact(tmpdir):
+    """Asserts that compaction drops expired and duplicate actions from closed segments."""
+
+    recent = arrow.utcnow().shift(days=-5).floor('day').isoformat()
+    old_actions, recent_actions = _raw_actions(1, 5), _raw_actions(2, 5, start=recent)
+    action_log = unit.ActionLog(tmpdir.join('log').strpath, segment_size=256, retention_days=30)
+    action_log.append('AAAAAAAA', old_actions + recent_actions)
+    # Logged again by another process, followed by newer actions
+    unit.ActionLog(tmpdir.join('log').strpath, segment_size=256).append(
+        'AAAAAAAA', recent_actions[:2] + _raw_actions(3, 5, start=recent))
+
+    # Ranges of rewritten segments are computed again
+    assert len(list(action_log.scan(since=old_actions[0]['date']))) == 15
+    assert action_log.compact() == 5 + 2
+    assert list(action_log.scan(since=recent)) == list(action_log.scan(
+        'AAAAAAAA', since=recent))
+    scanned = list(action_log.scan('AAAAAAAA'))
+    assert len(scanned) == 10
+    assert [action for action in scanned if action['id'].startswith('02')] == recent_actions
+    assert action_log.compact() == 0
+
+
+def test_maybe_compact(mocker, tmpdir):
+    """Asserts that compaction runs at most every COMPACT_INTERVAL seconds, across runs."""
+
+    clock = mocker.patch('time.time', return_value=1000000)
+    mocker.spy(unit.ActionLog, '_compact')
+
+    unit.ActionLog(tmpdir.join('log').strpath).maybe_compact()
+    clock.return_value = 1000000 + unit.COMPACT_INTERVAL - 1
+    unit.ActionLog(tmpdir.join('log').strpath).maybe_compact()
+    assert unit.ActionLog._compact.call_count == 1  # pylint: disable=E1101,W0212
+    clock.return_value = 1000000 + unit.COMPACT_INTERVAL
+    unit.ActionLog(tmpdir.join('log').strpath).maybe_compact()
+    assert unit.ActionLog._compact.call_count == 2  # pylint: disable=E1101,W0212
+
+    # Compaction dates in the future do not postpone compactions
+    clock.return_value = 1000000
+    unit.ActionLog(tmpdir.join('log').strpath).maybe_compact()
+    assert unit.ActionLog._compact.call_count == 3  # pylint: disable=E1101,W0212
+    tmpdir.join('log', 'compacted').write('')
+    unit.ActionLog(tmpdir.join('log').strpath).maybe_compact()
+    assert unit.ActionLog._compact.call_count == 4  # pylint: disable=E1101,W0212
+
+
+def test_range_scan(mocker, tmpdir):
+    """Asserts that scans by date skip closed segments out of range, once their range is known."""
+
+    action_log = unit.ActionLog(tmpdir.join('log').strpath, segment_size=256)
+    actions = _raw_actions(1, 20)
+    action_log.append('AAAAAAAA', actions)
+    segments = action_log.segments()
+    assert len(segments) > 3
+    assert list(action_log.scan(until='2017-01-03')) == actions[:2]
+    assert os.path.exists(tmpdir.join('log', '{:010d}.range'.format(segments[0])).strpath)
+
+    action_log = unit.ActionLog(tmpdir.join('log').strpath, segment_size=256)
+    index = mocker.spy(action_log, '_index')
+    assert list(action_log.scan(since='2017-01-19')) == actions[18:]
+    assert [call[0][0] for call in index.call_args_list] == [segments[-1]]
+    assert list(action_log.scan('AAAAAAAA', '2017-01-05', '2017-01-08')) == actions[4:7]
+    assert list(action_log.scan()) == actions
+
+
+def test_missing_index(tmpdir):
+    """Asserts that segments without an index, or an empty one, are skipped."""
+
+    action_log = unit.ActionLog(tmpdir.join('log').strpath)
+    actions = _raw_actions(1, 3)
+    action_log.append('AAAAAAAA', actions)
+    tmpdir.join('log', '0000000001.log').write('')
+    tmpdir.join('log', '0000000002.log').write('')
+    tmpdir.join('log', '0000000002.idx').write('')
+
+    assert list(action_log.scan()) == actions
+    assert action_log.get(actions[1]['id']) == actions[1]
+    assert action_log.get('ffffffffffffffffffffffff') is None
+    assert unit.ActionLog(tmpdir.join('log').strpath).append('AAAAAAAA', actions) == 3
+
+#  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
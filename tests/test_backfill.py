@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+"""triscord.backfill unit tests."""
+
+import json
+import os
+import sys
+import unittest.mock
+
+import arrow
+import pytest
+
+import triscord
+from triscord import backfill as unit
+
+from test_trello import _load_from_json
+
+FIXTURES_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'fixtures')
+CONFIG_PATH = os.path.join(FIXTURES_DIR, 'triscord.ini')
+
+
+def _mock_board_actions(mocker, actions):
+    """Mocks Trello's board actions endpoint, honouring since, before and limit."""
+
+    def side_effect(_, params):
+        """Lists the actions within the requested range, newest first."""
+
+        before = params['before']
+        # Action ids are 24 hexadecimal digits, dates are longer
+        if len(before) == 24:
+            before = next(action['date'] for action in actions if action['id'] == before)
+        page = [
+            action for action in actions
+            if arrow.get(params['since']) <= arrow.get(action['date']) < arrow.get(before)
+        ]
+        return unittest.mock.Mock(json=unittest.mock.Mock(return_value=page[:params['limit']]))
+
+    mocker.patch('triscord.trello.TrelloAPI.get', side_effect=side_effect)
+
+
+def _history():
+    """Returns raw actions spread over 2017, newest first."""
+
+    actions = []
+    for index, action in enumerate(_load_from_json('trello_api_actions.json')):
+        action = dict(action, date=arrow.get('2017-01-01').shift(days=index * 10).isoformat())
+        actions.insert(0, action)
+    return actions
+
+
+def test_time_slices():
+    """Asserts that time slices cover the whole range contiguously."""
+
+    since, until = arrow.get('2017-01-01'), arrow.get('2017-01-31')
+    slices = unit.time_slices(since, until, 3)
+
+    assert len(slices) == 3
+    assert slices[0][0] == since and slices[-1][1] == until
+    assert all(first[1] == second[0] for first, second in zip(slices, slices[1:]))
+
+
+def test_fetch_slice_paging(mocker):
+    """Asserts that slices are fetched page after page, and returned chronologically."""
+
+    actions = _history()
+    _mock_board_actions(mocker, actions)
+    feed = triscord.trello.TrelloActivityFeed(triscord.trello.TrelloAPI('a', 'b'), 'AAAAAAAA')
+
+    raw_actions = unit.fetch_slice(
+        feed, arrow.get('2016-01-01'), arrow.get('2019-01-01'), page_size=3)
+
+    assert raw_actions == list(reversed(actions))
+    get = triscord.trello.TrelloAPI.get  # pylint: disable=E1101
+    assert get.call_count == len(actions) // 3 + 1  # pylint: disable=E1101
+
+
+def test_fetch_history(mocker):
+    """Asserts that concurrently fetched slices are merged chronologically."""
+
+    actions = _history()
+    _mock_board_actions(mocker, actions)
+    feed = triscord.trello.TrelloActivityFeed(triscord.trello.TrelloAPI('a', 'b'), 'AAAAAAAA')
+
+    raw_actions = list(unit.fetch_history(
+        feed, arrow.get('2016-12-01'), arrow.get('2018-01-01'), slices=4))
+
+    assert raw_actions == list(reversed(actions))
+
+
+def test_backfill_command(mocker, tmpdir, capsys):
+    """Asserts that the backfill command renders a date range into a file."""
+
+    actions = _history()
+    _mock_board_actions(mocker, actions)
+    output_path = tmpdir.join('messages.jsonl').strpath
+    mocker.patch('triscord.LOGGER')
+    mocker.patch.object(sys, 'argv', [
+        'triscord', '--config-path', CONFIG_PATH,
+        'backfill', '--since', '2017-01-01', '--until', '2017-03-01', '--output', output_path,
+    ])
+
+    triscord.entry_point()
+
+    with open(output_path, 'r') as output_file:
+        lines = [json.loads(line) for line in output_file]
+    assert lines
+    assert all(arrow.get(line['date']) < arrow.get('2017-03-01') for line in lines)
+    assert "into {} messages".format(len(lines)) in capsys.readouterr().err
+
+
+def test_backfill_delivery(mocker, tmpdir):
+    """Asserts that backfilled messages are sent chronologically to the board's webhook.
+
+    Webhooks share the configured rate limit state with running synchronisations.
+    """
+
+    actions = _history()
+    _mock_board_actions(mocker, actions)
+    mocker.patch('triscord.discord.DiscordWebhook.send_message', autospec=True)
+    mocker.patch('logging.getLogger')
+    config_file = tmpdir.join('triscord.ini')
+    with open(CONFIG_PATH) as fixture_file:
+        config_file.write(fixture_file.read() + "rate_state_path = {}\n".format(
+            tmpdir.join('ratelimit').strpath))
+
+    actions_count, messages_count = unit.main(
+        config_file.strpath, since='2016-01-01', until='2019-01-01', slices=3, debug=True)
+
+    send_message = triscord.discord.DiscordWebhook.send_message  # pylint: disable=E1101
+    assert send_message.call_count == messages_count  # pylint: disable=E1101
+    assert 0 < messages_count <= actions_count
+    webhook = send_message.call_args[0][0]  # pylint: disable=E1101
+    assert webhook.bucket_state.file_path == tmpdir.join('ratelimit').strpath
+    with pytest.raises(triscord.settings.InvalidSettings):
+        unit.main(CONFIG_PATH, since='2019-01-01', until='2016-01-01')
+    with pytest.raises(triscord.settings.InvalidSettings):
+        unit.main(CONFIG_PATH, since='2016-01-01', until='2019-01-01', slices=0)
+
+#  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
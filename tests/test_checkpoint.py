@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+"""triscord.checkpoint unit tests."""
+
+import arrow
+
+import triscord.checkpoint as unit
+import triscord.persistence as persistence
+import triscord.trello as trello
+
+
+def _actions(count):
+    """Returns count chronologically ordered actions."""
+
+    return [
+        trello.Action(
+            id='{:024d}'.format(index),
+            date='2017-01-01T00:00:{:02d}+00:00'.format(index),
+        )
+        for index in range(count)
+    ]
+
+
+def test_watermark():
+    """Asserts that the watermark only moves past contiguously delivered actions."""
+
+    actions = _actions(3)
+    watermark = unit.Watermark(reversed(actions))
+    assert watermark.position is None
+
+    assert not watermark.ack(actions[1])
+    assert watermark.position is None
+    assert watermark.delivered_ahead == frozenset([actions[1].id])
+
+    assert watermark.ack(actions[0])
+    assert watermark.position is actions[1]
+    assert watermark.delivered_ahead == frozenset()
+    assert not watermark.complete
+
+    assert watermark.ack(actions[2])
+    assert watermark.complete
+
+
+def test_advance_cursor():
+    """Asserts that cursors follow the watermark, jumping past all actions once complete."""
+
+    actions = _actions(3)
+    initial = unit.Cursor(arrow.get('2016-01-01T00:00:00+00:00'), None, frozenset())
+    fetched = unit.Cursor(arrow.get('2018-01-01T00:00:00+00:00'), actions[2].id, frozenset())
+    watermark = unit.Watermark(actions)
+
+    watermark.ack(actions[2])
+    assert unit.advance_cursor(initial, fetched, watermark) == \
+        initial._replace(delivered=frozenset([actions[2].id]))
+    watermark.ack(actions[0])
+    assert unit.advance_cursor(initial, fetched, watermark) == unit.Cursor(
+        arrow.get(actions[0].date), actions[0].id, frozenset([actions[2].id]))
+    watermark.ack(actions[1])
+    assert unit.advance_cursor(initial, fetched, watermark) == fetched
+
+
+def test_checkpointer(mocker, tmpdir_factory):
+    """Asserts that cursors are group-committed and loaded back."""
+
+    clock = [0]
+    mocker.patch('time.monotonic', side_effect=lambda: clock[0])
+    persist_path = str(tmpdir_factory.mktemp('data').join('database.pickle3'))
+    with persistence.persistent_storage(persist_path) as storage:
+        storage['last_update'] = '2016-01-01T00:00:00+00:00'
+    checkpointer = unit.Checkpointer(persist_path, every=2, interval=10)
+    cursor = unit.Cursor(arrow.get('2017-01-01T00:00:00+00:00'), 'a' * 24, frozenset(['b' * 24]))
+
+    checkpointer.advance('AAAAAAAA', cursor)
+    assert checkpointer.load(['AAAAAAAA'])['AAAAAAAA'] == \
+        unit.Cursor(arrow.get('2016-01-01T00:00:00+00:00'), None, frozenset())
+    clock[0] = 10
+    checkpointer.advance('AAAAAAAA', cursor)
+    assert checkpointer.load(['AAAAAAAA'])['AAAAAAAA'] == cursor
+    checkpointer.advance('BBBBBBBB', cursor._replace(delivered=frozenset()))
+    checkpointer.advance('BBBBBBBB', cursor._replace(delivered=frozenset()))
+    assert checkpointer.load(['BBBBBBBB'])['BBBBBBBB'].delivered == frozenset()
+
+    # Without pending cursors, flushing leaves the persistence file alone
+    mocker.spy(persistence, 'persistent_storage')
+    checkpointer.flush()
+    assert not persistence.persistent_storage.called  # pylint: disable=E1101
+
+#  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+"""triscord.coalesce unit tests."""
+
+import arrow
+
+from triscord import coalesce as unit
+from triscord import trello
+
+START = arrow.get('2017-12-04T11:00:00.000Z')
+
+
+def _update(seconds, field, new_value, card_id='card', **fields):
+    return trello.Action(
+        id='update-{}'.format(seconds),
+        type='updateCard',
+        date=START.shift(seconds=seconds).isoformat(),
+        card_id=card_id,
+        old=(field, ),
+        new={field: new_value},
+        **fields
+    )
+
+
+def _member(seconds, action_type, member_id='member'):
+    return trello.Action(
+        id='member-{}'.format(seconds),
+        type=action_type,
+        date=START.shift(seconds=seconds).isoformat(),
+        card_id='card',
+        member_id=member_id,
+    )
+
+
+def _comment(seconds):
+    return trello.Action(
+        id='comment-{}'.format(seconds),
+        type='commentCard',
+        date=START.shift(seconds=seconds).isoformat(),
+        card_id='card',
+    )
+
+
+def test_coalesce_disabled():
+    """Asserts that a null window leaves actions untouched."""
+
+    actions = [_update(0, 'name', 'b'), _update(1, 'name', 'c')]
+    assert unit.coalesce_actions(actions, 0) == actions
+
+
+def test_coalesce_updates():
+    """Asserts that rapid updates of a card field are merged into their final value."""
+
+    actions = [
+        _update(0, 'name', 'b'),
+        _comment(5),
+        _update(10, 'desc', 'y'),
+        _update(20, 'name', 'c'),
+        _update(30, 'name', 'd'),
+        _update(30, 'name', 'w', card_id='other_card'),
+    ]
+    coalesced = unit.coalesce_actions(actions, 60)
+
+    assert [action.id for action in coalesced] == [
+        'comment-5', 'update-10', 'update-30', 'update-30',
+    ]
+    merged = coalesced[2]
+    assert merged.old == ('name', )
+    assert merged.new == {'name': 'd'}
+    assert coalesced[3].card_id == 'other_card'
+
+
+def test_coalesce_window():
+    """Asserts that chains are split when successive updates are further than the window."""
+
+    actions = [
+        _update(0, 'name', 'b'),
+        _update(50, 'name', 'c'),
+        _update(200, 'name', 'd'),
+    ]
+    coalesced = unit.coalesce_actions(actions, 60)
+
+    assert [action.new['name'] for action in coalesced] == ['c', 'd']
+
+
+def test_coalesce_list_moves():
+    """Asserts that merged list moves keep their original list."""
+
+    actions = [
+        _update(0, 'idList', 'list_b', list_before='A', list_after='B'),
+        _update(5, 'idList', 'list_c', list_before='B', list_after='C'),
+    ]
+
+    coalesced, = unit.coalesce_actions(actions, 60)
+    assert coalesced.list_before == 'A'
+    assert coalesced.list_after == 'C'
+    assert actions[1].list_before == 'B'
+
+
+def test_coalesce_member_flipflop():
+    """Asserts that member add/remove flip-flops are reduced to their net effect."""
+
+    actions = [
+        _member(0, 'addMemberToCard'),
+        _member(10, 'removeMemberFromCard'),
+        _member(10, 'addMemberToCard', member_id='other_member'),
+    ]
+    coalesced = unit.coalesce_actions(actions, 60)
+    assert coalesced == [actions[2]]
+
+    actions.append(_member(20, 'addMemberToCard'))
+    coalesced = unit.coalesce_actions(actions, 60)
+    assert coalesced == [actions[2], actions[3]]
+
+
+def test_coalesce_streaming():
+    """Asserts that chains are yielded as soon as they are out of the window, in order."""
+
+    read = []
+
+    def actions():
+        for action in [
+                _update(0, 'name', 'b'),
+                _comment(10),
+                _update(20, 'name', 'c'),
+                _update(200, 'name', 'd'),
+                _update(210, 'desc', 'y'),
+                _update(400, 'name', 'e'),
+        ]:
+            read.append(action.id)
+            yield action
+
+    coalesced = unit.iter_coalesced(actions(), 60)
+
+    assert next(coalesced).id == 'comment-10'
+    assert read == ['update-0', 'comment-10', 'update-20']
+    assert next(coalesced).new == {'name': 'c'}
+    assert read[-1] == 'update-200'
+    assert next(coalesced).id == 'update-200'
+    assert read[-1] == 'update-400'
+    assert [action.id for action in coalesced] == ['update-210', 'update-400']
+
+
+#  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+"""triscord.dates unit tests."""
+
+import datetime
+
+import arrow
+import pytest
+
+import triscord.dates as unit
+
+
+@pytest.mark.parametrize('text', [
+    '2017-03-22T17:36:08.366Z',
+    '2017-03-22T17:36:08Z',
+    '2017-03-22T17:36:08.366000+00:00',
+    '2017-03-22T17:36:08-03:30',
+    '2017-03-22T17:36+0200',
+    '2017-03-22T17:36:08',
+    '2017-03-22',
+])
+def test_parse(text):
+    """Asserts that ISO 8601 dates are parsed as arrow does."""
+
+    date = unit.parse(text)
+    assert date.tzinfo is not None
+    assert date == arrow.get(text)
+
+
+def test_parse_fallback():
+    """Asserts that dates outside of the fast path, datetimes and arrow dates are supported."""
+
+    assert unit.parse('2017-W12-3') == arrow.get('2017-W12-3')
+    assert unit.parse(arrow.get('2017-01-01')) == arrow.get('2017-01-01')
+    assert unit.parse(datetime.datetime(2017, 1, 1)) == arrow.get('2017-01-01')
+    assert unit.timestamp('1970-01-01T00:01:00Z') == 60
+
+
+def test_now():
+    """Asserts that the current date is timezone-aware."""
+
+    assert abs((unit.now() - arrow.utcnow()).total_seconds()) < 60
+
+#  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+"""triscord.digest unit tests."""
+
+from triscord import digest as unit
+from triscord import trello
+
+from test_trello import _load_from_json
+
+
+def _load_actions():
+    actions = _load_from_json('trello_api_actions.json')
+    actions.reverse()
+    return [trello.Action.from_json(action) for action in actions]
+
+
+def test_digest_counts():
+    """Asserts that digests count actions per type, card, list and member."""
+
+    actions = _load_actions()
+    messages = unit.digest_messages(actions, top_items=100)
+    content = "\n".join(messages)
+
+    assert "{} actions".format(len(actions)) in content
+    assert actions[0].date in content
+    assert actions[-1].date in content
+    update_count = len([action for action in actions if action.type == 'updateCard'])
+    assert "- `updateCard`: {}".format(update_count) in content
+    for action in actions:
+        assert action.creator in content
+        if action.card_name is not None:
+            assert action.card_name in content
+
+
+def test_digest_top_items():
+    """Asserts that digests only list the most active entries of each category."""
+
+    actions = _load_actions()
+    card_action = next(action for action in actions if action.card_name is not None)
+    actions = actions + [card_action] * 10
+    content = "\n".join(unit.digest_messages(actions, top_items=1))
+
+    assert content.count("- `") == 4
+    assert "`{}`: 1".format(card_action.card_name) in content
+    assert "more" in content
+
+
+def test_digest_backlog_size():
+    """Asserts that large backlogs fit in a handful of messages within Discord's limit."""
+
+    actions = _load_actions() * 200
+    messages = unit.digest_messages(actions, top_items=10, max_length=300)
+
+    assert len(actions) > 2000
+    assert len(messages) < 10
+    assert all(len(message) <= 300 for message in messages)
+
+
+#  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
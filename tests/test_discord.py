@@ -14,6 +14,7 @@ import requests
 from dateutil import tz as dateutil_tz
 
 from triscord import discord as unit
+from triscord import ratelimit
 
 
 @pytest.fixture()
@@ -37,6 +38,12 @@ class TimeMock(object):
 
         self.mocker.patch('time.sleep', side_effect=self.sleep)
         self.mocker.patch('arrow.now', side_effect=self.arrow_now)
+        self.mocker.patch('time.time', side_effect=self.time)
+
+    def time(self):
+        """Mocks time.time()."""
+
+        return self.mocked_timestamp
 
     def arrow_now(self, tzinfo=None):
         """Mocks arrow.now()."""
@@ -65,16 +72,18 @@ def time_mock(mocker):
 def test_webhook_message_sending(mocker, webhook):  # pylint: disable=W0621
     """Asserts that DiscordWebhook properly formats messages to DiscordApp's API."""
 
-    mocker.patch('requests.post')
+    mocker.patch('requests.Session.request', return_value=_generate_response(mocker))
 
     message = "test_webhook_message_sending"
 
     webhook.send_message(message)
 
-    requests.post.assert_called_with(  # pylint:disable=E1101
+    requests.Session.request.assert_called_with(  # pylint:disable=E1101
+        'post',
         ANY,
         data={'content': message},
         params=ANY,
+        timeout=ANY,
     )
 
 
@@ -113,7 +122,7 @@ def _generate_response(mocker, remaining=3, retry_after=1000):
 def test_webhook_ratelimit(mocker, webhook):  # pylint: disable=W0621
     """Asserts that DiscordWebhook supports rate limited requests."""
 
-    mocker.patch('requests.post', side_effect=_side_effects_gen(
+    mocker.patch('requests.Session.request', side_effect=_side_effects_gen(
         (
             (_generate_response, (mocker,), {'remaining': 0}),
             (_generate_response, (mocker,), {'remaining': 3}),
@@ -124,7 +133,7 @@ def test_webhook_ratelimit(mocker, webhook):  # pylint: disable=W0621
 
     webhook.send_message(message)
 
-    assert requests.post.call_count == 2  # pylint:disable=E1101
+    assert requests.Session.request.call_count == 2  # pylint:disable=E1101
 
 
 class _DelayViolation(Exception):
@@ -152,7 +161,7 @@ def _generate_delaylimited_response(mocker, retry_after=3000, reinitialize=False
 def test_webhook_retrydelay(mocker, webhook):  # pylint: disable=W0621
     """Asserts that DiscordWebhook is a good internet citizen and respects Retry-After delay."""
 
-    mocker.patch('requests.post', side_effect=_side_effects_gen(
+    mocker.patch('requests.Session.request', side_effect=_side_effects_gen(
         (
             (_generate_delaylimited_response, (mocker,), {'retry_after': 3000,
                                                           'reinitialize': True}),
@@ -165,7 +174,7 @@ def test_webhook_retrydelay(mocker, webhook):  # pylint: disable=W0621
 
     webhook.send_message(message)
 
-    assert requests.post.call_count == 3  # pylint:disable=E1101
+    assert requests.Session.request.call_count == 3  # pylint:disable=E1101
 
 
 class _ResetViolation(Exception):
@@ -194,7 +203,7 @@ def _generate_resetlimited_response(mocker, retry_after=3000, reinitialize=False
 def test_webhook_buffering(mocker, webhook):  # pylint: disable=W0621
     """Asserts that DiscordWebhook waits for the next X-RateLimit-Reset interval."""
 
-    mocker.patch('requests.post', side_effect=_side_effects_gen(
+    mocker.patch('requests.Session.request', side_effect=_side_effects_gen(
         (
             (_generate_resetlimited_response, (mocker,), {'retry_after': 3000,
                                                           'reinitialize': True}),
@@ -215,8 +224,8 @@ def test_webhook_buffering(mocker, webhook):  # pylint: disable=W0621
     # Second call: will trigger blocking call
     webhook.send_message(message + "_2")
 
-    assert requests.post.call_count == 2  # pylint:disable=E1101
-    requests.post.reset_mock()  # pylint:disable=E1101
+    assert requests.Session.request.call_count == 2  # pylint:disable=E1101
+    requests.Session.request.reset_mock()  # pylint:disable=E1101
 
     # Third call: will go through but will be the last allowed request until reset is reached.
     webhook.send_message(message + "_3")
@@ -225,7 +234,110 @@ def test_webhook_buffering(mocker, webhook):  # pylint: disable=W0621
     time.sleep(5)
     webhook.send_message(message + "_4")
 
-    assert requests.post.call_count == 2  # pylint:disable=E1101
+    assert requests.Session.request.call_count == 2  # pylint:disable=E1101
+
+
+@pytest.mark.usefixtures("time_mock")
+def test_webhook_shared_bucket(mocker, webhook, tmpdir):  # pylint: disable=W0621
+    """Asserts that DiscordWebhook waits for a bucket exhausted by another process."""
+
+    bucket_state = ratelimit.SharedBucketState(tmpdir.join('ratelimit').strpath)
+    webhook.bucket_state = bucket_state
+    other_webhook = unit.DiscordWebhook(url=webhook.url, bucket_state=bucket_state)
+
+    mocker.patch('requests.Session.request', side_effect=_side_effects_gen(
+        (
+            (_generate_resetlimited_response, (mocker,), {'retry_after': 3000,
+                                                          'reinitialize': True}),
+            (_generate_resetlimited_response, (mocker,), {'retry_after': 1000,
+                                                          'remaining': 5}),
+        ),
+    ))
+    mocker.spy(bucket_state, 'reserve')
+
+    # Exhausts the shared bucket, as if posted by another process
+    other_webhook.send_message("test_webhook_shared_bucket_1")
+    assert not webhook.rate_exhausted
+
+    webhook.send_message("test_webhook_shared_bucket_2")
+
+    assert requests.Session.request.call_count == 2  # pylint:disable=E1101
+    assert bucket_state.reserve.call_count == 3  # pylint:disable=E1101
+
+
+@pytest.mark.usefixtures("time_mock")
+def test_webhook_shared_retrydelay(mocker, webhook, tmpdir):  # pylint: disable=W0621
+    """Asserts that Retry-After delays are recorded into the shared bucket state."""
+
+    bucket_state = ratelimit.SharedBucketState(tmpdir.join('ratelimit').strpath)
+    webhook.bucket_state = bucket_state
+    mocker.patch('requests.Session.request', side_effect=_side_effects_gen(
+        (
+            (_generate_delaylimited_response, (mocker,), {'retry_after': 3000,
+                                                          'reinitialize': True}),
+            (_generate_response, (mocker,), {}),
+        ),
+    ))
+    mocker.spy(bucket_state, 'update')
+
+    webhook.send_message("test_webhook_shared_retrydelay")
+
+    assert requests.Session.request.call_count == 2  # pylint:disable=E1101
+    assert bucket_state.update.call_args_list[0] == (  # pylint:disable=E1101
+        (webhook.url, 0, ANY), {})
+
+
+def test_webhook_pool(mocker):
+    """Asserts that pooled webhooks are used in turn, preferring those with most budget."""
+
+    pool = unit.open_webhook(
+        "https://dummy.tld/api/webhooks/0/a, https://dummy.tld/api/webhooks/1/b")
+    first, second = pool.webhooks
+    mocker.patch('requests.Session.request', return_value=_generate_response(mocker, remaining=3))
+
+    assert pool.pick() is first
+    assert pool.pick() is second
+    assert pool.pick() is first
+
+    pool.send_message("test_webhook_pool")
+    assert second.remaining == 2
+    assert pool.pick() is first
+    assert pool.pick() is first
+
+    first.remaining = 1
+    first.rate_exhausted = True
+    first.next_reset = arrow.now().timestamp + 10
+    assert pool.pick() is second
+
+    transport = mocker.Mock()
+    pool.transport = transport
+    assert first.transport is transport and second.transport is transport
+    assert pool.transport is transport
+
+    bucket_state = mocker.Mock()
+    pool.bucket_state = bucket_state
+    assert first.bucket_state is bucket_state and second.bucket_state is bucket_state
+    assert pool.bucket_state is bucket_state
+    assert isinstance(unit.open_webhook("https://dummy.tld/api/webhooks/0/a"), unit.DiscordWebhook)
+
+
+def test_webhook_message_editing(mocker):
+    """Asserts that messages are edited through the webhook which sent them."""
+
+    pool = unit.open_webhook(
+        "https://dummy.tld/api/webhooks/0/a, https://dummy.tld/api/webhooks/1/b")
+    mocker.patch('requests.Session.request', return_value=_generate_response(mocker))
+
+    assert pool.webhook_ids == ('0', '1')
+    pool.edit_message('1', '42', "test_webhook_message_editing")
+
+    requests.Session.request.assert_called_with(  # pylint:disable=E1101
+        'patch',
+        "https://dummy.tld/api/webhooks/1/b/messages/42",
+        json={'content': "test_webhook_message_editing"},
+        timeout=ANY,
+    )
+    assert pool.webhooks[0].remaining is None and pool.webhooks[1].remaining is not None
 
 
 #  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+"""triscord.fairness unit tests."""
+
+import pytest
+
+from triscord import fairness as unit
+from triscord import outbox
+
+
+def _scheduler(backlogs, **boards):
+    """Returns a FairScheduler of boards with given backlogs, and keyword arguments."""
+
+    scheduler = unit.FairScheduler()
+    for board_id, backlog in backlogs:
+        queue = scheduler.add_board(board_id, outbox.Outbox(), **boards.get(board_id, dict()))
+        for index in range(backlog):
+            queue.push((board_id, index), 'createCard')
+    return scheduler
+
+
+def _drain(scheduler):
+    items = []
+    while scheduler:
+        items.append(scheduler.pop())
+    return items
+
+
+def test_round_robin():
+    """Asserts that boards take turns, so that a large backlog does not starve others."""
+
+    scheduler = _scheduler([('noisy', 100), ('quiet', 2)])
+    assert len(scheduler) == 102
+    assert [board_id for board_id, _ in _drain(scheduler)[:5]] == [
+        'noisy', 'quiet', 'noisy', 'quiet', 'noisy',
+    ]
+    with pytest.raises(IndexError):
+        scheduler.pop()
+
+
+def test_weights():
+    """Asserts that boards get deliveries in proportion of their weights."""
+
+    scheduler = _scheduler([('A', 30), ('B', 30), ('C', 30)],
+                           A=dict(weight=2), C=dict(weight=0.5))
+    delivered = [board_id for board_id, _ in _drain(scheduler)[:35]]
+    assert [delivered.count(board_id) for board_id in 'ABC'] == [20, 10, 5]
+
+
+def test_priorities():
+    """Asserts that boards holding important items go first within a round."""
+
+    scheduler = _scheduler([('A', 1)])
+    scheduler.add_board('B', outbox.Outbox()).push(('B', 0), 'digest')
+    assert _drain(scheduler) == [('B', 0), ('A', 0)]
+
+
+def test_budgets():
+    """Asserts that boards stop being scheduled once their budget is delivered."""
+
+    scheduler = _scheduler([('noisy', 10), ('quiet', 4)], noisy=dict(budget=3))
+    delivered = [board_id for board_id, _ in _drain(scheduler)]
+    assert delivered == ['noisy', 'quiet'] * 3 + ['quiet']
+    assert scheduler.depths() == {'noisy': 7, 'quiet': 0}
+    assert scheduler.delivered == {'noisy': 3, 'quiet': 4}
+
+#  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
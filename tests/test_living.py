@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+"""triscord.living unit tests."""
+
+import pytest
+import requests
+
+import triscord.living as unit
+import triscord.trello as trello
+
+
+def _webhook(mocker):
+    """Returns a mocked webhook, answering with Discord's message objects."""
+
+    message_ids = iter(range(1, 100))
+    return mocker.Mock(
+        webhook_ids=('0', ),
+        send_message=mocker.Mock(side_effect=lambda message: {
+            'id': str(next(message_ids)), 'webhook_id': '0', 'content': message,
+        }),
+        edit_message=mocker.Mock(side_effect=lambda webhook_id, message_id, message: {
+            'id': message_id, 'webhook_id': webhook_id, 'content': message,
+        }),
+    )
+
+
+def _action(card_id):
+    return trello.Action(type='updateCard', card_id=card_id)
+
+
+def test_deliver(mocker, tmpdir):
+    """Asserts that a card's messages edit its living message within the window."""
+
+    mocker.patch('time.time', return_value=1000)
+    persist_path = tmpdir.join('database').strpath
+    webhook = _webhook(mocker)
+    messages = unit.LivingMessages(persist_path, window=60, max_length=20)
+
+    messages.deliver(webhook, 'AAAAAAAA', "first", [_action('C1')])
+    messages.deliver(webhook, 'AAAAAAAA', "other", [_action('C2')])
+    messages.deliver(webhook, 'AAAAAAAA', "digest", [_action('C1'), _action('C2')])
+    response = messages.deliver(webhook, 'AAAAAAAA', "second", [_action('C1')])
+    assert response == {'id': '1', 'webhook_id': '0', 'content': "first\nsecond"}
+    messages.flush()
+
+    messages = unit.LivingMessages(persist_path, window=60, max_length=20)
+    messages.deliver(webhook, 'AAAAAAAA', "third", [_action('C1')])
+    webhook.edit_message.assert_called_with('0', '1', "first\nsecond\nthird")
+    messages.deliver(webhook, 'AAAAAAAA', "too long now", [_action('C1')])
+    assert webhook.send_message.call_count == 4
+
+    mocker.patch('time.time', return_value=1061)
+    messages.deliver(webhook, 'AAAAAAAA', "expired", [_action('C2')])
+    assert webhook.send_message.call_count == 5
+    assert webhook.edit_message.call_count == 2
+
+    mocker.patch('time.time', return_value=1200)
+    messages.flush()
+    messages = unit.LivingMessages(persist_path, window=60)
+    assert not messages._messages('AAAAAAAA')  # pylint: disable=W0212
+
+
+def test_deliver_deleted(mocker, tmpdir):
+    """Asserts that messages are posted anew when their living message was deleted.
+
+    Other editing failures are raised.
+    """
+
+    webhook = _webhook(mocker)
+    webhook.edit_message.side_effect = requests.exceptions.HTTPError(
+        response=mocker.Mock(status_code=404))
+    messages = unit.LivingMessages(tmpdir.join('database').strpath, window=60)
+
+    messages.deliver(webhook, 'AAAAAAAA', "first", [_action('C1')])
+    messages.deliver(webhook, 'AAAAAAAA', "second", [_action('C1')])
+    messages.deliver(webhook, 'AAAAAAAA', "third", [_action('C1')])
+    assert webhook.send_message.call_count == 3
+    assert webhook.edit_message.call_count == 2
+
+    webhook.edit_message.side_effect = requests.exceptions.HTTPError(
+        response=mocker.Mock(status_code=500))
+    with pytest.raises(requests.exceptions.HTTPError):
+        messages.deliver(webhook, 'AAAAAAAA', "fourth", [_action('C1')])
+    assert webhook.send_message.call_count == 3
+
+    assert unit.LivingMessages(tmpdir.join('disabled').strpath).deliver(
+        webhook, 'AAAAAAAA', "disabled", [_action('C1')])['id'] == '4'
+
+#  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+
+"""Memory budget regression tests over large backlogs.
+
+Each pipeline stage runs over a synthetic backlog under tracemalloc, and its peak allocation
+must stay within a per-action budget: a change making a stage hold more of the backlog at
+once fails here rather than getting the bot OOM-killed after an outage.
+"""
+
+import collections
+import contextlib
+import copy
+import http.server
+import json
+import threading
+import tracemalloc
+import urllib.parse
+
+import arrow
+import pytest
+import requests
+
+import triscord
+from triscord import ratelimit
+from triscord import replay
+from triscord import settings
+from triscord import trello
+
+from test_trello import _load_from_json
+
+# Peak allocation budgets, in bytes per backlog action: measured peaks plus about 15%
+FETCH_BUDGET = 5100
+FILTER_BUDGET = 360
+FORMAT_BUDGET = 125
+SEND_BUDGET = 550
+
+BACKLOG_SIZES = (10000, 100000)
+
+
+def _backlog(size):
+    """Returns a synthetic raw actions list, newest first, cycling through fixture actions."""
+
+    templates = [
+        action for action in _load_from_json('trello_api_actions.json')
+        if action['type'] in ('commentCard', 'createCard', 'updateCheckItemStateOnCard',
+                              'updateCard')
+    ]
+    start = arrow.get('2017-01-01')
+    actions = []
+    for index in range(size, 0, -1):
+        action = copy.deepcopy(templates[index % len(templates)])
+        action['id'] = '{:024x}'.format(index)
+        action['date'] = start.shift(seconds=index).isoformat()
+        action['data']['card']['id'] = '{:024x}'.format(index % 997)
+        action['data']['card']['name'] = 'Card {}'.format(index % 997)
+        actions.append(action)
+    return actions
+
+
+def _peak(func):
+    """Runs func under tracemalloc, returning its result and peak traced allocation."""
+
+    tracemalloc.start()
+    try:
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak
+
+
+@contextlib.contextmanager
+def _stub_trello(raw_actions):
+    """Serves raw actions by pages on a local port, yielding the stub's API base URL.
+
+    Pages are encoded beforehand, so that serving them allocates next to nothing.
+    """
+
+    pages = dict()
+    before = None
+    for index in range(0, len(raw_actions) + 1, trello.PAGE_SIZE):
+        page = raw_actions[index:index + trello.PAGE_SIZE]
+        pages[before] = json.dumps(page).encode('utf-8')
+        before = page[-1]['id'] if page else None
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        """Answers actions requests with the page preceding their `before` parameter."""
+
+        def do_GET(self):  # pylint: disable=C0103
+            """Sends a page of the backlog."""
+
+            query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+            body = pages[query.get('before', [None])[0]]
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *_):  # pylint: disable=W0221
+            """Keeps the tests output quiet."""
+
+    server = http.server.HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        yield 'http://127.0.0.1:{}/1'.format(server.server_address[1])
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+@pytest.fixture(scope="module", params=BACKLOG_SIZES)
+def backlog(request):
+    """Returns a synthetic backlog of each tested size."""
+
+    return _backlog(request.param)
+
+
+def test_fetch_budget():
+    """Asserts that fetching a backlog from Trello stays within its memory budget.
+
+    Only the smaller backlog is fetched, JSON decoding being slow under tracemalloc.
+    """
+
+    size = BACKLOG_SIZES[0]
+    with _stub_trello(_backlog(size)) as base_url:
+        api = trello.TrelloAPI(
+            key='aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa',
+            token='aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa',
+            base_url=base_url,
+            limiter=ratelimit.SlidingWindowLimiter(10),
+        )
+        feed = trello.TrelloActivityFeed(api, 'AAAAAAAA')
+        raw_actions, peak = _peak(feed.fetch_actions)
+
+    assert len(raw_actions) == size
+    assert peak <= FETCH_BUDGET * size
+
+
+def test_filter_budget(backlog):  # pylint: disable=W0621
+    """Asserts that parsing and filtering a backlog stays within its memory budget."""
+
+    feed = trello.TrelloActivityFeed(None, 'AAAAAAAA')
+    raw_actions = list(backlog)
+    actions, peak = _peak(lambda: list(feed.process_actions(raw_actions)))
+
+    assert len(actions) == len(backlog)
+    assert peak <= FILTER_BUDGET * len(backlog)
+
+
+def test_format_budget(backlog):  # pylint: disable=W0621
+    """Asserts that formatting a backlog's actions stays within its memory budget."""
+
+    feed = trello.TrelloActivityFeed(None, 'AAAAAAAA')
+    actions = list(feed.process_actions(list(backlog)))
+    messages, peak = _peak(lambda: [feed.format_action(action) for action in actions])
+
+    assert len(messages) == len(actions)
+    assert peak <= FORMAT_BUDGET * len(backlog)
+
+
+def test_send_budget(mocker, tmpdir):
+    """Asserts that a synchronisation cycle over a backlog stays within its memory budget.
+
+    The cycle fetches the backlog from a Trello stub, then queues and posts every action's
+    message through a webhook whose HTTP requests are stubbed. Tracing restarts once actions
+    are fetched, fetching having its own budget, so that only what queueing and delivering
+    allocate on top of fetched actions counts.
+    """
+
+    size = BACKLOG_SIZES[0]
+    raw_actions = _backlog(size)
+    messages = [
+        message for _, message in replay.render(
+            trello.TrelloActivityFeed(None, 'AAAAAAAA'), reversed(raw_actions))
+        if message
+    ]
+    config_file = tmpdir.join('triscord.ini')
+    config_file.write(
+        "[Trello]\n"
+        "board_id = AAAAAAAA\n"
+        "key = aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa\n"
+        "token = aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa\n"
+        "\n"
+        "[Discord]\n"
+        "webhook_url = https://dummy.tld/api/webhooks/0/a\n"
+        "digest_threshold = 0\n"
+        "coalesce_window = 0\n"
+    )
+    response = requests.Response()
+    response.status_code = 200
+    response._content = b'{"id": "1", "webhook_id": "0"}'  # pylint: disable=W0212
+    posted = collections.Counter()
+
+    session_request = requests.Session.request
+
+    def request(session, method, url, **kwargs):
+        """Acknowledges a posted message, without recording the call as a mock would."""
+
+        if method != 'post':
+            return session_request(session, method, url, **kwargs)
+        posted[url] += 1
+        return response
+
+    mocker.patch('requests.Session.request', new=request)
+
+    synchronizer = triscord.Synchronizer(tmpdir.join('database.pickle3').strpath)
+    synchronizer.configure(settings.load(config_file.strpath))
+    feed = synchronizer.feeds['AAAAAAAA']
+    feed.last_update = arrow.get('2016-01-01')
+    fetch = synchronizer._fetch  # pylint: disable=W0212
+
+    def fetch_then_trace(feeds):
+        """Fetches feeds' actions, then restarts tracing."""
+
+        feeds_actions = fetch(feeds)
+        tracemalloc.stop()
+        tracemalloc.start()
+        return feeds_actions
+
+    mocker.patch.object(synchronizer, '_fetch', side_effect=fetch_then_trace)
+    with _stub_trello(raw_actions) as base_url:
+        synchronizer.api.base_url = base_url
+        synchronizer.api.limiter = ratelimit.SlidingWindowLimiter(10)
+        _, peak = _peak(synchronizer.run_cycle)
+
+    assert posted == {'https://dummy.tld/api/webhooks/0/a': len(messages)}
+    assert feed.last_action_id == '{:024x}'.format(size)
+    assert peak <= SEND_BUDGET * size
+
+#  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+"""triscord.metrics unit tests."""
+
+import arrow
+
+import triscord.metrics as unit
+import triscord.trello as trello
+
+
+def test_percentile():
+    """Asserts that percentiles use the nearest rank."""
+
+    values = list(range(1, 101))
+    assert unit.percentile(values, 50) == 50
+    assert unit.percentile(values, 99) == 99
+    assert unit.percentile([7], 90) == 7
+
+
+def test_acknowledged_at(mocker):
+    """Asserts that Discord's message timestamp is preferred over the current time."""
+
+    assert unit.acknowledged_at({'timestamp': '2017-01-01T00:00:10+00:00'}) \
+        == arrow.get('2017-01-01T00:00:10+00:00')
+    assert unit.acknowledged_at({
+        'timestamp': '2017-01-01T00:00:10+00:00',
+        'edited_timestamp': '2017-01-01T00:01:00+00:00',
+    }) == arrow.get('2017-01-01T00:01:00+00:00')
+    mocker.patch('triscord.dates.now', return_value=arrow.get('2018-01-01T00:00:00+00:00'))
+    assert unit.acknowledged_at(None) == arrow.get('2018-01-01T00:00:00+00:00')
+
+
+def test_lag_tracker(mocker):
+    """Asserts that lags are tracked per board and action type, warning over the SLO."""
+
+    mocker.patch('logging.warning')
+    tracker = unit.LagTracker(slo=30, window=10)
+    actions = [
+        trello.Action(type='commentCard', date='2017-01-01T00:00:{:02d}+00:00'.format(second))
+        for second in range(20)
+    ]
+
+    tracker.record_delivery('AAAAAAAA', actions, arrow.get('2017-01-01T00:00:40+00:00'))
+
+    assert tracker.counts[('AAAAAAAA', 'commentCard')] == 20
+    assert tracker.slo_breaches[('AAAAAAAA', 'commentCard')] == 10
+    assert unit.logging.warning.call_count == 10  # pylint: disable=E1101
+    # Only the last 10 samples, lags 21 to 30s, are kept
+    assert tracker.percentiles('AAAAAAAA', 'commentCard') == {50: 25, 90: 29, 99: 30}
+    assert tracker.percentiles('AAAAAAAA', 'createCard') == dict()
+    assert list(tracker.snapshot()) == [('AAAAAAAA', 'commentCard')]
+
+
+def test_lag_tracker_summary(mocker):
+    """Asserts that summaries are logged every summary_interval seconds."""
+
+    clock = [0]
+    mocker.patch('time.monotonic', side_effect=lambda: clock[0])
+    mocker.patch('logging.info')
+    tracker = unit.LagTracker(summary_interval=60)
+    tracker.record('AAAAAAAA', 'createCard', 3)
+
+    tracker.maybe_log_summary()
+    assert not unit.logging.info.called  # pylint: disable=E1101
+    clock[0] = 60
+    tracker.maybe_log_summary()
+    unit.logging.info.assert_called_once_with(  # pylint: disable=E1101
+        mocker.ANY, 'AAAAAAAA', 'createCard', 'p50=3.0s, p90=3.0s, p99=3.0s', 1, 0,
+    )
+
+    tracker.record_depths({'AAAAAAAA': 12, 'BBBBBBBB': 0})
+    tracker.record_depths({'AAAAAAAA': 2})
+    unit.logging.info.reset_mock()  # pylint: disable=E1101
+    tracker.log_summary()
+    unit.logging.info.assert_has_calls([  # pylint: disable=E1101
+        mocker.call(mocker.ANY, 'AAAAAAAA', 2, 12),
+        mocker.call(mocker.ANY, 'BBBBBBBB', 0, 0),
+    ])
+
+#  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
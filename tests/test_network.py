@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+"""triscord.network unit tests."""
+
+import unittest.mock
+
+import pytest
+import requests
+import urllib3
+
+from triscord import network as unit
+
+from test_ratelimit import ClockMock
+
+
+@pytest.fixture(name="clock")
+def clock_fixture(mocker):
+    """Ensures time.monotonic and time.sleep are mocked."""
+
+    return ClockMock(mocker)
+
+
+def _response(status_code):
+    return unittest.mock.Mock(status_code=status_code)
+
+
+def test_deadline(clock):
+    """Asserts that Deadline tracks the remaining budget and refuses to outlast it."""
+
+    deadline = unit.Deadline(10)
+    deadline.check()
+    deadline.sleep(4)
+    assert deadline.remaining == 6
+
+    with pytest.raises(unit.DeadlineExceeded):
+        deadline.sleep(7)
+    clock.now = clock.now + 6
+    with pytest.raises(unit.DeadlineExceeded):
+        deadline.check()
+
+
+def test_circuit_breaker(clock):
+    """Asserts that CircuitBreaker opens after consecutive failures and half-opens later."""
+
+    breaker = unit.CircuitBreaker(threshold=2, cooldown=30)
+    breaker.failure('endpoint')
+    breaker.success('endpoint')
+    breaker.failure('endpoint')
+    breaker.check('endpoint')
+
+    breaker.failure('endpoint')
+    with pytest.raises(unit.CircuitOpen):
+        breaker.check('endpoint')
+    breaker.check('other_endpoint')
+
+    clock.now = clock.now + 30
+    breaker.check('endpoint')
+    breaker.failure('endpoint')
+    with pytest.raises(unit.CircuitOpen):
+        breaker.check('endpoint')
+
+
+def test_transport_timeout(clock):
+    """Asserts that Transport passes timeouts to requests, capped by the deadline."""
+
+    _ = clock
+    transport = unit.Transport(connect_timeout=5, read_timeout=30)
+    assert transport.timeout == (5, 30)
+
+    transport.deadline = unit.Deadline(10)
+    assert transport.timeout == (5, 10)
+
+
+@pytest.mark.usefixtures("clock")
+def test_transport_retry(mocker):
+    """Asserts that Transport retries connection errors and server errors with backoff."""
+
+    response = _response(200)
+    mocker.patch('requests.Session.request', side_effect=[
+        requests.exceptions.ConnectionError(),
+        _response(503),
+        response,
+    ])
+    mocker.patch('random.uniform', side_effect=lambda low, high: high)
+
+    transport = unit.Transport(max_retries=3, backoff_base=1)
+    assert transport.request('get', 'https://dummy.tld/path', params={}) is response
+    assert requests.Session.request.call_count == 3  # pylint:disable=E1101
+    assert [call[0] for call in unit.random.uniform.call_args_list] == [  # pylint:disable=E1101
+        (0, 1),
+        (0, 2),
+    ]
+
+
+def test_transport_session(mocker):
+    """Asserts that Transport's requests share a session, created upon the first one."""
+
+    mocker.patch('requests.Session.request', autospec=True, return_value=_response(200))
+    transport = unit.Transport()
+    assert transport._session is None  # pylint:disable=W0212
+    transport.request('get', 'https://dummy.tld/path')
+    transport.request('post', 'https://dummy.tld/other')
+    calls = requests.Session.request.call_args_list  # pylint:disable=E1101
+    assert [call[0][:2] for call in calls] == [
+        (transport.session, 'get'),
+        (transport.session, 'post'),
+    ]
+
+
+@pytest.mark.usefixtures("clock")
+def test_transport_retry_exhaustion(mocker):
+    """Asserts that Transport gives up after max_retries, returning or raising the error."""
+
+    mocker.patch('requests.Session.request', side_effect=requests.exceptions.Timeout())
+    transport = unit.Transport(max_retries=2)
+    with pytest.raises(requests.exceptions.Timeout):
+        transport.request('get', 'https://dummy.tld/path')
+    assert requests.Session.request.call_count == 3  # pylint:disable=E1101
+
+    response = _response(502)
+    mocker.patch('requests.Session.request', return_value=response)
+    assert transport.request('post', 'https://dummy.tld/other') is response
+
+
+@pytest.mark.usefixtures("clock")
+def test_transport_non_idempotent(mocker):
+    """Asserts that posts are only retried when they could not reach the server."""
+
+    response = _response(200)
+    mocker.patch('random.uniform', return_value=0)
+    transport = unit.Transport(max_retries=3, breaker=unit.CircuitBreaker(threshold=10))
+
+    mocker.patch('requests.Session.request',
+                 side_effect=[requests.exceptions.ReadTimeout(), response])
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        transport.request('post', 'https://dummy.tld/path')
+    assert requests.Session.request.call_count == 1  # pylint:disable=E1101
+
+    server_error = _response(503)
+    mocker.patch('requests.Session.request', side_effect=[server_error, response])
+    assert transport.request('post', 'https://dummy.tld/path') is server_error
+
+    mocker.patch('requests.Session.request', side_effect=[
+        requests.exceptions.ConnectionError(urllib3.exceptions.ProtocolError('Aborted')),
+        response,
+    ])
+    with pytest.raises(requests.exceptions.ConnectionError):
+        transport.request('post', 'https://dummy.tld/path')
+
+    refused = urllib3.exceptions.MaxRetryError(
+        None, '/path', urllib3.exceptions.NewConnectionError(None, 'Refused'))
+    mocker.patch('requests.Session.request', side_effect=[
+        requests.exceptions.ConnectTimeout(),
+        requests.exceptions.ConnectionError(refused),
+        response,
+    ])
+    assert transport.request('post', 'https://dummy.tld/path') is response
+    assert requests.Session.request.call_count == 3  # pylint:disable=E1101
+
+
+@pytest.mark.usefixtures("clock")
+def test_transport_circuit_breaking(mocker):
+    """Asserts that Transport stops requesting an endpoint once its circuit is open."""
+
+    mocker.patch('requests.Session.request', side_effect=requests.exceptions.ConnectionError())
+    transport = unit.Transport(max_retries=5, breaker=unit.CircuitBreaker(threshold=2))
+    with pytest.raises(unit.CircuitOpen):
+        transport.request('get', 'https://dummy.tld/path')
+    assert requests.Session.request.call_count == 2  # pylint:disable=E1101
+
+
+def test_transport_deadline(mocker, clock):
+    """Asserts that Transport does not start requests or backoffs past the deadline."""
+
+    mocker.patch('requests.Session.request', side_effect=requests.exceptions.ConnectionError())
+    mocker.patch('random.uniform', return_value=20)
+    transport = unit.Transport(max_retries=5, deadline=unit.Deadline(10))
+    with pytest.raises(unit.DeadlineExceeded):
+        transport.request('get', 'https://dummy.tld/path')
+    assert requests.Session.request.call_count == 1  # pylint:disable=E1101
+
+    clock.now = clock.now + 10
+    with pytest.raises(unit.DeadlineExceeded):
+        transport.request('get', 'https://dummy.tld/path')
+    assert requests.Session.request.call_count == 1  # pylint:disable=E1101
+
+
+#  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
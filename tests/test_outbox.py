@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+"""triscord.outbox unit tests."""
+
+import pytest
+
+from triscord import outbox as unit
+
+
+def _drain(outbox):
+    items = []
+    while outbox:
+        items.append(outbox.pop())
+    return items
+
+
+def test_outbox_priorities():
+    """Asserts that important action types are delivered first, in FIFO order otherwise."""
+
+    outbox = unit.Outbox()
+    outbox.push('tick_1', 'updateCheckItemStateOnCard', card_id='card_1')
+    outbox.push('tick_2', 'updateCheckItemStateOnCard', card_id='card_2')
+    outbox.push('comment', 'commentCard', card_id='card_3')
+    outbox.push('unknown', 'createList')
+    outbox.push('creation', 'createCard', card_id='card_4')
+
+    assert len(outbox) == 5
+    assert outbox.head_priority() == 30
+    assert _drain(outbox) == ['comment', 'creation', 'unknown', 'tick_1', 'tick_2']
+    assert outbox.head_priority() is None
+    with pytest.raises(IndexError):
+        outbox.pop()
+
+
+def test_outbox_configured_priorities():
+    """Asserts that configured priorities override defaults, ignoring case."""
+
+    outbox = unit.Outbox(priorities={'updatecheckitemstateoncard': 100})
+    outbox.push('comment', 'commentCard', card_id='card_1')
+    outbox.push('tick', 'updateCheckItemStateOnCard', card_id='card_2')
+
+    assert _drain(outbox) == ['tick', 'comment']
+
+
+def test_outbox_card_ordering():
+    """Asserts that a card's items are never reordered, important ones pulling the others."""
+
+    outbox = unit.Outbox()
+    outbox.push('tick_1', 'updateCheckItemStateOnCard', card_id='card_1')
+    outbox.push('tick_2', 'updateCheckItemStateOnCard', card_id='card_2')
+    outbox.push('update', 'updateCard', card_id='card_3')
+    outbox.push('comment', 'commentCard', card_id='card_2')
+    outbox.push('tick_3', 'updateCheckItemStateOnCard', card_id='card_2')
+
+    assert _drain(outbox) == ['tick_2', 'comment', 'update', 'tick_1', 'tick_3']
+
+
+def test_outbox_shedding():
+    """Asserts that the oldest least important sheddable items are dropped past max depth."""
+
+    outbox = unit.Outbox(
+        max_depth=3,
+        sheddable_types=['updateCheckItemStateOnCard', 'addMemberToCard'],
+    )
+    outbox.push('tick_1', 'updateCheckItemStateOnCard', card_id='card_1')
+    outbox.push('join', 'addMemberToCard', card_id='card_1')
+    outbox.push('tick_2', 'updateCheckItemStateOnCard', card_id='card_2')
+    outbox.push('comment_1', 'commentCard', card_id='card_1')
+    assert outbox.shed_count == 1
+    assert outbox.shed == ['tick_1']
+    assert sorted(outbox.items()) == ['comment_1', 'join', 'tick_2']
+
+    outbox.push('comment_2', 'commentCard', card_id='card_2')
+    outbox.push('comment_3', 'commentCard', card_id='card_3')
+    outbox.push('comment_4', 'commentCard', card_id='card_4')
+    assert outbox.shed_count == 3
+    assert outbox.shed == ['tick_1', 'tick_2', 'join']
+    assert len(outbox) == 4
+    assert _drain(outbox) == ['comment_1', 'comment_2', 'comment_3', 'comment_4']
+
+
+#  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
@@ -2,8 +2,10 @@
 
 """triscord.persistence unit tests."""
 
+import fcntl
 import os
 import stat
+import time
 
 import pytest
 
@@ -36,4 +38,75 @@ def test_persistence(tmpdir_factory):
         assert storage["test_key"] == persisted_value
 
 
+def test_lease(tmpdir_factory):
+    """Asserts that a single runner holds a persistence file's lease at a time."""
+
+    tmpfile_path = str(tmpdir_factory.mktemp('data').join('database.pickle3'))
+    with unit.Lease(tmpfile_path) as lease:
+        lease.heartbeat()
+        with pytest.raises(unit.LeaseHeld):
+            unit.Lease(tmpfile_path).acquire()
+        with pytest.raises(unit.LeaseHeld):
+            unit.Lease(tmpfile_path, wait=0.05, poll_interval=0.01).acquire()
+    with unit.Lease(tmpfile_path):
+        pass
+
+
+def test_lease_takeover(mocker, tmpdir_factory):
+    """Asserts that stale leases are taken over, their former owner finding out."""
+
+    tmpfile_path = str(tmpdir_factory.mktemp('data').join('database.pickle3'))
+    stalled = unit.Lease(tmpfile_path, ttl=60)
+    stalled.acquire()
+
+    now = time.time()
+    mocker.patch('time.time', return_value=now + 30)
+    stalled.heartbeat()
+    with pytest.raises(unit.LeaseHeld):
+        unit.Lease(tmpfile_path, ttl=60).acquire()
+
+    mocker.patch('time.time', return_value=now + 120)
+    with unit.Lease(tmpfile_path, ttl=60):
+        with pytest.raises(unit.LeaseLost):
+            stalled.heartbeat()
+        stalled.release()
+        assert os.path.exists(tmpfile_path + '.lease')
+    assert not os.path.exists(tmpfile_path + '.lease')
+
+
+def test_lease_races(mocker, tmpdir_factory):
+    """Asserts that leases being written, removed or replaced by other runners are not taken."""
+
+    tmpfile_path = str(tmpdir_factory.mktemp('data').join('database.pickle3'))
+    with open(tmpfile_path + '.lease', 'w') as lease_file:
+        # Locked by a runner which did not write its heartbeat yet
+        fcntl.flock(lease_file, fcntl.LOCK_EX)
+        with pytest.raises(unit.LeaseHeld):
+            unit.Lease(tmpfile_path, ttl=0).acquire()
+    assert os.path.exists(tmpfile_path + '.lease')
+
+    lease = unit.Lease(tmpfile_path)
+    lease.acquire()
+    os.unlink(tmpfile_path + '.lease')
+    with pytest.raises(unit.LeaseLost):
+        lease.heartbeat()
+    lease.release()
+
+    real_flock = fcntl.flock
+    replaced = []
+
+    def flock(lease_file, operation):
+        """Has the lease file replaced by another runner right before first locking it."""
+
+        if not replaced:
+            replaced.append(lease_file)
+            os.unlink(tmpfile_path + '.lease')
+            open(tmpfile_path + '.lease', 'w').close()
+        real_flock(lease_file, operation)
+
+    mocker.patch('fcntl.flock', side_effect=flock)
+    with unit.Lease(tmpfile_path, wait=1, poll_interval=0.01) as lease:
+        assert replaced[0].closed
+        assert lease._owned()  # pylint: disable=W0212
+
 #  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
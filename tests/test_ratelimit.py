@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+"""triscord.ratelimit unit tests."""
+
+import os
+import stat
+
+import pytest
+
+from triscord import ratelimit as unit
+
+
+class ClockMock(object):
+    """Monotonic clock mocking class."""
+
+    def __init__(self, mocker):
+        self.now = 1000.0
+        self.sleeps = []
+
+        mocker.patch('time.monotonic', side_effect=lambda: self.now)
+        mocker.patch('time.sleep', side_effect=self.sleep)
+
+    def sleep(self, delay):
+        """Mocks time.sleep(delay)."""
+
+        self.sleeps.append(delay)
+        self.now = self.now + delay
+
+
+@pytest.fixture(name="clock")
+def clock_fixture(mocker):
+    """Ensures time.monotonic and time.sleep are mocked."""
+
+    return ClockMock(mocker)
+
+
+def test_limiter_within_quota(clock):
+    """Asserts that requests within quota are not delayed."""
+
+    limiter = unit.SlidingWindowLimiter(period=10)
+    for _ in range(5):
+        limiter.acquire([('key', 5)])
+    assert not clock.sleeps
+
+
+def test_limiter_delays_over_quota(clock):
+    """Asserts that requests over quota wait for the oldest request to leave the window."""
+
+    limiter = unit.SlidingWindowLimiter(period=10)
+    for _ in range(3):
+        limiter.acquire([('key', 3)])
+        clock.now = clock.now + 1
+    limiter.acquire([('key', 3)])
+
+    assert clock.sleeps == [7]
+
+
+def test_limiter_shared_keys(clock):
+    """Asserts that a request counts against every key it is acquired for."""
+
+    limiter = unit.SlidingWindowLimiter(period=10)
+    limiter.acquire([('key', 300), ('token-a', 1)])
+    limiter.acquire([('key', 300), ('token-b', 1)])
+    assert not clock.sleeps
+
+    limiter.acquire([('key', 2), ('token-c', 1)])
+    assert clock.sleeps == [10]
+
+
+def test_limiter_block(clock):
+    """Asserts that blocked keys delay requests regardless of their quota."""
+
+    limiter = unit.SlidingWindowLimiter(period=10)
+    limiter.block(['key'], 4)
+    limiter.acquire([('other', 1)])
+    assert not clock.sleeps
+
+    limiter.acquire([('key', 100)])
+    assert clock.sleeps == [4]
+
+
+def test_shared_bucket_state(tmpdir):
+    """Asserts that bucket reservations are shared by every SharedBucketState on a file."""
+
+    state_path = tmpdir.join('ratelimit').strpath
+    first_state = unit.SharedBucketState(state_path)
+    second_state = unit.SharedBucketState(state_path)
+    key = 'https://dummy.tld/api/webhooks/0/secret'
+
+    assert first_state.reserve(key, now=100) == 0
+    first_state.update(key, remaining=1, reset=110)
+    assert second_state.reserve(key, now=101) == 0
+    assert first_state.reserve(key, now=102) == 8
+    assert second_state.reserve('other', now=102) == 0
+    assert second_state.reserve(key, now=110) == 0
+
+    with open(state_path) as state_file:
+        assert 'secret' not in state_file.read()
+    assert not stat.S_IMODE(os.stat(state_path).st_mode) & (stat.S_IRWXG | stat.S_IRWXO)
+
+
+def test_shared_bucket_state_corruption(tmpdir):
+    """Asserts that a corrupted state file is discarded."""
+
+    state_file = tmpdir.join('ratelimit')
+    state_file.write('{"truncated')
+    state = unit.SharedBucketState(state_file.strpath)
+    assert state.reserve('key', now=100) == 0
+    state.update('key', remaining=0, reset=110)
+    assert state.reserve('key', now=100) == 10
+
+
+#  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+"""triscord.reconcile unit tests."""
+
+import copy
+
+import arrow
+
+import triscord.reconcile as unit
+import triscord.trello as trello
+
+LISTS = [{'id': 'L1', 'name': 'To do'}, {'id': 'L2', 'name': 'Done'}]
+LABELS = [{'id': 'B1', 'name': 'bug', 'color': 'red'}, {'id': 'B2', 'name': '', 'color': 'blue'}]
+MEMBERS = [{'id': 'M1', 'username': 'alice'}, {'id': 'M2', 'username': 'bob'}]
+CARDS = [
+    {
+        'id': 'C1', 'name': 'Card 1', 'idList': 'L1', 'idLabels': [], 'idMembers': ['M1'],
+        'due': None, 'dateLastActivity': '2017-01-01T00:00:00.000Z',
+    },
+    {
+        'id': 'C2', 'name': 'Card 2', 'idList': 'L1', 'idLabels': ['B1'], 'idMembers': [],
+        'due': None, 'dateLastActivity': '2017-01-01T00:00:00.000Z',
+    },
+]
+FETCHED_AT = arrow.get('2017-02-01T00:00:00+00:00')
+
+
+def _feed(mocker, cards):
+    """Returns a feed whose board snapshot holds given cards."""
+
+    api = mocker.Mock(batch=mocker.Mock(return_value=[cards, LISTS, LABELS, MEMBERS]))
+    return trello.TrelloActivityFeed(api, 'AAAAAAAA')
+
+
+def _messages(feed, raw_actions):
+    """Renders synthetic raw actions through a feed."""
+
+    return [feed.format_action(action) for action in feed.filter_actions(raw_actions)]
+
+
+def test_reconcile(mocker, tmpdir):
+    """Asserts that only changes the feed did not deliver are turned into actions."""
+
+    reconciler = unit.Reconciler(tmpdir.join('database').strpath, interval=3600)
+    assert reconciler.reconcile(_feed(mocker, CARDS), FETCHED_AT) == []
+
+    cards = copy.deepcopy(CARDS)
+    cards[0].update(idList='L2', idMembers=['M2'], due='2017-03-01T12:00:00.000Z')
+    cards[1].update(name='Renamed', idLabels=['B2'])
+    delivered = trello.Action(
+        type='updateCard', card_id='C1', old=('idList', ), new={'idList': 'L2'})
+    reconciler.add('AAAAAAAA', [delivered])
+    reconciler.flush()
+
+    feed = _feed(mocker, cards)
+    messages = _messages(feed, reconciler.reconcile(feed, FETCHED_AT))
+    assert messages == [
+        "`someone` updated the card `Card 1`'s due to `2017-03-01T12:00:00.000Z`.",
+        "`bob` joined card `Card 1`.",
+        "`alice` left card `Card 1`.",
+        "`someone` updated the card `Renamed`'s name to `Renamed`.",
+        "`someone` updated the card `Renamed`'s labels to `blue`.",
+    ]
+    assert reconciler.reconcile(feed, FETCHED_AT) == []
+
+
+def test_flush(mocker, tmpdir):
+    """Asserts that delivered member changes and archivals are applied to the snapshots."""
+
+    reconciler = unit.Reconciler(tmpdir.join('database').strpath, interval=3600)
+    reconciler.reconcile(_feed(mocker, CARDS), FETCHED_AT)
+    reconciler.add('AAAAAAAA', [
+        trello.Action(type='addMemberToCard', card_id='C1', member_id='M2'),
+        trello.Action(type='removeMemberFromCard', card_id='C1', member_id='M1'),
+        trello.Action(type='commentCard', card_id='C1'),
+        trello.Action(type='updateCard', card_id='C2', old=('closed', ), new={'closed': True}),
+        trello.Action(type='updateCard', card_id='C3', old=('name', ), new={'name': 'New'}),
+    ])
+    reconciler.add('BBBBBBBB', [trello.Action(type='commentCard', card_id='C4')])
+    reconciler.flush()
+
+    cards = copy.deepcopy(CARDS[:1])
+    cards[0].update(idMembers=['M2'])
+    assert reconciler.reconcile(_feed(mocker, cards), FETCHED_AT) == []
+
+
+def test_reconcile_moves(mocker, tmpdir):
+    """Asserts that missed moves are reported, and recently active cards left for later."""
+
+    reconciler = unit.Reconciler(tmpdir.join('database').strpath, interval=3600)
+    reconciler.reconcile(_feed(mocker, CARDS), FETCHED_AT)
+
+    cards = copy.deepcopy(CARDS)
+    cards[0].update(idList='L2')
+    cards[1].update(idList='L2', dateLastActivity='2017-03-01T00:00:00.000Z')
+    feed = _feed(mocker, cards)
+    assert _messages(feed, reconciler.reconcile(feed, FETCHED_AT)) == [
+        "`someone` moved card `Card 1` to list `Done`.",
+    ]
+    assert _messages(feed, reconciler.reconcile(feed, arrow.get('2017-04-01'))) == [
+        "`someone` moved card `Card 2` to list `Done`.",
+    ]
+
+
+def test_reconcile_failure(mocker, tmpdir):
+    """Asserts that a failed snapshot leaves the previous one untouched."""
+
+    reconciler = unit.Reconciler(tmpdir.join('database').strpath, interval=3600)
+    reconciler.reconcile(_feed(mocker, CARDS), FETCHED_AT)
+    feed = _feed(mocker, CARDS)
+    feed.api.batch.return_value = [None, LISTS, LABELS, MEMBERS]
+    assert reconciler.reconcile(feed, FETCHED_AT) == []
+
+    cards = copy.deepcopy(CARDS)
+    cards[0].update(idList='L2')
+    assert len(reconciler.reconcile(_feed(mocker, cards), FETCHED_AT)) == 1
+
+
+def test_due(tmpdir):
+    """Asserts that boards are reconciled every interval."""
+
+    now = arrow.get('2017-01-01T00:00:00+00:00')
+    assert unit.Reconciler(tmpdir.join('disabled').strpath).due(['AAAAAAAA'], now) == []
+
+    reconciler = unit.Reconciler(tmpdir.join('database').strpath, interval=3600)
+    assert reconciler.due(['AAAAAAAA'], now) == ['AAAAAAAA']
+    assert reconciler.due(['AAAAAAAA'], now.shift(minutes=59)) == []
+    assert reconciler.due(['AAAAAAAA'], now.shift(minutes=60)) == ['AAAAAAAA']
+
+#  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+"""triscord.replay unit tests."""
+
+import io
+import json
+import os
+import sys
+
+import arrow
+import pytest
+import requests
+
+import triscord
+from triscord import replay as unit
+
+from test_trello import _load_from_json
+
+FIXTURES_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'fixtures')
+ACTIONS_PATH = os.path.join(FIXTURES_DIR, 'trello_api_actions.json')
+CONFIG_PATH = os.path.join(FIXTURES_DIR, 'triscord.ini')
+
+
+def test_read_actions(tmpdir):
+    """Asserts that API responses and JSON lines dumps are both read chronologically."""
+
+    actions = list(unit.read_actions(ACTIONS_PATH))
+    dates = [arrow.get(action['date']) for action in actions]
+    assert dates == sorted(dates)
+    assert len(actions) == len(_load_from_json('trello_api_actions.json'))
+
+    jsonl_file = tmpdir.join('actions.jsonl')
+    jsonl_file.write("\n".join(json.dumps(action) for action in actions) + "\n\n")
+    assert list(unit.read_actions(jsonl_file.strpath)) == actions
+
+
+def test_replay():
+    """Asserts that replayed actions go through filters and formatters into JSON lines."""
+
+    feed = triscord.trello.TrelloActivityFeed(
+        None,
+        board_id='AAAAAAAA',
+        muted_action_types=['commentCard'],
+    )
+    output = io.StringIO()
+    actions_count, messages_count = unit.replay(feed, unit.read_actions(ACTIONS_PATH), output)
+
+    lines = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert len(lines) == messages_count
+    assert 0 < messages_count <= actions_count < len(_load_from_json('trello_api_actions.json'))
+    assert all(line['type'] != 'commentCard' for line in lines)
+    assert all(line['board_id'] == 'AAAAAAAA' and line['message'] for line in lines)
+
+
+def test_render_streaming():
+    """Asserts that coalesced rendering does not read actions ahead of the coalescing window."""
+
+    feed = triscord.trello.TrelloActivityFeed(None, board_id='AAAAAAAA')
+    replay_actions = list(unit.read_actions(ACTIONS_PATH))
+    read = []
+
+    def raw_actions():
+        """Yields the replayed actions, recording those read."""
+
+        for raw_action in replay_actions:
+            read.append(raw_action)
+            yield raw_action
+
+    rendered = unit.render(feed, raw_actions(), coalesce_window=60)
+    next(rendered)
+    assert len(read) < len(replay_actions)
+
+
+def test_replay_command(mocker, tmpdir, capsys):
+    """Asserts that the replay command renders a dump to a file and reports throughput."""
+
+    output_path = tmpdir.join('messages.jsonl').strpath
+    mocker.patch('triscord.LOGGER')
+    mocker.patch.object(sys, 'argv', [
+        'triscord', '--config-path', CONFIG_PATH,
+        'replay', '--input', ACTIONS_PATH, '--output', output_path,
+    ])
+    mocker.patch('requests.Session.request')
+
+    triscord.entry_point()
+
+    with open(output_path, 'r') as output_file:
+        messages_count = len(output_file.readlines())
+    assert messages_count
+    assert "into {} messages".format(messages_count) in capsys.readouterr().err
+    assert not requests.Session.request.called  # pylint: disable=E1101
+
+
+def test_replay_from_log(tmpdir, capsys):
+    """Asserts that logged actions are replayed when no input is given."""
+
+    log_path = tmpdir.join('log').strpath
+    config_file = tmpdir.join('triscord.ini')
+    with open(CONFIG_PATH, 'r') as fixture_file:
+        config_file.write(fixture_file.read() + "\n[ActionLog]\npath = {}\n".format(log_path))
+    feed = triscord.trello.TrelloActivityFeed(
+        None,
+        board_id='AAAAAAAA',
+        action_log=triscord.actionlog.ActionLog(log_path),
+    )
+    assert list(feed.process_actions(_load_from_json('trello_api_actions.json')))
+
+    output_path = tmpdir.join('messages.jsonl').strpath
+    actions_count, messages_count = unit.main(config_file.strpath, output_path=output_path)
+
+    assert 0 < messages_count <= actions_count
+    assert "into {} messages".format(messages_count) in capsys.readouterr().err
+    with pytest.raises(triscord.settings.InvalidSettings):
+        unit.main(CONFIG_PATH)
+
+
+def test_replay_stdout(mocker, capsys):
+    """Asserts that a given board's messages are written to the standard output by default."""
+
+    mocker.patch('logging.getLogger')
+    actions_count, messages_count = unit.main(
+        CONFIG_PATH, ACTIONS_PATH, board_id='AAAAAAAA', debug=True)
+
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert 0 < len(lines) == messages_count <= actions_count
+    assert all(line['board_id'] == 'AAAAAAAA' for line in lines)
+
+
+def test_replay_unknown_board():
+    """Asserts that replaying with an unconfigured board's settings is refused."""
+
+    with pytest.raises(triscord.settings.InvalidSettings):
+        unit.main(CONFIG_PATH, ACTIONS_PATH, '-', board_id='unknown')
+
+
+def test_sync_requires_persistence(mocker):
+    """Asserts that synchronising without a persistence file is refused."""
+
+    mocker.patch.object(sys, 'argv', ['triscord', '--config-path', CONFIG_PATH])
+    with pytest.raises(SystemExit):
+        triscord.entry_point()
+
+
+#  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
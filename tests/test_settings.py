@@ -40,4 +40,123 @@ def test_configurator_fetching(config_file):  # pylint: disable=W0621
     config_parser.read(config_file)
     assert config_parser.get('TestSection', 'key') == "value"
 
+
+SETTINGS_CONTENT = (
+    "[Trello]\n"
+    "board_id = AAAAAAAA, BBBBBBBB\n"
+    "key = aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa\n"
+    "token = aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa\n"
+    "muted_update_lists = Done, Archive\n"
+    "\n"
+    "[Discord]\n"
+    "webhook_url = https://dummy.tld/api/webhooks/0/a\n"
+    "\n"
+    "[Board:BBBBBBBB]\n"
+    "webhook_url = https://dummy.tld/api/webhooks/1/b\n"
+    "muted_update_lists = \n"
+    "weight = 0.5\n"
+    "cycle_budget = 20\n"
+)
+
+
+@pytest.fixture(name="settings_file")
+def settings_file_fixture(tmpdir):
+    """Fixture that generates a complete configuration file."""
+
+    tmpfile = tmpdir.join('triscord.ini')
+    tmpfile.write(SETTINGS_CONTENT)
+    return tmpfile
+
+
+def test_settings_loading(settings_file):
+    """Asserts that settings are parsed into typed, frozen values with board overrides."""
+
+    loaded = unit.load(settings_file.strpath)
+
+    assert loaded.batch_requests is True
+    assert loaded.network.connect_timeout == 5
+    assert loaded.metrics.lag_slo == 0
+    first_board, second_board = loaded.boards
+    assert first_board.board_id == 'AAAAAAAA'
+    assert first_board.webhook_url == 'https://dummy.tld/api/webhooks/0/a'
+    assert first_board.muted_update_lists == frozenset(['Done', 'Archive'])
+    assert second_board.webhook_url == 'https://dummy.tld/api/webhooks/1/b'
+    assert second_board.muted_update_lists == frozenset()
+    assert (first_board.weight, first_board.cycle_budget) == (1, 0)
+    assert (second_board.weight, second_board.cycle_budget) == (0.5, 20)
+    with pytest.raises(AttributeError):
+        loaded.poll_interval = 0  # pylint: disable=E0237
+    assert loaded == unit.load(settings_file.strpath)
+
+
+def test_select_boards(settings_file):
+    """Asserts that settings are restricted to a worker's boards."""
+
+    loaded = unit.load(settings_file.strpath)
+
+    assert unit.select_boards(loaded, None) is loaded
+    selected = unit.select_boards(loaded, ['BBBBBBBB'])
+    assert [board.board_id for board in selected.boards] == ['BBBBBBBB']
+    assert selected._replace(boards=loaded.boards) == loaded
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        "",
+        "[Trello]\nboard_id = A\n",
+        SETTINGS_CONTENT.replace("AAAAAAAA, BBBBBBBB", ""),
+        SETTINGS_CONTENT + "\n[Daemon]\npoll_interval = -1\n",
+        SETTINGS_CONTENT + "\n[Network]\nmax_retries = many\n",
+        SETTINGS_CONTENT + "\n[Metrics]\nlag_slo = -5\n",
+        SETTINGS_CONTENT.replace("weight = 0.5", "weight = 0"),
+        SETTINGS_CONTENT + "\n[Scheduling]\ncycle_budget = -1\n",
+        SETTINGS_CONTENT.replace("webhook_url = https://dummy.tld/api/webhooks/0/a", ""),
+        "[Trello\n",
+    ]
+)
+def test_settings_validation(tmpdir, content):
+    """Asserts that invalid configuration files are rejected."""
+
+    tmpfile = tmpdir.join('triscord.ini')
+    tmpfile.write(content)
+    with pytest.raises(unit.InvalidSettings):
+        unit.load(tmpfile.strpath)
+
+
+def test_settings_missing_file(tmpdir):
+    """Asserts that missing configuration files are rejected."""
+
+    with pytest.raises(unit.InvalidSettings):
+        unit.load(tmpdir.join('missing.ini').strpath)
+
+
+def test_settings_watcher(settings_file):
+    """Asserts that SettingsWatcher reloads modified files and on demand only."""
+
+    watcher = unit.SettingsWatcher(settings_file.strpath, unit.load(settings_file.strpath))
+    assert watcher.poll() is None
+
+    watcher.request_reload()
+    assert watcher.poll() is None
+
+    settings_file.write(SETTINGS_CONTENT + "\n[Daemon]\npoll_interval = 5\n")
+    settings_file.setmtime(settings_file.mtime() + 10)
+    reloaded = watcher.poll()
+    assert reloaded.poll_interval == 5
+    assert watcher.current is reloaded
+    assert watcher.poll() is None
+
+
+def test_settings_watcher_invalid(settings_file):
+    """Asserts that SettingsWatcher keeps current settings when the new file is invalid."""
+
+    current = unit.load(settings_file.strpath)
+    watcher = unit.SettingsWatcher(settings_file.strpath, current)
+
+    settings_file.remove()
+    assert watcher.poll() is None
+    assert watcher.current is current
+
+
 #  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
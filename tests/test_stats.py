@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+"""triscord.stats unit tests."""
+
+import collections
+import os
+import sys
+
+import arrow
+
+import triscord
+from triscord import stats as unit
+
+from test_trello import _load_from_json
+
+FIXTURES_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'fixtures')
+CONFIG_PATH = os.path.join(FIXTURES_DIR, 'triscord.ini')
+
+
+def _actions():
+    """Returns the fixture actions, parsed and filtered as delivered."""
+
+    raw_actions = _load_from_json('trello_api_actions.json')
+    feed = triscord.trello.TrelloActivityFeed(None, board_id='AAAAAAAA')
+    return list(feed.process_actions(raw_actions))
+
+
+def test_count():
+    """Asserts that actions are counted per type, member, list and card event."""
+
+    counters = collections.Counter()
+    for action in _actions():
+        unit.count(counters, action)
+
+    assert counters[('type', 'createCard')] > 0
+    assert counters[('cards', 'created')] >= counters[('type', 'createCard')]
+    assert counters[('cards', 'moved')] > 0
+    assert any(kind == 'member' for kind, _ in counters)
+    assert any(kind == 'list' for kind, _ in counters)
+
+    archival = triscord.trello.Action(type='updateCard', old=('closed', ), new={'closed': True})
+    unarchival = archival.replace(new={'closed': False})
+    counters = collections.Counter()
+    unit.count(counters, archival)
+    unit.count(counters, unarchival)
+    assert counters[('cards', 'closed')] == 1
+
+
+def test_recorder(tmpdir):
+    """Asserts that counters are merged into the persisted ones of each action's day."""
+
+    persist_path = tmpdir.join('database.pickle3').strpath
+    recorder = unit.StatsRecorder(persist_path)
+    actions = _actions()
+
+    recorder.add('AAAAAAAA', actions)
+    recorder.flush()
+    recorder.add('AAAAAAAA', actions)
+    recorder.flush()
+    recorder.flush()
+
+    dates = sorted(arrow.get(action.date) for action in actions)
+    counters = unit.load([persist_path], 'AAAAAAAA', dates[0], dates[-1].shift(days=1))
+    assert sum(value for (kind, _), value in counters.items() if kind == 'type') \
+        == 2 * len(actions)
+    assert not unit.load([persist_path], 'BBBBBBBB', dates[0], dates[-1].shift(days=1))
+    assert not unit.load([persist_path], 'AAAAAAAA', dates[-1].shift(days=1), dates[0])
+
+
+def test_summary_messages():
+    """Asserts that summaries list card events and the most active entries."""
+
+    counters = collections.Counter()
+    for action in _actions():
+        unit.count(counters, action)
+
+    messages = unit.summary_messages(
+        'AAAAAAAA', counters, arrow.get('2017-01-01'), arrow.get('2017-01-08'))
+
+    assert len(messages) == 1
+    assert messages[0].startswith("Activity of board AAAAAAAA from 2017-01-01 to 2017-01-08")
+    assert "{} cards moved".format(counters[('cards', 'moved')]) in messages[0]
+    assert "**Members**" in messages[0]
+
+
+def test_due_digests(tmpdir):
+    """Asserts that digests are first due days after a board is first seen."""
+
+    recorder = unit.StatsRecorder(tmpdir.join('database.pickle3').strpath)
+    now = arrow.get('2017-01-01')
+
+    assert recorder.due_digests(['AAAAAAAA'], 7, now) == []
+    assert recorder.due_digests(['AAAAAAAA'], 7, now.shift(days=6)) == []
+    assert recorder.due_digests(['AAAAAAAA'], 7, now.shift(days=7)) == ['AAAAAAAA']
+    assert recorder.due_digests(['AAAAAAAA'], 7, now.shift(days=8)) == []
+
+
+def test_stats_command(mocker, tmpdir, capsys):
+    """Asserts that the stats command prints or posts persisted statistics.
+
+    Statistics are read from the shard of the worker synchronising each board, if any.
+    """
+
+    persist_path = tmpdir.join('database.pickle3').strpath
+    with triscord.persistence.persistent_storage(persist_path) as storage:
+        storage['shards'] = {'AAAAAAAA': 1}
+    recorder = unit.StatsRecorder(triscord.supervisor.shard_persist_path(persist_path, 1))
+    recorder.add('AAAAAAAA', _actions())
+    recorder.flush()
+    mocker.patch('triscord.LOGGER')
+    mocker.patch.object(sys, 'argv', [
+        'triscord', '--config-path', CONFIG_PATH, '--persist-path', persist_path,
+        'stats', '--since', '2015-01-01',
+    ])
+
+    triscord.entry_point()
+
+    output = capsys.readouterr().out
+    assert "Activity of board AAAAAAAA from 2015-01-01" in output
+    assert "0 cards created" not in output
+
+    mocker.patch('logging.getLogger')
+    mocker.patch('triscord.discord.DiscordWebhook.send_message', autospec=True)
+    unit.main(CONFIG_PATH, persist_path, board_id='AAAAAAAA', since='2015-01-01', post=True,
+              debug=True)
+    send_message = triscord.discord.DiscordWebhook.send_message  # pylint: disable=E1101
+    calls = send_message.call_args_list  # pylint: disable=E1101
+    webhook, summary = calls[0][0]
+    assert summary.startswith("Activity of board AAAAAAAA from 2015-01-01")
+    assert all(call[0][0] is webhook for call in calls)
+    assert webhook.bucket_state.file_path == persist_path + '.ratelimit'
+    assert not capsys.readouterr().out
+    assert not tmpdir.listdir(lambda path: '.shard0' in path.basename)
+
+#  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+
+"""triscord.supervisor unit tests."""
+
+import os
+
+import pytest
+
+import triscord
+import triscord.persistence as persistence
+import triscord.supervisor as unit
+
+BOARD_IDS = ['{:08d}'.format(index) for index in range(200)]
+
+
+def test_hash_ring_minimal_movement():
+    """Asserts that adding a shard only moves boards onto that new shard."""
+
+    before = unit.HashRing(4)
+    after = unit.HashRing(5)
+
+    moved = [board_id for board_id in BOARD_IDS if before.shard(board_id) != after.shard(board_id)]
+    assert moved
+    assert len(moved) < len(BOARD_IDS) / 2
+    assert all(after.shard(board_id) == 4 for board_id in moved)
+
+
+def test_assign():
+    """Asserts that every board is assigned to exactly one shard."""
+
+    assignment = unit.assign(BOARD_IDS, 3)
+
+    assert set(assignment) == {0, 1, 2}
+    assert sorted(board_id for board_ids in assignment.values() for board_id in board_ids) \
+        == BOARD_IDS
+
+
+def test_migrate_board_state(tmpdir_factory):
+    """Asserts that a board's persisted keys move between shards' files."""
+
+    persist_path = str(tmpdir_factory.mktemp('data').join('database.pickle3'))
+    with persistence.persistent_storage(unit.shard_persist_path(persist_path, 0)) as storage:
+        storage['last_update/AAAAAAAA'] = 'cursor A'
+        storage['last_update/BBBBBBBB'] = 'cursor B'
+
+    unit.migrate_board_state(persist_path, 'AAAAAAAA', 0, 1)
+
+    with persistence.persistent_storage(unit.shard_persist_path(persist_path, 0)) as storage:
+        assert dict(storage) == {'last_update/BBBBBBBB': 'cursor B'}
+    with persistence.persistent_storage(unit.shard_persist_path(persist_path, 1)) as storage:
+        assert dict(storage) == {'last_update/AAAAAAAA': 'cursor A'}
+
+
+def test_shard_from_main_file(mocker, tmpdir_factory):
+    """Asserts that boards' state moves into shards when enabling workers, and back."""
+
+    mocker.patch('multiprocessing.Process')
+    persist_path = str(tmpdir_factory.mktemp('data').join('database.pickle3'))
+    with persistence.persistent_storage(persist_path) as storage:
+        storage['last_update'] = 'legacy cursor'
+        storage['last_action/AAAAAAAA'] = 'action A'
+
+    supervisor = unit.Supervisor(mocker.Mock(), 'triscord.ini', persist_path)
+    supervisor.rebalance(['AAAAAAAA', 'BBBBBBBB'], 1)
+    with persistence.persistent_storage(persist_path) as storage:
+        assert 'last_action/AAAAAAAA' not in storage
+    with persistence.persistent_storage(unit.shard_persist_path(persist_path, 0)) as storage:
+        assert dict(storage) == {
+            'last_action/AAAAAAAA': 'action A',
+            'last_update/AAAAAAAA': 'legacy cursor',
+            'last_update/BBBBBBBB': 'legacy cursor',
+        }
+
+    unit.unshard(persist_path)
+    with persistence.persistent_storage(persist_path) as storage:
+        assert storage['last_action/AAAAAAAA'] == 'action A'
+        assert storage['last_update/BBBBBBBB'] == 'legacy cursor'
+        assert 'shards' not in storage
+    with persistence.persistent_storage(unit.shard_persist_path(persist_path, 0)) as storage:
+        assert not storage
+
+
+def test_run_worker(mocker):
+    """Asserts that workers do not inherit the supervisor's SIGTERM handler."""
+
+    mocker.patch('signal.signal')
+    target = mocker.Mock()
+    unit.run_worker(target, board_ids=('AAAAAAAA', ))
+    unit.signal.signal.assert_called_once_with(  # pylint: disable=E1101
+        unit.signal.SIGTERM, unit.signal.SIG_DFL)
+    target.assert_called_once_with(board_ids=('AAAAAAAA', ))
+
+
+def test_supervisor_rebalance(mocker, tmpdir_factory):
+    """Asserts that rebalancing only restarts workers whose boards changed."""
+
+    mocker.patch('multiprocessing.Process')
+    persist_path = str(tmpdir_factory.mktemp('data').join('database.pickle3'))
+    supervisor = unit.Supervisor(mocker.Mock(), 'triscord.ini', persist_path)
+
+    supervisor.rebalance(BOARD_IDS, 4)
+    assert unit.multiprocessing.Process.call_count == 4  # pylint: disable=E1101
+    kwargs = unit.multiprocessing.Process.call_args[1]['kwargs']  # pylint: disable=E1101
+    assert kwargs['daemon']
+    assert kwargs['rate_state_path'] == persist_path + '.ratelimit'
+    assert kwargs['persist_path'].startswith(persist_path + '.shard')
+
+    unit.multiprocessing.Process.reset_mock()  # pylint: disable=E1101
+    supervisor.rebalance(BOARD_IDS + ['ZZZZZZZZ'], 4)
+    assert unit.multiprocessing.Process.call_count == 1  # pylint: disable=E1101
+    kwargs = unit.multiprocessing.Process.call_args[1]['kwargs']  # pylint: disable=E1101
+    assert 'ZZZZZZZZ' in kwargs['board_ids']
+
+    supervisor.rebalance(BOARD_IDS, 5)
+
+    with persistence.persistent_storage(persist_path) as storage:
+        assert storage['shards'] == {
+            board_id: shard
+            for shard, board_ids in unit.assign(BOARD_IDS, 5).items()
+            for board_id in board_ids
+        }
+
+
+def test_supervisor_restarts_crashed_workers(mocker, tmpdir_factory):
+    """Asserts that crashed workers are restarted with an increasing delay."""
+
+    clock = [0]
+    mocker.patch('time.monotonic', side_effect=lambda: clock[0])
+    mocker.patch('multiprocessing.Process')
+    persist_path = str(tmpdir_factory.mktemp('data').join('database.pickle3'))
+    supervisor = unit.Supervisor(mocker.Mock(), 'triscord.ini', persist_path)
+    supervisor.rebalance(['AAAAAAAA'], 1)
+    process = supervisor.processes[0]
+    process.is_alive.return_value = False
+    unit.multiprocessing.Process.reset_mock()  # pylint: disable=E1101
+
+    supervisor.check_workers()
+    assert not unit.multiprocessing.Process.called  # pylint: disable=E1101
+    clock[0] = 1
+    supervisor.check_workers()
+    assert unit.multiprocessing.Process.call_count == 1  # pylint: disable=E1101
+
+    supervisor.check_workers()
+    clock[0] = 2
+    supervisor.check_workers()
+    assert unit.multiprocessing.Process.call_count == 1  # pylint: disable=E1101
+    clock[0] = 3
+    supervisor.check_workers()
+    assert unit.multiprocessing.Process.call_count == 2  # pylint: disable=E1101
+
+    # Crashes after a stable run start backing off over
+    clock[0] = 3 + unit.STABLE_RUN_DURATION + 1
+    supervisor.check_workers()
+    assert supervisor.crashes[0] == 1
+    clock[0] = clock[0] + 1
+    supervisor.check_workers()
+    assert unit.multiprocessing.Process.call_count == 3  # pylint: disable=E1101
+
+
+def test_supervisor_stop(mocker, tmpdir_factory):
+    """Asserts that SIGTERM stops supervision along with every worker, SIGHUP reloading.
+
+    The persistence file's lease is kept alive meanwhile.
+    """
+
+    current_settings = triscord.settings.load(os.path.join(
+        os.path.abspath(os.path.dirname(__file__)),
+        'fixtures',
+        'triscord.ini'
+    ))
+    current_settings = current_settings._replace(workers=4, boards=tuple(
+        current_settings.boards[0]._replace(board_id=board_id) for board_id in BOARD_IDS))
+    mocker.patch('multiprocessing.Process')
+    mocker.patch('signal.signal')
+    persist_path = str(tmpdir_factory.mktemp('data').join('database.pickle3'))
+    lease = mocker.Mock()
+    supervisor = unit.Supervisor(mocker.Mock(), 'triscord.ini', persist_path, lease=lease)
+    mocker.patch('time.sleep', side_effect=lambda _: supervisor.request_stop())
+
+    supervisor.run(current_settings)
+    lease.heartbeat.assert_called_once_with()
+
+    assert unit.signal.signal.call_args_list == [  # pylint: disable=E1101
+        mocker.call(unit.signal.SIGTERM, supervisor.request_stop),
+        mocker.call(unit.signal.SIGHUP, mocker.ANY),
+    ]
+    reload_handler = unit.signal.signal.call_args[0][1]  # pylint: disable=E1101
+    assert reload_handler.__func__ is triscord.settings.SettingsWatcher.request_reload
+    process = unit.multiprocessing.Process.return_value  # pylint: disable=E1101
+    assert process.terminate.call_count == 4
+    assert process.join.call_count == 4
+    assert not supervisor.processes
+
+
+def test_supervisor_reload_without_workers(mocker, tmpdir_factory):
+    """Asserts that reloading a configuration without workers keeps the running ones."""
+
+    current_settings = triscord.settings.load(os.path.join(
+        os.path.abspath(os.path.dirname(__file__)),
+        'fixtures',
+        'triscord.ini'
+    ))._replace(workers=2)
+    mocker.patch('multiprocessing.Process')
+    mocker.patch('signal.signal')
+    mocker.patch('triscord.settings.SettingsWatcher.poll', side_effect=[
+        current_settings._replace(workers=0, poll_interval=5), None,
+    ])
+    persist_path = str(tmpdir_factory.mktemp('data').join('database.pickle3'))
+    supervisor = unit.Supervisor(mocker.Mock(), 'triscord.ini', persist_path)
+    mocker.patch('time.sleep', side_effect=lambda _: (
+        unit.time.sleep.call_count > 1 and supervisor.request_stop()))  # pylint: disable=E1101
+    mocker.spy(supervisor, 'rebalance')
+
+    supervisor.run(current_settings)
+    supervisor.rebalance.assert_called_once_with(['AAAAAAAA'], 2)  # pylint: disable=E1101
+
+
+def test_main_starts_supervisor(mocker):
+    """Asserts that daemon mode hands over to the supervisor when workers are configured."""
+
+    current_settings = triscord.settings.load(os.path.join(
+        os.path.abspath(os.path.dirname(__file__)),
+        'fixtures',
+        'triscord.ini'
+    ))._replace(workers=2)
+    mocker.patch('triscord.settings.load', return_value=current_settings)
+    mocker.patch('triscord.supervisor.Supervisor.run', side_effect=KeyboardInterrupt)
+    mocker.patch('triscord.Synchronizer')
+
+    with pytest.raises(KeyboardInterrupt):
+        triscord.main('triscord.ini', 'database.pickle3', daemon=True)
+
+    unit.Supervisor.run.assert_called_once_with(current_settings)  # pylint: disable=E1101
+    assert not triscord.Synchronizer.called  # pylint: disable=E1101
+
+#  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
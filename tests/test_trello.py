@@ -41,7 +41,7 @@ def api_config():
 def test_api_authentication(mocker, api_config):  # pylint: disable=W0621
     """Asserts that TrelloApi properly format requests credentials to Trello's API."""
 
-    mocker.patch('requests.get')
+    mocker.patch('requests.Session.request', return_value=unittest.mock.Mock(status_code=200))
 
     endpoint = '/boards/{board_id}'.format(board_id=api_config['board_id'])
 
@@ -52,15 +52,46 @@ def test_api_authentication(mocker, api_config):  # pylint: disable=W0621
     )
     api.get(endpoint)
 
-    requests.get.assert_called_with(  # pylint:disable=E1101
+    requests.Session.request.assert_called_with(  # pylint:disable=E1101
+        'get',
         api_config['url'] + endpoint,
         params={
             'key': api_config['key'],
             'token': api_config['token'],
         },
+        timeout=(api.transport.connect_timeout, api.transport.read_timeout),
     )
 
 
+def test_action_parsing():
+    """Asserts that Action keeps the fields formatters need out of Trello's raw JSON."""
+
+    raw_actions = _load_from_json('trello_api_actions.json')
+    raw_update = next(action for action in raw_actions
+                      if action['type'] == 'updateCard' and 'listAfter' in action['data'])
+    action = unit.Action.from_json(raw_update)
+
+    assert not hasattr(action, '__dict__')
+    assert action.id == raw_update['id']
+    assert action.date == raw_update['date']
+    assert action.creator == raw_update['memberCreator']['username']
+    assert action.card_id == raw_update['data']['card']['id']
+    assert action.list_after == raw_update['data']['listAfter']['name']
+    assert action.old == tuple(raw_update['data']['old'].keys())
+    assert action.new == {
+        field: raw_update['data']['card'][field] for field in raw_update['data']['old']
+    }
+    assert repr(action) == '<Action updateCard {} {}>'.format(action.id, action.date)
+
+    moved = action.replace(list_after='Other list')
+    assert moved.list_after == 'Other list'
+    assert moved.id == action.id
+    assert action.list_after == raw_update['data']['listAfter']['name']
+
+    with pytest.raises(TypeError):
+        unit.Action(type='updateCard', data={})  # pylint: disable=E1123
+
+
 @pytest.fixture(scope="function")
 def api_actions(mocker):
     """Fixture generating and mocking Trello's API endpoint for board actions."""
@@ -112,6 +143,46 @@ def test_actions_fetching(api_config, api_actions):  # pylint: disable=W0621
     assert any(feed.actions)
 
 
+def test_actions_paging(mocker, api_config):  # pylint: disable=W0621
+    """Asserts that backlogs larger than a page are fetched page after page."""
+
+    comment = next(action for action in _load_from_json('trello_api_actions.json')
+                   if action['type'] == 'commentCard')
+    raw_actions = [dict(comment, id='{:08d}'.format(index)) for index in range(2500, 0, -1)]
+
+    def get(_, params):
+        """Lists a page of actions before the requested one, newest first."""
+
+        index = 0
+        if 'before' in params:
+            index = [raw_action['id'] for raw_action in raw_actions].index(params['before']) + 1
+        return mocker.Mock(json=lambda: raw_actions[index:index + params['limit']])
+
+    api = unit.TrelloAPI(key=api_config['key'], token=api_config['token'])
+    mocker.patch.object(api, 'get', side_effect=get)
+    feed = unit.TrelloActivityFeed(api=api, board_id=api_config['board_id'])
+    assert feed.fetch_actions() == raw_actions
+    assert api.get.call_count == 3  # pylint:disable=E1101
+    assert feed.last_action_id == '00002500'
+
+    mocker.patch.object(api, 'batch', return_value=[raw_actions[:unit.PAGE_SIZE]])
+    feed = unit.TrelloActivityFeed(api=api, board_id=api_config['board_id'])
+    (_, actions), = unit.fetch_feeds_actions(api, [feed])
+    assert len(list(actions)) == 2500
+    assert feed.last_action_id == '00002500'
+
+
+def test_action_log_failure(mocker, api_actions):  # pylint: disable=W0621
+    """Asserts that actions still get processed when the action log cannot be written."""
+
+    mocker.patch('logging.error')
+    action_log = mocker.Mock(append=mocker.Mock(side_effect=OSError('No space left on device')))
+    feed = unit.TrelloActivityFeed(None, 'AAAAAAAA', action_log=action_log)
+
+    assert len(list(feed.process_actions(list(api_actions)))) > 0
+    assert unit.logging.error.call_count == 1  # pylint: disable=E1101
+
+
 def test_action_type_filter(mocker, api_config):  # pylint: disable=W0621
     """Asserts that TrelloActivityFeed properly constructs `filter` param for action listing."""
 
@@ -164,9 +235,9 @@ def test_action_update_filter(api_config, api_actions):  # pylint: disable=W0621
         muted_update_fields=muted_update_fields,
     )
     for action in feed.actions:
-        if action['type'] == "updateCard":
+        if action.type == "updateCard":
             for muted_field in muted_update_fields:
-                assert muted_field not in action['data']['old']
+                assert muted_field not in action.old
 
 
 def test_action_update_listfilter(api_config, api_actions):  # pylint: disable=W0621
@@ -193,9 +264,157 @@ def test_action_update_listfilter(api_config, api_actions):  # pylint: disable=W
         muted_update_lists=muted_lists,
     )
     for action in feed.actions:
-        if action['type'] == "updateCard":
-            if 'listAfter' in action['data']:
-                assert action['data']['listAfter']['name'] not in muted_lists
+        if action.type == "updateCard":
+            assert action.list_after not in muted_lists
+
+
+def test_actions_request(api_config, api_actions):  # pylint: disable=W0621
+    """Asserts that only read fields are requested, and only moves into muted lists muted."""
+
+    feed = unit.TrelloActivityFeed(
+        api=None,
+        board_id=api_config['board_id'],
+        muted_update_lists=["Blacklisted List"],
+    )
+    endpoint, params = feed.actions_request
+    assert endpoint == '/boards/AAAAAAAA/actions'
+    assert 'updateCard' in params['filter'].split(',')
+    assert params['memberCreator_fields'] == 'username'
+
+    rename = {
+        'id': '1', 'type': 'updateCard', 'date': '2017-01-01T00:00:00.000Z',
+        'memberCreator': {'username': 'alice'},
+        'data': {
+            'card': {'id': 'C1', 'name': 'Renamed'}, 'old': {'name': 'Card'},
+            'list': {'id': 'L1', 'name': 'Blacklisted List'},
+        },
+    }
+    moves = [action for action in api_actions if action['type'] == 'updateCard' and
+             action['data'].get('listAfter', {}).get('name') == "Blacklisted List"]
+    assert moves
+    assert [action.id for action in feed.filter_actions([rename] + moves)] == ['1']
+
+
+def test_api_ratelimit(mocker, api_config):  # pylint: disable=W0621
+    """Asserts that TrelloAPI waits for Retry-After and retries rate limited requests."""
+
+    limited_response = unittest.mock.Mock(status_code=429, headers={'Retry-After': '3'})
+    response = unittest.mock.Mock(status_code=200, headers={})
+    mocker.patch('requests.Session.request', side_effect=[limited_response, response])
+    limiter = unit.ratelimit.SlidingWindowLimiter(period=unit.QUOTA_PERIOD)
+    mocker.patch.object(limiter, 'block', wraps=limiter.block)
+    clock = [0]
+    mocker.patch('time.monotonic', side_effect=lambda: clock[0])
+    mocker.patch('time.sleep', side_effect=lambda delay: clock.append(clock.pop() + delay))
+
+    api = unit.TrelloAPI(
+        key=api_config['key'],
+        token=api_config['token'],
+        base_url=api_config['url'],
+        limiter=limiter,
+    )
+
+    assert api.get('/boards') is response
+    assert requests.Session.request.call_count == 2  # pylint:disable=E1101
+    limiter.block.assert_called_once_with(  # pylint:disable=E1101
+        [('key', api_config['key']), ('token', api_config['token'])],
+        3,
+    )
+    assert clock == [3]
+
+    # Quota resets past the cycle deadline fail right away
+    api.transport.deadline = unit.network.Deadline(2)
+    requests.Session.request.side_effect = [limited_response]  # pylint:disable=E1101
+    with pytest.raises(unit.network.DeadlineExceeded):
+        api.get('/boards')
+    assert clock == [3]
+
+
+def test_api_shared_limiter(api_config):  # pylint: disable=W0621
+    """Asserts that API clients share the process-wide quota limiter by default."""
+
+    first_api = unit.TrelloAPI(key=api_config['key'], token=api_config['token'])
+    second_api = unit.TrelloAPI(key=api_config['key'], token=api_config['token'])
+    assert first_api.limiter is second_api.limiter is unit.QUOTA_LIMITER
+
+
+def test_api_batch(mocker, api_config):  # pylint: disable=W0621
+    """Asserts that TrelloAPI.batch chunks routes and demultiplexes per-route results."""
+
+    def side_effect(method, url, params, timeout):
+        """Batch endpoint side effect, failing any route containing `error`."""
+
+        _ = timeout
+        assert method == 'get'
+        assert url == api_config['url'] + '/batch'
+        routes = params['urls'].split(',')
+        assert len(routes) <= unit.BATCH_MAX_ROUTES
+        response = unittest.mock.Mock(status_code=200)
+        response.json = unittest.mock.Mock(return_value=[
+            {'404': 'not found'} if 'error' in route else {'200': route}
+            for route in routes
+        ])
+        return response
+
+    mocker.patch('requests.Session.request', side_effect=side_effect)
+
+    api = unit.TrelloAPI(
+        key=api_config['key'],
+        token=api_config['token'],
+        base_url=api_config['url'],
+    )
+    routes = ['/route/{}'.format(index) for index in range(23)]
+    routes[12] = '/route/error'
+
+    results = api.batch(routes)
+
+    assert requests.Session.request.call_count == 3  # pylint:disable=E1101
+    assert results[12] is None
+    assert results[:12] == routes[:12]
+    assert results[13:] == routes[13:]
+
+
+def test_api_route():
+    """Asserts that batchable routes keep their own parameters isolated from the batch."""
+
+    assert unit.TrelloAPI.route('/boards/A/actions') == '/boards/A/actions'
+    route = unit.TrelloAPI.route('/boards/A/actions', {'filter': 'a,b'})
+    assert ',' not in route
+    assert route == '/boards/A/actions?filter=a%2Cb'
+
+
+def test_feeds_batched_fetching(mocker, api_config):  # pylint: disable=W0621
+    """Asserts that fetch_feeds_actions dispatches batch results and falls back on errors."""
+
+    actions = _load_from_json('trello_api_actions.json')
+    board_ids = ['AAAAAAAA', 'BBBBBBBB', 'CCCCCCCC']
+
+    api = unit.TrelloAPI(
+        key=api_config['key'],
+        token=api_config['token'],
+        base_url=api_config['url'],
+    )
+    mocker.patch.object(api, 'batch', return_value=[list(actions), None, []])
+    fallback_response = unittest.mock.Mock()
+    fallback_response.json = unittest.mock.Mock(return_value=list(actions))
+    mocker.patch.object(api, 'get', return_value=fallback_response)
+
+    feeds = [unit.TrelloActivityFeed(api=api, board_id=board_id) for board_id in board_ids]
+    routes = [unit.TrelloAPI.route(*feed.actions_request) for feed in feeds]
+    feeds_actions = unit.fetch_feeds_actions(api, feeds)
+
+    assert [feed for feed, _ in feeds_actions] == feeds
+    api.batch.assert_called_once_with(routes)  # pylint:disable=E1101
+    api.get.assert_called_once_with(  # pylint:disable=E1101
+        '/boards/BBBBBBBB/actions',
+        params=mocker.ANY,
+    )
+    actions_lists = [
+        [action.id for action in feed_actions] for _, feed_actions in feeds_actions
+    ]
+    assert any(actions_lists[0])
+    assert actions_lists[0] == actions_lists[1]
+    assert not any(actions_lists[2])
 
 
 @pytest.fixture(scope="function", params=_load_from_json('trello_api_actions.json'))
@@ -246,10 +465,10 @@ def test_action_formatting(api_config, api_action):  # pylint: disable=W0621
     )
     for action in feed.actions:
         message = feed.format_action(action)
-        if action['type'] == 'updateCard':
+        if action.type == 'updateCard':
             # Assert updateCard supressions
-            if 'idLabels' in action['data']['old'] or \
-               'membersList' in action['data']['old']:
+            if 'idLabels' in action.old or \
+               'membersList' in action.old:
                 assert message is None
                 continue
         assert any(message)
@@ -361,7 +580,7 @@ def test_actions_ordering(api_config, api_actions):  # pylint: disable=W0621
 
     previous_action_date = None
     for action in feed.actions:
-        action_date = arrow.get(action['date'])
+        action_date = arrow.get(action.date)
         if previous_action_date is not None:
             assert action_date > previous_action_date
         previous_action_date = action_date
@@ -3,9 +3,13 @@
 """triscord unit tests."""
 
 import argparse
+import datetime
 import logging
 import os
+import subprocess
+import sys
 
+import arrow
 import pytest
 import requests
 
@@ -16,15 +20,18 @@ from test_trello import api_actions
 
 _ = api_actions
 
+# Seconds importing triscord may take, slow dependencies excluded
+STARTUP_BUDGET = 0.5
+
 
 def test_main_function(mocker, api_actions, tmpdir_factory):  # pylint: disable=W0621
     """Asserts the main function if working properly."""
 
     mocker.patch('triscord.PARSER')
     mocker.patch('triscord.LOGGER')
-    mocker.patch('requests.get')
-    mocker.patch('requests.post')
+    mocker.patch('requests.Session.request')
     mocker.patch('triscord.discord.DiscordWebhook.send_message')
+    mocker.spy(unit.metrics.LagTracker, 'log_summary')
 
     persist_file_path = str(tmpdir_factory.mktemp('data').join('database.pickle3'))
     with persistence.persistent_storage(persist_file_path) as storage:
@@ -49,6 +56,38 @@ def test_main_function(mocker, api_actions, tmpdir_factory):  # pylint: disable=
     unit.discord.DiscordWebhook.send_message.assert_called_with(  # pylint: disable=E1101
         mocker.ANY
     )
+    # The one-shot run ends well before summary_interval, its summary is logged on exit
+    assert unit.metrics.LagTracker.log_summary.call_count == 1  # pylint: disable=E1101
+
+
+def test_main_multiple_boards(mocker, tmpdir_factory):
+    """Asserts that several boards are fetched with a single batch and tracked separately."""
+
+    mocker.patch('triscord.LOGGER')
+    mocker.patch('triscord.trello.TrelloAPI.batch', return_value=[[], []])
+    mocker.patch('triscord.discord.DiscordWebhook.send_message')
+
+    data_dir = tmpdir_factory.mktemp('data')
+    config_path = data_dir.join('triscord.ini')
+    config_path.write(
+        "[Trello]\n"
+        "board_id = AAAAAAAA, BBBBBBBB\n"
+        "key = aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa\n"
+        "token = aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa\n"
+        "\n"
+        "[Discord]\n"
+        "webhook_url = https://dummy.tld/api/webhooks/0/a\n"
+    )
+    persist_file_path = str(data_dir.join('database.pickle3'))
+
+    unit.main(config_path=str(config_path), persist_path=persist_file_path)
+
+    unit.trello.TrelloAPI.batch.assert_called_once_with(  # pylint: disable=E1101
+        [mocker.ANY, mocker.ANY],
+    )
+    with persistence.persistent_storage(persist_file_path) as storage:
+        assert 'last_update/AAAAAAAA' in storage
+        assert 'last_update/BBBBBBBB' in storage
 
 
 @pytest.mark.parametrize(
@@ -87,4 +126,530 @@ def test_trello_unavailability(mocker, tmpdir_factory, get_exception):
     unit.discord.DiscordWebhook.send_message.assert_not_called()  # pylint: disable=E1101
 
 
+def test_deadline_cancellation(mocker, api_actions, tmpdir_factory):  # pylint: disable=W0621
+    """Asserts the main function stops cleanly without advancing cursors past its deadline."""
+
+    mocker.patch('triscord.LOGGER')
+    mocker.patch(
+        'triscord.discord.DiscordWebhook.send_message',
+        side_effect=unit.network.DeadlineExceeded(),
+    )
+
+    persist_file_path = str(tmpdir_factory.mktemp('data').join('database.pickle3'))
+    last_update = api_actions[-1]['date']
+    with persistence.persistent_storage(persist_file_path) as storage:
+        storage['last_update'] = last_update
+
+    unit.main(
+        config_path=os.path.join(
+            os.path.abspath(os.path.dirname(__file__)),
+            'fixtures',
+            'triscord.ini'
+        ),
+        persist_path=persist_file_path,
+    )
+
+    unit.discord.DiscordWebhook.send_message.assert_called_once_with(  # pylint: disable=E1101
+        mocker.ANY
+    )
+    with persistence.persistent_storage(persist_file_path) as storage:
+        assert arrow.get(storage['last_update/AAAAAAAA']) == arrow.get(last_update)
+
+
+def test_main_digest(mocker, api_actions, tmpdir_factory):  # pylint: disable=W0621
+    """Asserts the main function sends a digest when the backlog exceeds the threshold."""
+
+    mocker.patch('triscord.LOGGER')
+    mocker.patch('triscord.discord.DiscordWebhook.send_message')
+
+    data_dir = tmpdir_factory.mktemp('data')
+    config_path = data_dir.join('triscord.ini')
+    config_path.write(
+        "[Trello]\n"
+        "board_id = AAAAAAAA\n"
+        "key = aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa\n"
+        "token = aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa\n"
+        "\n"
+        "[Discord]\n"
+        "webhook_url = https://dummy.tld/api/webhooks/0/a\n"
+        "digest_threshold = 5\n"
+    )
+    persist_file_path = str(data_dir.join('database.pickle3'))
+    with persistence.persistent_storage(persist_file_path) as storage:
+        storage['last_update'] = api_actions[-1]['date']
+
+    unit.main(config_path=str(config_path), persist_path=persist_file_path)
+
+    send_message = unit.discord.DiscordWebhook.send_message  # pylint: disable=E1101
+    assert send_message.call_count == 1  # pylint: disable=E1101
+    assert "digest" in send_message.call_args[0][0]  # pylint: disable=E1101
+
+
+def _fixture_config_path():
+    return os.path.join(
+        os.path.abspath(os.path.dirname(__file__)),
+        'fixtures',
+        'triscord.ini'
+    )
+
+
+def test_synchronizer_reconfiguration(tmpdir_factory):
+    """Asserts that Synchronizer only rebuilds clients and feeds affected by new settings."""
+
+    persist_file_path = str(tmpdir_factory.mktemp('data').join('database.pickle3'))
+    current_settings = unit.settings.load(_fixture_config_path())
+    current_settings = current_settings._replace(boards=(
+        current_settings.boards[0],
+        current_settings.boards[0]._replace(board_id='BBBBBBBB'),
+    ))
+
+    synchronizer = unit.Synchronizer(persist_file_path)
+    synchronizer.configure(current_settings)
+    api, transport = synchronizer.api, synchronizer.transport
+    session = transport.session
+    feeds, webhooks = dict(synchronizer.feeds), dict(synchronizer.webhooks)
+    feeds['AAAAAAAA'].last_update = feeds['AAAAAAAA'].last_update + datetime.timedelta(hours=1)
+
+    synchronizer.configure(current_settings._replace(boards=(
+        current_settings.boards[0]._replace(muted_update_lists=frozenset(['Done'])),
+        current_settings.boards[1],
+    )))
+    assert synchronizer.api is api
+    assert synchronizer.transport.session is session
+    assert synchronizer.feeds['BBBBBBBB'] is feeds['BBBBBBBB']
+    assert synchronizer.feeds['AAAAAAAA'] is not feeds['AAAAAAAA']
+    assert synchronizer.feeds['AAAAAAAA'].muted_update_lists == set(['Done'])
+    assert synchronizer.feeds['AAAAAAAA'].last_update == feeds['AAAAAAAA'].last_update
+    assert synchronizer.webhooks == webhooks
+
+    synchronizer.configure(synchronizer.settings._replace(
+        network=current_settings.network._replace(read_timeout=1),
+    ))
+    assert synchronizer.transport is not transport
+    assert synchronizer.transport.session is not session
+    assert synchronizer.api is api
+    assert api.transport is synchronizer.transport
+    assert all(webhook.transport is synchronizer.transport for webhook in webhooks.values())
+
+    synchronizer.configure(synchronizer.settings._replace(trello_token='b' * 64))
+    assert synchronizer.api is not api
+    assert all(feed.api is synchronizer.api for feed in synchronizer.feeds.values())
+
+    bucket_state = synchronizer.bucket_state
+    synchronizer.configure(synchronizer.settings._replace(
+        rate_state_path=persist_file_path + '.shared-ratelimit'))
+    assert synchronizer.bucket_state is not bucket_state
+    assert synchronizer.webhooks == webhooks
+    assert all(webhook.bucket_state is synchronizer.bucket_state
+               for webhook in webhooks.values())
+
+
+def test_main_daemon(mocker, tmpdir_factory):
+    """Asserts that daemon mode keeps synchronising and applies configuration changes."""
+
+    data_dir = tmpdir_factory.mktemp('data')
+    config_file = data_dir.join('triscord.ini')
+    with open(_fixture_config_path()) as fixture_file:
+        config_file.write(fixture_file.read())
+
+    def wait(_):
+        """Modifies the configuration file on first call, stops the daemon on second."""
+
+        if unit.Synchronizer.wait.call_count > 1:  # pylint: disable=E1101
+            return True
+        config_file.write("\n[Daemon]\npoll_interval = 5\n", mode='a')
+        config_file.setmtime(config_file.mtime() + 10)
+        return False
+
+    mocker.patch('triscord.LOGGER')
+    mocker.patch('signal.signal')
+    mocker.patch.object(unit.Synchronizer, 'wait', side_effect=wait)
+    signals = []
+    mocker.patch('triscord.Synchronizer.run_cycle', side_effect=lambda: signals.append(
+        [call[0][0] for call in unit.signal.signal.call_args_list]))  # pylint: disable=E1101
+    mocker.patch('triscord.Synchronizer.configure', autospec=True,
+                 side_effect=unit.Synchronizer.configure)
+
+    unit.main(
+        config_path=config_file.strpath,
+        persist_path=str(data_dir.join('database.pickle3')),
+        daemon=True,
+    )
+
+    assert unit.Synchronizer.run_cycle.call_count == 2  # pylint: disable=E1101
+    assert unit.Synchronizer.configure.call_count == 2  # pylint: disable=E1101
+    unit.Synchronizer.wait.assert_called_with(5)  # pylint: disable=E1101
+    assert unit.signal.signal.call_args_list == [  # pylint: disable=E1101
+        mocker.call(unit.signal.SIGTERM, mocker.ANY),
+        mocker.call(unit.signal.SIGHUP, mocker.ANY),
+    ]
+    # Handlers are installed before the first, possibly long, catch-up cycle
+    assert signals[0] == [unit.signal.SIGTERM, unit.signal.SIGHUP]
+
+
+def test_main_supervisor(mocker, tmpdir_factory):
+    """Asserts that daemons with workers supervise them rather than synchronising."""
+
+    data_dir = tmpdir_factory.mktemp('data')
+    config_file = data_dir.join('triscord.ini')
+    with open(_fixture_config_path()) as fixture_file:
+        config_file.write(fixture_file.read() + "\n[Daemon]\nworkers = 2\n")
+    persist_file_path = str(data_dir.join('database.pickle3'))
+    mocker.patch('triscord.supervisor.Supervisor')
+    mocker.patch('triscord.Synchronizer.run_cycle')
+
+    unit.main(config_path=config_file.strpath, persist_path=persist_file_path, daemon=True)
+
+    supervisor_class = unit.supervisor.Supervisor  # pylint: disable=E1101
+    supervisor_class.assert_called_once_with(  # pylint: disable=E1101
+        unit.main, config_file.strpath, persist_file_path, False, lease=mocker.ANY)
+    supervisor_class.return_value.run.assert_called_once_with(mocker.ANY)  # pylint: disable=E1101
+    assert supervisor_class.return_value.run.call_args[0][0].workers == 2  # pylint: disable=E1101
+    assert not unit.Synchronizer.run_cycle.called  # pylint: disable=E1101
+
+
+def test_cycle_priorities(mocker, api_actions, tmpdir_factory):  # pylint: disable=W0621
+    """Asserts that important messages go first and only fully delivered boards advance."""
+
+    comment = next(action for action in api_actions if action['type'] == 'commentCard')
+    tick = next(action for action in api_actions
+                if action['type'] == 'updateCheckItemStateOnCard')
+    mocker.patch('triscord.trello.TrelloAPI.batch', return_value=[[tick], [comment]])
+    mocker.patch(
+        'triscord.discord.DiscordWebhook.send_message',
+        side_effect=[None, unit.network.DeadlineExceeded()],
+    )
+
+    persist_file_path = str(tmpdir_factory.mktemp('data').join('database.pickle3'))
+    current_settings = unit.settings.load(_fixture_config_path())
+    current_settings = current_settings._replace(boards=(
+        current_settings.boards[0],
+        current_settings.boards[0]._replace(board_id='BBBBBBBB'),
+    ))
+    synchronizer = unit.Synchronizer(persist_file_path)
+    synchronizer.configure(current_settings)
+    cursors = {
+        board_id: feed.last_update for board_id, feed in synchronizer.feeds.items()
+    }
+
+    synchronizer.run_cycle()
+
+    send_message = unit.discord.DiscordWebhook.send_message  # pylint: disable=E1101
+    assert 'commented' in send_message.call_args_list[0][0][0]  # pylint: disable=E1101
+    assert 'marked' in send_message.call_args_list[1][0][0]  # pylint: disable=E1101
+    assert synchronizer.feeds['AAAAAAAA'].last_update == cursors['AAAAAAAA']
+    assert synchronizer.feeds['BBBBBBBB'].last_update > cursors['BBBBBBBB']
+    with persistence.persistent_storage(persist_file_path) as storage:
+        assert storage['last_update/AAAAAAAA'] == cursors['AAAAAAAA'].isoformat()
+    assert list(synchronizer.lag_tracker.snapshot()) == [('BBBBBBBB', 'commentCard')]
+
+
+def test_cycle_checkpointing(mocker, api_actions, tmpdir_factory):  # pylint: disable=W0621
+    """Asserts that actions delivered before a failure are neither lost nor sent again."""
+
+    tick = dict(next(action for action in api_actions
+                     if action['type'] == 'updateCheckItemStateOnCard'))
+    comment = dict(next(action for action in api_actions if action['type'] == 'commentCard'))
+    tick['date'] = '2017-01-01T00:00:00.000Z'
+    comment['date'] = '2017-01-01T00:01:00.000Z'
+    mocker.patch('triscord.trello.TrelloAPI.get',
+                 side_effect=lambda *_, **__: mocker.Mock(json=lambda: [comment, tick]))
+    mocker.patch(
+        'triscord.discord.DiscordWebhook.send_message',
+        side_effect=[None, unit.network.DeadlineExceeded(), None],
+    )
+
+    persist_file_path = str(tmpdir_factory.mktemp('data').join('database.pickle3'))
+    synchronizer = unit.Synchronizer(persist_file_path)
+    synchronizer.configure(unit.settings.load(_fixture_config_path()))
+    last_update = synchronizer.feeds['AAAAAAAA'].last_update
+
+    synchronizer.run_cycle()
+    with persistence.persistent_storage(persist_file_path) as storage:
+        assert storage['delivered/AAAAAAAA'] == (comment['id'], )
+        assert storage['last_update/AAAAAAAA'] == last_update.isoformat()
+
+    synchronizer = unit.Synchronizer(persist_file_path)
+    synchronizer.configure(unit.settings.load(_fixture_config_path()))
+    synchronizer.run_cycle()
+
+    send_message = unit.discord.DiscordWebhook.send_message  # pylint: disable=E1101
+    assert send_message.call_count == 3  # pylint: disable=E1101
+    assert 'commented' in send_message.call_args_list[0][0][0]  # pylint: disable=E1101
+    assert 'marked' in send_message.call_args_list[2][0][0]  # pylint: disable=E1101
+    assert synchronizer.feeds['AAAAAAAA'].last_action_id == comment['id']
+    with persistence.persistent_storage(persist_file_path) as storage:
+        assert storage['delivered/AAAAAAAA'] == ()
+        assert storage['last_action/AAAAAAAA'] == comment['id']
+    counters = unit.stats.load(
+        [persist_file_path], 'AAAAAAAA', arrow.get('2017-01-01'), arrow.get('2017-01-02'))
+    assert counters[('type', 'commentCard')] == 1
+    assert counters[('type', 'updateCheckItemStateOnCard')] == 1
+
+
+def test_cycle_shutdown(mocker, api_actions, tmpdir_factory):  # pylint: disable=W0621
+    """Asserts that a stop leaves undelivered actions for next run and stops fetching."""
+
+    tick = dict(next(action for action in api_actions
+                     if action['type'] == 'updateCheckItemStateOnCard'))
+    comment = dict(next(action for action in api_actions if action['type'] == 'commentCard'))
+    tick['date'] = '2017-01-01T00:00:00.000Z'
+    comment['date'] = '2017-01-01T00:01:00.000Z'
+    mocker.patch('triscord.trello.TrelloAPI.get',
+                 side_effect=lambda *_, **__: mocker.Mock(json=lambda: [comment, tick]))
+
+    persist_file_path = str(tmpdir_factory.mktemp('data').join('database.pickle3'))
+    current_settings = unit.settings.load(_fixture_config_path())._replace(shutdown_grace=0)
+    synchronizer = unit.Synchronizer(persist_file_path)
+    synchronizer.configure(current_settings)
+    last_update = synchronizer.feeds['AAAAAAAA'].last_update
+    mocker.patch('triscord.discord.DiscordWebhook.send_message',
+                 side_effect=lambda _: synchronizer.request_stop())
+
+    synchronizer.run_cycle()
+    synchronizer.run_cycle()
+    assert unit.trello.TrelloAPI.get.call_count == 1  # pylint: disable=E1101
+    assert unit.discord.DiscordWebhook.send_message.call_count == 1  # pylint: disable=E1101
+    assert synchronizer.wait(60)
+    stop_deadline = synchronizer.stop_deadline
+    synchronizer.request_stop()
+    assert synchronizer.stop_deadline is stop_deadline
+    with persistence.persistent_storage(persist_file_path) as storage:
+        assert storage['delivered/AAAAAAAA'] == (comment['id'], )
+        assert storage['last_update/AAAAAAAA'] == last_update.isoformat()
+
+    mocker.patch('triscord.discord.DiscordWebhook.send_message')
+    synchronizer = unit.Synchronizer(persist_file_path)
+    synchronizer.configure(current_settings)
+    synchronizer.run_cycle()
+    send_message = unit.discord.DiscordWebhook.send_message  # pylint: disable=E1101
+    send_message.assert_called_once_with(mocker.ANY)  # pylint: disable=E1101
+    assert 'marked' in send_message.call_args[0][0]  # pylint: disable=E1101
+
+
+def test_cycle_budget(mocker, api_actions, tmpdir_factory):  # pylint: disable=W0621
+    """Asserts that messages over a board's cycle budget are delivered on next cycle."""
+
+    tick = dict(next(action for action in api_actions
+                     if action['type'] == 'updateCheckItemStateOnCard'))
+    comment = dict(next(action for action in api_actions if action['type'] == 'commentCard'))
+    tick['date'] = '2017-01-01T00:00:00.000Z'
+    comment['date'] = '2017-01-01T00:01:00.000Z'
+    mocker.patch('triscord.trello.TrelloAPI.get',
+                 side_effect=lambda *_, **__: mocker.Mock(json=lambda: [comment, tick]))
+    mocker.patch('triscord.discord.DiscordWebhook.send_message')
+
+    current_settings = unit.settings.load(_fixture_config_path())
+    current_settings = current_settings._replace(boards=tuple(
+        board._replace(cycle_budget=1) for board in current_settings.boards))
+    synchronizer = unit.Synchronizer(str(tmpdir_factory.mktemp('data').join('database')))
+    synchronizer.configure(current_settings)
+
+    synchronizer.run_cycle()
+    send_message = unit.discord.DiscordWebhook.send_message  # pylint: disable=E1101
+    assert send_message.call_count == 1  # pylint: disable=E1101
+    assert synchronizer.lag_tracker.queue_depths == {'AAAAAAAA': 2}
+    assert synchronizer.delivered['AAAAAAAA'] == frozenset([comment['id']])
+
+    synchronizer.run_cycle()
+    assert send_message.call_count == 2  # pylint: disable=E1101
+    assert 'marked' in send_message.call_args[0][0]  # pylint: disable=E1101
+    assert synchronizer.feeds['AAAAAAAA'].last_action_id == comment['id']
+
+
+def test_cycle_shedding(mocker, api_actions, tmpdir_factory):  # pylint: disable=W0621
+    """Asserts that cursors move past the actions of shed messages, which are never sent."""
+
+    tick = dict(next(action for action in api_actions
+                     if action['type'] == 'updateCheckItemStateOnCard'))
+    comment = dict(next(action for action in api_actions if action['type'] == 'commentCard'))
+    tick['date'] = '2017-01-01T00:00:00.000Z'
+    comment['date'] = '2017-01-01T00:01:00.000Z'
+    mocker.patch('triscord.trello.TrelloAPI.get',
+                 side_effect=lambda *_, **__: mocker.Mock(json=lambda: [comment, tick]))
+    mocker.patch('triscord.discord.DiscordWebhook.send_message')
+
+    persist_file_path = str(tmpdir_factory.mktemp('data').join('database.pickle3'))
+    synchronizer = unit.Synchronizer(persist_file_path)
+    synchronizer.configure(unit.settings.load(_fixture_config_path())._replace(
+        queue_max_depth=1, shed_action_types=frozenset(['updateCheckItemStateOnCard'])))
+    synchronizer.run_cycle()
+
+    send_message = unit.discord.DiscordWebhook.send_message  # pylint: disable=E1101
+    send_message.assert_called_once_with(mocker.ANY)  # pylint: disable=E1101
+    assert 'commented' in send_message.call_args[0][0]  # pylint: disable=E1101
+    assert synchronizer.feeds['AAAAAAAA'].last_action_id == comment['id']
+    with persistence.persistent_storage(persist_file_path) as storage:
+        assert storage['last_action/AAAAAAAA'] == comment['id']
+        assert storage['delivered/AAAAAAAA'] == ()
+
+
+def test_cycle_stats_digest(mocker, api_actions, tmpdir_factory):  # pylint: disable=W0621
+    """Asserts that scheduled statistics digests are posted once due, failures being logged."""
+
+    comment = dict(next(action for action in api_actions if action['type'] == 'commentCard'))
+    comment['date'] = '2017-01-02T01:00:00.000Z'
+    mocker.patch('triscord.trello.TrelloAPI.get', side_effect=[
+        mocker.Mock(json=lambda: [comment]),
+        mocker.Mock(json=list),
+        mocker.Mock(json=list),
+    ])
+    error = requests.exceptions.ConnectionError('Connection refused')
+    mocker.patch('triscord.discord.DiscordWebhook.send_message', side_effect=[None, None, error])
+    now = mocker.patch('triscord.dates.now', return_value=unit.dates.parse('2017-01-02'))
+    mocker.patch('logging.error')
+
+    persist_file_path = str(tmpdir_factory.mktemp('data').join('database.pickle3'))
+    synchronizer = unit.Synchronizer(persist_file_path)
+    synchronizer.configure(
+        unit.settings.load(_fixture_config_path())._replace(stats_digest_days=7))
+    synchronizer.run_cycle()
+    now.return_value = unit.dates.parse('2017-01-09')
+    synchronizer.run_cycle()
+
+    send_message = unit.discord.DiscordWebhook.send_message  # pylint: disable=E1101
+    assert send_message.call_count == 2  # pylint: disable=E1101
+    assert send_message.call_args[0][0].startswith(  # pylint: disable=E1101
+        "Activity of board AAAAAAAA from 2017-01-02 to 2017-01-09")
+    assert 'commentCard' in send_message.call_args[0][0]  # pylint: disable=E1101
+
+    now.return_value = unit.dates.parse('2017-01-16')
+    synchronizer.run_cycle()
+    assert send_message.call_count == 3  # pylint: disable=E1101
+    unit.logging.error.assert_called_once_with(error)  # pylint: disable=E1101
+
+
+def test_cycle_action_log(mocker, api_actions, tmpdir_factory):  # pylint: disable=W0621
+    """Asserts that fetched actions are recorded into the action log, then compacted."""
+
+    mocker.patch('triscord.trello.TrelloAPI.get',
+                 side_effect=lambda *_, **__: mocker.Mock(json=lambda: api_actions[:2]))
+    mocker.patch('triscord.discord.DiscordWebhook.send_message')
+
+    data_dir = tmpdir_factory.mktemp('data')
+    current_settings = unit.settings.load(_fixture_config_path())
+    synchronizer = unit.Synchronizer(str(data_dir.join('database.pickle3')))
+    synchronizer.configure(current_settings._replace(
+        action_log=current_settings.action_log._replace(path=str(data_dir.join('log'))),
+    ))
+    mocker.spy(synchronizer.action_log, 'maybe_compact')
+    synchronizer.feeds['AAAAAAAA'].last_update = unit.dates.parse('2017-01-01')
+    synchronizer.run_cycle()
+
+    assert [action['id'] for action in synchronizer.action_log.scan('AAAAAAAA')] == \
+        [action['id'] for action in reversed(api_actions[:2])]
+    assert synchronizer.action_log.maybe_compact.call_count == 1  # pylint: disable=E1101
+
+
+def test_startup():
+    """Asserts that importing triscord is quick and leaves slow dependencies out."""
+
+    script = (
+        "import sys, time\n"
+        "started_at = time.perf_counter()\n"
+        "import triscord\n"
+        "print(time.perf_counter() - started_at)\n"
+        "print(','.join(sorted({'arrow', 'requests'} & set(sys.modules))))\n"
+    )
+    elapsed, slow_modules = subprocess.check_output(
+        [sys.executable, '-c', script],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        universal_newlines=True,
+    ).splitlines()
+    assert not slow_modules
+    assert float(elapsed) < STARTUP_BUDGET
+
+
+def test_cycle_reconciliation(mocker, tmpdir_factory):
+    """Asserts that changes found by scheduled reconciliations are posted once caught up.
+
+    Reconciliations failing are logged, and retried when next due.
+    """
+
+    card = {'id': 'C1', 'name': 'Card 1', 'idList': 'L1', 'idLabels': [], 'idMembers': [],
+            'due': None, 'dateLastActivity': '2017-01-01T00:00:00.000Z'}
+    lists = [{'id': 'L1', 'name': 'To do'}, {'id': 'L2', 'name': 'Done'}]
+    mocker.patch('triscord.trello.TrelloAPI.get',
+                 side_effect=lambda *_, **__: mocker.Mock(json=lambda: []))
+    error = requests.exceptions.ConnectionError('Connection refused')
+    mocker.patch('triscord.trello.TrelloAPI.batch', side_effect=[
+        [[card], lists, [], []],
+        [[dict(card, idList='L2')], lists, [], []],
+        error,
+    ])
+    mocker.patch('triscord.discord.DiscordWebhook.send_message')
+
+    persist_file_path = str(tmpdir_factory.mktemp('data').join('database.pickle3'))
+    synchronizer = unit.Synchronizer(persist_file_path)
+    synchronizer.configure(
+        unit.settings.load(_fixture_config_path())._replace(reconcile_interval=3600))
+    synchronizer.run_cycle()
+    synchronizer.run_cycle()
+    mocker.patch('triscord.dates.now', return_value=unit.dates.now() + datetime.timedelta(1))
+    synchronizer.run_cycle()
+
+    send_message = unit.discord.DiscordWebhook.send_message  # pylint: disable=E1101
+    send_message.assert_called_once_with(  # pylint: disable=E1101
+        "`someone` moved card `Card 1` to list `Done`.")
+
+    mocker.patch('logging.error')
+    mocker.patch('triscord.dates.now', return_value=unit.dates.now() + datetime.timedelta(2))
+    synchronizer.run_cycle()
+    unit.logging.error.assert_called_once_with(error)  # pylint: disable=E1101
+
+
+def test_main_lease(mocker, tmpdir_factory):
+    """Asserts that runs exit right away while another one holds the persistence file."""
+
+    mocker.patch('requests.Session.request', return_value=mocker.Mock(status_code=200, json=list))
+    persist_file_path = str(tmpdir_factory.mktemp('data').join('database.pickle3'))
+    with persistence.Lease(persist_file_path):
+        unit.main(_fixture_config_path(), persist_file_path)
+    assert not requests.Session.request.called  # pylint: disable=E1101
+
+    unit.main(_fixture_config_path(), persist_file_path)
+    assert requests.Session.request.called  # pylint: disable=E1101
+    assert not os.path.exists(persist_file_path + '.lease')
+
+
+def test_cycle_lease_lost(mocker, api_actions, tmpdir_factory):  # pylint: disable=W0621
+    """Asserts that runs losing their lease stop writing the persistence file and exit."""
+
+    mocker.patch('triscord.trello.TrelloAPI.get',
+                 side_effect=lambda *_, **__: mocker.Mock(json=lambda: api_actions[:2]))
+    mocker.patch('triscord.discord.DiscordWebhook.send_message')
+    persist_file_path = str(tmpdir_factory.mktemp('data').join('database.pickle3'))
+    synchronizer = unit.Synchronizer(persist_file_path)
+    synchronizer.configure(unit.settings.load(_fixture_config_path()))
+    mocker.spy(synchronizer.checkpointer, 'flush')
+    mocker.spy(synchronizer.stats, 'flush')
+    lease = persistence.Lease(persist_file_path)
+    lease.acquire()
+    synchronizer.lease = lease
+
+    def send_message(_):
+        """Has another runner take the lease over."""
+
+        os.unlink(persist_file_path + '.lease')
+        persistence.Lease(persist_file_path).acquire()
+
+    unit.discord.DiscordWebhook.send_message.side_effect = send_message
+    with pytest.raises(persistence.LeaseLost):
+        synchronizer.run_cycle()
+    assert not synchronizer.checkpointer.flush.called  # pylint: disable=E1101
+    assert not synchronizer.stats.flush.called  # pylint: disable=E1101
+
+    mocker.patch('triscord.Synchronizer.run_cycle', side_effect=persistence.LeaseLost())
+    unit.main(_fixture_config_path(), str(tmpdir_factory.mktemp('data').join('database')))
+
+
+def test_wait_heartbeat(mocker, tmpdir_factory):
+    """Asserts that the lease's heartbeat is refreshed while waiting between cycles."""
+
+    synchronizer = unit.Synchronizer(str(tmpdir_factory.mktemp('data').join('database')))
+    synchronizer.lease = mocker.Mock(ttl=0.2)
+    assert not synchronizer.wait(0.12)
+    assert synchronizer.lease.heartbeat.call_count >= 3
+
+
 #  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
@@ -4,14 +4,31 @@
 """Main entrypoint for triscord."""
 
 import argparse
+import datetime
 import logging
+import signal
+import threading
+import time
 
-import arrow
-import requests
-
+from . import actionlog
+from . import backfill
+from . import checkpoint
+from . import coalesce
+from . import dates
+from . import digest
 from . import discord
+from . import fairness
+from . import living
+from . import metrics
+from . import network
+from . import outbox
 from . import persistence
+from . import ratelimit
+from . import reconcile
+from . import replay
 from . import settings
+from . import stats
+from . import supervisor
 from . import trello
 
 PARSER = argparse.ArgumentParser(
@@ -31,80 +48,592 @@ PARSER.add_argument(
 )
 PARSER.add_argument(
     '--persist-path',
+    help="Path of the persistence file, required for synchronisation",
+)
+PARSER.add_argument(
+    '--daemon',
+    const=True,
+    default=False,
+    action='store_const',
+    help="Keep synchronising every poll_interval, reloading configuration on change/SIGHUP",
+)
+SUBPARSERS = PARSER.add_subparsers(
+    dest='command',
+    help="Run a given command instead of synchronising",
+)
+
+REPLAY_PARSER = SUBPARSERS.add_parser(
+    'replay',
+    help="Render recorded actions offline, writing messages instead of posting them",
+)
+REPLAY_PARSER.add_argument(
+    '--input',
+    dest='input_path',
+    help="Recorded actions, either a Trello API JSON response or a chronological .jsonl file, "
+         "defaults to the board's actions in the configured action log",
+)
+REPLAY_PARSER.add_argument(
+    '--output',
+    dest='output_path',
+    default='-',
+    help="JSON lines file receiving rendered messages, defaults to the standard output",
+)
+REPLAY_PARSER.add_argument(
+    '--board',
+    dest='board_id',
+    help="Board whose settings apply, defaults to the first configured one",
+)
+REPLAY_PARSER.add_argument(
+    '--since',
+    help="Only replay logged actions from this date, e.g. 2018-01-01",
+)
+REPLAY_PARSER.add_argument(
+    '--until',
+    help="Only replay logged actions until this date",
+)
+
+BACKFILL_PARSER = SUBPARSERS.add_parser(
+    'backfill',
+    help="Send a board's past actions within a date range, or write them into a file",
+)
+BACKFILL_PARSER.add_argument(
+    '--board',
+    dest='board_id',
+    help="Board to backfill, defaults to the first configured one",
+)
+BACKFILL_PARSER.add_argument(
+    '--since',
     required=True,
-    help="Path of the persistence file",
+    help="Start of the date range, e.g. 2018-01-01",
+)
+BACKFILL_PARSER.add_argument(
+    '--until',
+    help="End of the date range, defaults to now",
+)
+BACKFILL_PARSER.add_argument(
+    '--slices',
+    type=int,
+    default=8,
+    help="Number of time slices fetched concurrently",
+)
+BACKFILL_PARSER.add_argument(
+    '--output',
+    dest='output_path',
+    help="JSON lines file receiving rendered messages instead of the board's channel, "
+         "`-` standing for the standard output",
+)
+
+STATS_PARSER = SUBPARSERS.add_parser(
+    'stats',
+    help="Print or post boards' activity statistics, maintained while synchronising",
+)
+STATS_PARSER.add_argument(
+    '--board',
+    dest='board_id',
+    help="Board to report on, defaults to all configured ones",
+)
+STATS_PARSER.add_argument(
+    '--since',
+    help="Start of the reported period, defaults to 7 days before its end",
+)
+STATS_PARSER.add_argument(
+    '--until',
+    help="End of the reported period, defaults to now",
+)
+STATS_PARSER.add_argument(
+    '--post',
+    const=True,
+    default=False,
+    action='store_const',
+    help="Post statistics to the boards' channels instead of printing them",
 )
 
 LOGGER = logging.getLogger()
 
 
-def main(config_path, persist_path, debug=False):
-    """Main function."""
+def _feed_settings(board_settings):
+    """Returns the part of a board's settings its activity feed depends on."""
+
+    return board_settings._replace(webhook_url=None)
+
+
+class Synchronizer(object):
+    """Synchronises boards' activity to Discord, keeping clients alive across cycles."""
+
+    def __init__(self, persist_path, rate_state_path=None):
+        self.persist_path = persist_path
+        if rate_state_path is None:
+            rate_state_path = persist_path + '.ratelimit'
+        self.rate_state_path = rate_state_path
+
+        self.settings = None
+        self.transport = None
+        self.api = None
+        self.feeds = dict()
+        self.webhooks = dict()
+        self.bucket_state = None
+        self.lag_tracker = None
+        self.checkpointer = checkpoint.Checkpointer(persist_path)
+        self.delivered = dict()
+        self.action_log = None
+        self.stats = stats.StatsRecorder(persist_path)
+        self.reconciler = reconcile.Reconciler(persist_path)
+        self.living = living.LivingMessages(persist_path)
+        self.lease = None
+        self.stop_deadline = None
+        self._stop_requested = threading.Event()
+
+    @property
+    def stopping(self):
+        """Whether a stop was requested."""
+        return self._stop_requested.is_set()
+
+    def request_stop(self, *_):
+        """Requests synchronisation to stop, suitable as a signal handler.
+
+        No more actions get fetched, and already queued messages keep being delivered for
+        [Daemon] shutdown_grace seconds; those left are fetched again on next run.
+        """
+
+        if self.stopping:
+            return
+        logging.info("Stop requested, delivering pending messages for up to %ss",
+                     self.settings.shutdown_grace)
+        self.stop_deadline = network.Deadline(self.settings.shutdown_grace)
+        deadline = self.transport.deadline
+        if deadline is None or deadline.remaining > self.stop_deadline.remaining:
+            self.transport.deadline = self.stop_deadline
+        self._stop_requested.set()
+
+    def wait(self, timeout):
+        """Waits for timeout seconds, returning True early if a stop was requested.
+
+        The lease's heartbeat keeps being refreshed meanwhile, so that it outlives waits
+        longer than its ttl.
+        """
+
+        waited_until = time.monotonic() + timeout
+        while True:
+            remaining = waited_until - time.monotonic()
+            if remaining <= 0:
+                return False
+            if self.lease is not None:
+                self.lease.heartbeat()
+                remaining = min(remaining, self.lease.ttl / 4 or remaining)
+            if self._stop_requested.wait(remaining):
+                return True
+
+    def _holds_lease(self):
+        """Whether the persistence file may be written, i.e. its lease was not lost."""
+
+        if self.lease is None:
+            return True
+        try:
+            self.lease.heartbeat()
+        except persistence.LeaseLost:
+            return False
+        return True
+
+    def configure(self, new_settings):
+        """Applies new settings, only rebuilding the clients and feeds they affect."""
+
+        old_settings = self.settings
+        if old_settings is None or old_settings.network != new_settings.network:
+            self.transport = network.from_settings(new_settings.network)
+            for client in [self.api] + list(self.webhooks.values()):
+                if client is not None:
+                    client.transport = self.transport
+
+        if old_settings is None or \
+                (old_settings.trello_key, old_settings.trello_token) != \
+                (new_settings.trello_key, new_settings.trello_token):
+            self.api = trello.TrelloAPI(
+                key=new_settings.trello_key,
+                token=new_settings.trello_token,
+                transport=self.transport,
+            )
+
+        if old_settings is None or old_settings.action_log != new_settings.action_log:
+            log_settings = new_settings.action_log
+            self.action_log = None
+            if log_settings.path is not None:
+                self.action_log = actionlog.ActionLog(
+                    log_settings.path,
+                    segment_size=log_settings.segment_size,
+                    retention_days=log_settings.retention_days,
+                )
+
+        old_boards = dict()
+        if old_settings is not None:
+            old_boards = {board.board_id: board for board in old_settings.boards}
+        self.checkpointer.every = new_settings.checkpoint_every
+        self.checkpointer.interval = new_settings.checkpoint_interval
+        self.reconciler.interval = new_settings.reconcile_interval
+        self.living.window = new_settings.living_window
+        cursors = self.checkpointer.load([
+            board.board_id for board in new_settings.boards if board.board_id not in self.feeds
+        ])
+        for board_id, cursor in cursors.items():
+            self.delivered[board_id] = cursor.delivered
+        feeds = dict()
+        for board in new_settings.boards:
+            feed = self.feeds.get(board.board_id)
+            if feed is not None and feed.api is self.api and \
+                    _feed_settings(old_boards[board.board_id]) == _feed_settings(board):
+                feeds[board.board_id] = feed
+                continue
+            feeds[board.board_id] = trello.TrelloActivityFeed(
+                self.api,
+                board_id=board.board_id,
+                muted_action_types=board.muted_action_types,
+                muted_update_fields=board.muted_update_fields,
+                muted_update_lists=board.muted_update_lists,
+                last_update=(feed.last_update if feed is not None
+                             else cursors[board.board_id].last_update),
+                last_action_id=(feed.last_action_id if feed is not None
+                                else cursors[board.board_id].last_action_id),
+            )
+        for feed in feeds.values():
+            feed.action_log = self.action_log
+        self.feeds = feeds
+
+        rate_state_path = new_settings.rate_state_path or self.rate_state_path
+        if self.bucket_state is None or self.bucket_state.file_path != rate_state_path:
+            self.bucket_state = ratelimit.SharedBucketState(rate_state_path)
+            for webhook in self.webhooks.values():
+                webhook.bucket_state = self.bucket_state
+
+        self.webhooks = {
+            board.webhook_url: self.webhooks.get(board.webhook_url) or discord.open_webhook(
+                board.webhook_url,
+                transport=self.transport,
+                bucket_state=self.bucket_state,
+            )
+            for board in new_settings.boards
+        }
+
+        if old_settings is None or old_settings.metrics != new_settings.metrics:
+            self.lag_tracker = metrics.LagTracker(
+                slo=new_settings.metrics.lag_slo,
+                summary_interval=new_settings.metrics.summary_interval,
+                window=new_settings.metrics.window,
+            )
+        self.settings = new_settings
+
+    def _fetch(self, feeds):
+        """Returns (feed, actions list) pairs for all given feeds."""
+
+        if self.settings.batch_requests and len(feeds) > 1:
+            feeds_actions = trello.fetch_feeds_actions(self.api, feeds)
+        else:
+            feeds_actions = [(feed, feed.actions) for feed in feeds]
+        return [(feed, list(actions)) for feed, actions in feeds_actions]
+
+    def _queue(self, feed, feed_actions, outbox_queue, delivered):
+        """Formats a feed's actions and queues the resulting messages for delivery.
+
+        Queued items are (board id, message, actions) tuples, actions being those whose
+        delivery the message acknowledges. Actions whose id is in delivered were already
+        delivered and are skipped. Returns the checkpoint.Watermark of the feed's actions.
+        """
+
+        feed_actions = coalesce.coalesce_actions(feed_actions, self.settings.coalesce_window)
+        pending = [(action, feed.format_action(action)) for action in feed_actions]
+        pending = [(action, message) for action, message in pending if message]
+        watermark = checkpoint.Watermark([action for action, _ in pending])
+        for action, _ in pending:
+            if action.id in delivered:
+                watermark.ack(action)
+        pending = [(action, message) for action, message in pending if action.id not in delivered]
+
+        digest_threshold = self.settings.digest_threshold
+        if digest_threshold and len(pending) > digest_threshold:
+            logging.info('Board %s has %d pending actions, sending a digest instead',
+                         feed.board_id, len(pending))
+            actions = [action for action, _ in pending]
+            messages = digest.digest_messages(actions, top_items=self.settings.digest_top_items)
+            for index, message in enumerate(messages, 1):
+                outbox_queue.push(
+                    (feed.board_id, message, actions if index == len(messages) else ()),
+                    'digest',
+                    card_id=feed.board_id,
+                )
+            return watermark
+        for action, message in pending:
+            outbox_queue.push(
+                (feed.board_id, message, (action, )),
+                action.type,
+                card_id=action.card_id,
+            )
+        return watermark
+
+    def _drain(self, scheduler, on_delivered):
+        """Delivers queued messages, calling on_delivered(board id, actions) for each one.
+
+        Boards' messages are interleaved by a fairness.FairScheduler, those left over
+        boards' cycle budgets being delivered on next cycle. The freshness lag of delivered
+        actions is recorded as messages get acknowledged. Messages about a card may edit
+        its living message rather than being posted anew.
+        """
+
+        webhook_urls = {board.board_id: board.webhook_url for board in self.settings.boards}
+        try:
+            while scheduler:
+                if self.stop_deadline is not None and not self.stop_deadline.remaining:
+                    logging.warning(
+                        "Shutdown grace period over, leaving %d messages for next run",
+                        sum(scheduler.depths().values()))
+                    return
+                if self.lease is not None:
+                    self.lease.heartbeat()
+                board_id, message, actions = scheduler.pop()
+                response = self.living.deliver(
+                    self.webhooks[webhook_urls[board_id]], board_id, message, actions)
+                self.lag_tracker.record_delivery(
+                    board_id, actions, metrics.acknowledged_at(response))
+                on_delivered(board_id, actions)
+        except network.errors() as exc:
+            logging.error(exc)
+            return
+        for board_id, depth in sorted(scheduler.depths().items()):
+            if depth:
+                logging.info("Board %s reached its cycle budget, leaving %d messages for "
+                             "next cycle", board_id, depth)
+
+    def _post_stats_digests(self):
+        """Posts boards' scheduled activity statistics digests, if due."""
+
+        days = self.settings.stats_digest_days
+        if not days:
+            return
+        until = dates.now()
+        since = until - datetime.timedelta(days=days)
+        boards = {board.board_id: board for board in self.settings.boards}
+        try:
+            for board_id in self.stats.due_digests(sorted(boards), days, until):
+                counters = stats.load([self.persist_path], board_id, since, until)
+                for message in stats.summary_messages(
+                        board_id, counters, since, until,
+                        top_items=self.settings.digest_top_items,
+                ):
+                    self.webhooks[boards[board_id].webhook_url].send_message(message)
+        except network.errors() as exc:
+            logging.error(exc)
+
+    def _reconcile(self, watermarks, fetched_cursors):
+        """Posts the changes boards' scheduled reconciliation found the feed missed, if due.
+
+        Only boards all fetched actions of which were delivered are reconciled.
+        """
+
+        boards = {board.board_id: board for board in self.settings.boards}
+        board_ids = [board_id for board_id in sorted(boards) if watermarks[board_id].complete]
+        try:
+            for board_id in self.reconciler.due(board_ids, dates.now()):
+                feed = self.feeds[board_id]
+                raw_actions = self.reconciler.reconcile(
+                    feed, fetched_cursors[board_id].last_update)
+                for action in feed.filter_actions(raw_actions):
+                    message = feed.format_action(action)
+                    if message:
+                        self.webhooks[boards[board_id].webhook_url].send_message(message)
+        except network.errors() as exc:
+            logging.error(exc)
+
+    def run_cycle(self):
+        """Fetches and delivers all boards' new actions, checkpointing their cursors.
+
+        Boards' messages are delivered by order of priority, boards taking turns by weight
+        within their cycle budget. Messages shed past queue_max_depth are never delivered,
+        the cursor moving past their actions. Each board's cursor advances as its messages get
+        acknowledged, up to the newest action before which all were delivered, and is
+        group-committed to the persistence file. Actions delivered past it are remembered
+        so that they are not sent again on next cycle.
+        """
+
+        if self.stopping:
+            return
+        if self.lease is not None:
+            self.lease.heartbeat()
+        cycle_deadline = self.settings.network.cycle_deadline
+        self.transport.deadline = network.Deadline(cycle_deadline) if cycle_deadline else None
+
+        boards = self.settings.boards
+        feeds = [self.feeds[board.board_id] for board in boards]
+        cursors = {
+            feed.board_id: checkpoint.Cursor(
+                feed.last_update,
+                feed.last_action_id,
+                self.delivered.get(feed.board_id, frozenset()),
+            )
+            for feed in feeds
+        }
+        initial_cursors = dict(cursors)
+        try:
+            try:
+                feeds_actions = self._fetch(feeds)
+            except network.errors() as exc:
+                logging.error(exc)
+                return
+            fetched_cursors = {
+                feed.board_id: checkpoint.Cursor(
+                    feed.last_update, feed.last_action_id, frozenset())
+                for feed in feeds
+            }
+
+            scheduler = fairness.FairScheduler()
+            watermarks = dict()
+            for board, (feed, feed_actions) in zip(boards, feeds_actions):
+                outbox_queue = scheduler.add_board(
+                    feed.board_id,
+                    outbox.Outbox(
+                        priorities=dict(self.settings.priorities),
+                        max_depth=self.settings.queue_max_depth,
+                        sheddable_types=self.settings.shed_action_types,
+                    ),
+                    weight=board.weight,
+                    budget=board.cycle_budget,
+                )
+                watermarks[feed.board_id] = self._queue(
+                    feed,
+                    feed_actions,
+                    outbox_queue,
+                    initial_cursors[feed.board_id].delivered,
+                )
+                # Shed messages are dropped for good, their actions count as handled
+                for _, _, actions in outbox_queue.shed:
+                    for action in actions:
+                        watermarks[feed.board_id].ack(action)
+                del outbox_queue.shed[:]
+                cursors[feed.board_id] = checkpoint.advance_cursor(
+                    initial_cursors[feed.board_id],
+                    fetched_cursors[feed.board_id],
+                    watermarks[feed.board_id],
+                )
+            self.lag_tracker.record_depths(scheduler.depths())
+
+            def on_delivered(board_id, actions):
+                """Advances a board's cursor past freshly delivered actions."""
+
+                self.stats.add(board_id, actions)
+                self.reconciler.add(board_id, actions)
+                for action in actions:
+                    watermarks[board_id].ack(action)
+                cursors[board_id] = checkpoint.advance_cursor(
+                    initial_cursors[board_id],
+                    fetched_cursors[board_id],
+                    watermarks[board_id],
+                )
+                self.checkpointer.advance(board_id, cursors[board_id])
+
+            self._drain(scheduler, on_delivered)
+            if self.stopping:
+                return
+            if self.lease is not None:
+                self.lease.heartbeat()
+            self.living.flush()
+            self.stats.flush()
+            self._post_stats_digests()
+            self.reconciler.flush()
+            self._reconcile(watermarks, fetched_cursors)
+        finally:
+            for feed in feeds:
+                cursor = cursors[feed.board_id]
+                feed.last_update = cursor.last_update
+                feed.last_action_id = cursor.last_action_id
+                self.delivered[feed.board_id] = cursor.delivered
+            self.lag_tracker.maybe_log_summary()
+            # Once the lease is lost, the persistence file belongs to another runner
+            if self._holds_lease():
+                for feed in feeds:
+                    self.checkpointer.advance(feed.board_id, cursors[feed.board_id])
+                self.checkpointer.flush()
+                self.living.flush()
+                self.stats.flush()
+                self.reconciler.flush()
+                if self.action_log is not None:
+                    self.action_log.maybe_compact()
+
+
+def main(config_path, persist_path,  # pylint: disable=R0913
+         debug=False, daemon=False, board_ids=None, rate_state_path=None):
+    """Main function.
+
+    board_ids restricts synchronisation to some of the configured boards, which is how
+    worker processes get started when [Daemon] workers is set. Runs hold the persistence
+    file's lease, and exit if another runner holds it for longer than [Lease] wait or
+    takes it over. Upon SIGTERM, fetched messages are delivered within [Daemon]
+    shutdown_grace before exiting.
+    """
 
     if debug:
         LOGGER.setLevel(logging.DEBUG)
     logging.info("Setting debug to %s", debug)
 
-    settings.CONFIG.read(config_path)
-
-    api = trello.TrelloAPI(
-        key=settings.CONFIG.get('Trello', 'key'),
-        token=settings.CONFIG.get('Trello', 'token'),
-    )
-    last_update = arrow.now()
-    with persistence.persistent_storage(persist_path) as storage:
-        if 'last_update' in storage:
-            last_update = arrow.get(storage['last_update'])
-            logging.info('Last run detected, was on %s', last_update.isoformat())
+    current_settings = settings.load(config_path)
+    lease = persistence.Lease(
+        persist_path, ttl=current_settings.lease_ttl, wait=current_settings.lease_wait)
     try:
-        feed = trello.TrelloActivityFeed(
-            api,
-            board_id=settings.CONFIG.get('Trello', 'board_id'),
-            muted_action_types=str(settings.CONFIG.get(
-                'Trello',
-                'muted_action_types',
-                fallback="",
-            )).split(','),
-            muted_update_fields=str(settings.CONFIG.get(
-                'Trello',
-                'muted_update_fields',
-                fallback="",
-            )).split(','),
-            muted_update_lists=str(settings.CONFIG.get(
-                'Trello',
-                'muted_update_lists',
-                fallback="",
-            )).split(','),
-            last_update=last_update,
-        )
-        discord_hook = discord.DiscordWebhook(
-            url=settings.CONFIG.get(
-                'Discord',
-                'webhook_url',
-            ),
-        )
+        lease.acquire()
+    except persistence.LeaseHeld as exc:
+        logging.warning("%s, exiting", exc)
+        return
 
-        try:
-            feed_actions = list(feed.actions)
-        except (requests.exceptions.HTTPError, requests.exceptions.ConnectionError) as exc:
-            logging.error(exc)
+    try:
+        if daemon and board_ids is None and current_settings.workers:
+            supervisor.Supervisor(main, config_path, persist_path, debug, lease=lease).run(
+                current_settings)
             return
-        for action in feed_actions:
-            message = feed.format_action(action)
-            if message:
-                discord_hook.send_message(message)
-        last_update = feed.last_update
+        if board_ids is None:
+            supervisor.unshard(persist_path)
+
+        current_settings = settings.select_boards(current_settings, board_ids)
+        synchronizer = Synchronizer(persist_path, rate_state_path=rate_state_path)
+        synchronizer.lease = lease
+        synchronizer.configure(current_settings)
+        signal.signal(signal.SIGTERM, synchronizer.request_stop)
+        watcher = settings.SettingsWatcher(config_path, current_settings)
+        if daemon:
+            # Installed before the first cycle, which may be a long catch-up one
+            signal.signal(signal.SIGHUP, watcher.request_reload)
+        synchronizer.run_cycle()
+        while daemon and not synchronizer.wait(synchronizer.settings.poll_interval):
+            new_settings = watcher.poll()
+            if new_settings is not None:
+                logging.info("Configuration reloaded from %s", config_path)
+                synchronizer.configure(settings.select_boards(new_settings, board_ids))
+            synchronizer.run_cycle()
+
+        # Runs usually end before summary_interval goes by, one-shot ones always do
+        if synchronizer.settings.metrics.summary_interval:
+            synchronizer.lag_tracker.log_summary()
+    except persistence.LeaseLost as exc:
+        logging.warning("%s, exiting", exc)
     finally:
-        with persistence.persistent_storage(persist_path) as storage:
-            storage['last_update'] = last_update.isoformat()
+        lease.release()
+
+
+COMMANDS = {
+    'backfill': backfill.main,
+    'replay': replay.main,
+    'stats': stats.main,
+}
+# Commands reading the persistence file, as synchronisation does
+PERSISTENT_COMMANDS = (None, 'stats')
 
 
 def entry_point():
     """Setuptools' CLI entry point."""
 
-    args = PARSER.parse_args()
+    args = dict(PARSER.parse_args().__dict__)
     LOGGER.setLevel(logging.WARNING)
-    main(**args.__dict__)
+    command = args.pop('command', None)
+    if command in PERSISTENT_COMMANDS and args.get('persist_path') is None:
+        PARSER.error("the following arguments are required: --persist-path")
+    if command is not None:
+        COMMANDS[command](**args)
+        return
+    main(**args)
 
 if __name__ == '__main__':  # pragma: no cover
     entry_point()
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+
+"""Append-only on-disk log of fetched raw actions."""
+
+import collections
+import contextlib
+import datetime
+import fcntl
+import glob
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+
+from . import dates
+
+# Index records: action date timestamp, data offset and length, board id and action id
+INDEX_RECORD = struct.Struct('<dQI24s24s')
+# Date ranges of closed segments: oldest and newest action date timestamps
+RANGE_RECORD = struct.Struct('<dd')
+SEGMENT_SIZE = 64 * 1024 * 1024
+# Number of most recently logged action ids remembered to skip actions fetched again
+RECENT_IDS = 10000
+COMPACT_INTERVAL = 3600
+
+
+def _encode_id(identifier):
+    """Returns an identifier as fixed-width index bytes."""
+
+    return identifier.encode('ascii')[:24]
+
+
+def _decode_id(identifier):
+    """Returns an identifier out of fixed-width index bytes."""
+
+    return identifier.rstrip(b'\0').decode('ascii')
+
+
+def _timestamp(date):
+    """Returns a date, or None, as a float timestamp suitable for index lookups."""
+
+    return None if date is None else dates.timestamp(date)
+
+
+@contextlib.contextmanager
+def _mapped(file_path):
+    """Yields a read-only memory map of a file, or b'' if it is empty."""
+
+    with open(file_path, 'rb') as mapped_file:
+        if not os.fstat(mapped_file.fileno()).st_size:
+            yield b''
+            return
+        mapped = mmap.mmap(mapped_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield mapped
+        finally:
+            mapped.close()
+
+
+class ActionLog(object):
+    """Segmented, append-only log of raw actions, indexed by board, date and action id.
+
+    Raw actions are stored as JSON lines in `<sequence>.log` segment files, along with a
+    `<sequence>.idx` file of fixed-width INDEX_RECORD entries. Segments are rolled over past
+    segment_size bytes, and are memory-mapped when scanned. Closed segments, which are no
+    longer appended to, get a `<sequence>.range` file holding their dates' RANGE_RECORD,
+    so that scans skip those out of range. Writers of several processes are serialised by
+    a lock file, and the date of the last compaction is kept in a `compacted` file.
+    """
+
+    def __init__(self, directory, segment_size=SEGMENT_SIZE, retention_days=0):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.retention_days = retention_days
+
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self._recent_ids = collections.OrderedDict()
+        self._ranges = dict()
+        segments = self.segments()
+        if segments:
+            for record in self._index(segments[-1]):
+                self._remember(_decode_id(record[4]))
+
+    def _path(self, sequence, extension):
+        """Returns the path of a given segment's data or index file."""
+
+        return os.path.join(self.directory, '{:010d}.{}'.format(sequence, extension))
+
+    def segments(self):
+        """Returns the sequence numbers of existing segments, oldest first."""
+
+        return sorted(
+            int(os.path.basename(path)[:-len('.log')])
+            for path in glob.glob(os.path.join(self.directory, '*.log'))
+        )
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Holds the log's exclusive writer lock."""
+
+        file_descriptor = os.open(
+            os.path.join(self.directory, 'lock'), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(file_descriptor, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(file_descriptor)
+
+    def _index(self, sequence):
+        """Returns the index records of a given segment."""
+
+        index_path = self._path(sequence, 'idx')
+        if not os.path.exists(index_path):
+            return []
+        with _mapped(index_path) as index:
+            # Ignores a record torn by an interrupted write
+            usable = len(index) - len(index) % INDEX_RECORD.size
+            return list(INDEX_RECORD.iter_unpack(index[:usable]))
+
+    def _range(self, sequence):
+        """Returns the (oldest, newest) date timestamps of a closed segment, or None if empty.
+
+        Ranges are computed once out of the segment's index, then read from its range file.
+        """
+
+        if sequence in self._ranges:
+            return self._ranges[sequence]
+        range_path = self._path(sequence, 'range')
+        try:
+            with open(range_path, 'rb') as range_file:
+                date_range = RANGE_RECORD.unpack(range_file.read())
+        except (OSError, struct.error):
+            timestamps = [record[0] for record in self._index(sequence)]
+            date_range = (min(timestamps), max(timestamps)) if timestamps else None
+            if date_range is not None:
+                with open(range_path + '.tmp', 'wb') as range_file:
+                    range_file.write(RANGE_RECORD.pack(*date_range))
+                os.rename(range_path + '.tmp', range_path)
+        self._ranges[sequence] = date_range
+        return date_range
+
+    def _remember(self, action_id):
+        """Remembers a logged action id, forgetting the oldest ones past RECENT_IDS."""
+
+        self._recent_ids[action_id] = None
+        while len(self._recent_ids) > RECENT_IDS:
+            self._recent_ids.popitem(last=False)
+
+    def append(self, board_id, raw_actions):
+        """Logs a board's raw actions, skipping those recently logged already.
+
+        Returns the number of logged actions.
+        """
+
+        raw_actions = [
+            raw_action for raw_action in raw_actions if raw_action['id'] not in self._recent_ids
+        ]
+        if not raw_actions:
+            return 0
+        with self._locked():
+            segments = self.segments()
+            sequence = segments[-1] if segments else 0
+            with contextlib.ExitStack() as stack:
+                data_file, index_file = None, None
+                for raw_action in raw_actions:
+                    # Rolls over to a new segment once the current one is full
+                    while data_file is None or data_file.tell() >= self.segment_size:
+                        if data_file is not None:
+                            sequence = sequence + 1
+                        stack.close()
+                        data_file = stack.enter_context(open(self._path(sequence, 'log'), 'ab'))
+                        index_file = stack.enter_context(open(self._path(sequence, 'idx'), 'ab'))
+                    line = json.dumps(raw_action, separators=(',', ':')).encode('utf-8') + b'\n'
+                    offset = data_file.tell()
+                    # Data goes first, so that index records never point past its end
+                    data_file.write(line)
+                    data_file.flush()
+                    index_file.write(INDEX_RECORD.pack(
+                        _timestamp(raw_action['date']),
+                        offset,
+                        len(line),
+                        _encode_id(board_id),
+                        _encode_id(raw_action['id']),
+                    ))
+                    self._remember(raw_action['id'])
+        return len(raw_actions)
+
+    def scan(self, board_id=None, since=None, until=None):
+        """Generator yielding logged raw actions chronologically.
+
+        Actions may be restricted to a board, and to dates within [since, until).
+        """
+
+        board_key = _encode_id(board_id).ljust(24, b'\0') if board_id is not None else None
+        since, until = _timestamp(since), _timestamp(until)
+        matches = []
+        segments = self.segments()
+        for sequence in segments:
+            if sequence != segments[-1] and (since is not None or until is not None):
+                date_range = self._range(sequence)
+                if date_range is None or (since is not None and date_range[1] < since) or \
+                        (until is not None and date_range[0] >= until):
+                    continue
+            for date, offset, length, record_board, record_id in self._index(sequence):
+                if (board_key is None or record_board == board_key) and \
+                        (since is None or date >= since) and (until is None or date < until):
+                    matches.append((date, record_id, sequence, offset, length))
+        matches.sort()
+
+        seen = set()
+        data = dict()
+        with contextlib.ExitStack() as stack:
+            for _, record_id, sequence, offset, length in matches:
+                if record_id in seen:
+                    continue
+                seen.add(record_id)
+                if sequence not in data:
+                    data[sequence] = stack.enter_context(_mapped(self._path(sequence, 'log')))
+                yield json.loads(data[sequence][offset:offset + length].decode('utf-8'))
+
+    def get(self, action_id):
+        """Returns a logged raw action by id, or None."""
+
+        action_key = _encode_id(action_id).ljust(24, b'\0')
+        id_offset = INDEX_RECORD.size - 24
+        for sequence in reversed(self.segments()):
+            index_path = self._path(sequence, 'idx')
+            if not os.path.exists(index_path):
+                continue
+            with _mapped(index_path) as index:
+                position = index.find(action_key)
+                while position != -1 and position % INDEX_RECORD.size != id_offset:
+                    position = index.find(action_key, position + 1)
+                if position == -1:
+                    continue
+                _, offset, length, _, _ = INDEX_RECORD.unpack_from(index, position - id_offset)
+            with _mapped(self._path(sequence, 'log')) as data:
+                return json.loads(data[offset:offset + length].decode('utf-8'))
+        return None
+
+    def compact(self):
+        """Rewrites closed segments without expired nor duplicate actions.
+
+        Actions older than retention_days are expired, if set, and only the first logged
+        copy of each action is kept. Returns the number of dropped actions.
+        """
+
+        with self._locked():
+            return self._compact()
+
+    def _compact(self):
+        """Compacts the log, the writer lock being held."""
+
+        cutoff = None
+        if self.retention_days:
+            cutoff = time.time() - datetime.timedelta(days=self.retention_days).total_seconds()
+
+        dropped = 0
+        seen = set()
+        segments = self.segments()
+        for sequence in segments:
+            records = self._index(sequence)
+            kept = []
+            for record in records:
+                if record[4] not in seen and (cutoff is None or record[0] >= cutoff):
+                    kept.append(record)
+                seen.add(record[4])
+            if len(kept) == len(records) or sequence == segments[-1]:
+                continue
+            dropped = dropped + len(records) - len(kept)
+            self._ranges.pop(sequence, None)
+            if os.path.exists(self._path(sequence, 'range')):
+                os.remove(self._path(sequence, 'range'))
+            if not kept:
+                os.remove(self._path(sequence, 'log'))
+                os.remove(self._path(sequence, 'idx'))
+                continue
+            self._rewrite(sequence, kept)
+        with open(os.path.join(self.directory, 'compacted'), 'w') as compacted_file:
+            compacted_file.write(str(time.time()))
+        if dropped:
+            logging.info("ActionLog: compaction dropped %d actions", dropped)
+        return dropped
+
+    def _rewrite(self, sequence, records):
+        """Replaces a segment by one holding only the given index records' actions."""
+
+        data_path, index_path = self._path(sequence, 'log'), self._path(sequence, 'idx')
+        with _mapped(data_path) as data, \
+                open(data_path + '.tmp', 'wb') as data_file, \
+                open(index_path + '.tmp', 'wb') as index_file:
+            for date, offset, length, board_key, action_key in records:
+                index_file.write(INDEX_RECORD.pack(
+                    date, data_file.tell(), length, board_key, action_key))
+                data_file.write(data[offset:offset + length])
+            data_file.flush()
+            os.fsync(data_file.fileno())
+            index_file.flush()
+            os.fsync(index_file.fileno())
+        os.rename(data_path + '.tmp', data_path)
+        os.rename(index_path + '.tmp', index_path)
+
+    def maybe_compact(self):
+        """Compacts the log if COMPACT_INTERVAL seconds went by since the last compaction.
+
+        The last compaction's date is read from the log directory, so that one-shot runs
+        compact the log as seldom as daemons.
+        """
+
+        with self._locked():
+            try:
+                with open(os.path.join(self.directory, 'compacted'), 'r') as compacted_file:
+                    compacted_at = float(compacted_file.read())
+            except (OSError, ValueError):
+                compacted_at = None
+            # Dates in the future, e.g. after a clock change, do not postpone compactions
+            if compacted_at is None or not 0 <= time.time() - compacted_at < COMPACT_INTERVAL:
+                self._compact()
+
+#  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+"""Historical actions backfill."""
+
+import logging
+import sys
+import time
+
+from . import dates
+from . import discord
+from . import network
+from . import ratelimit
+from . import replay
+from . import settings
+from . import trello
+
+
+def time_slices(since, until, count):
+    """Splits the [since, until) range into count contiguous (since, until) date pairs."""
+
+    step = (until - since) / count
+    bounds = [since + step * index for index in range(count)] + [until]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def fetch_slice(feed, since, until, page_size=trello.PAGE_SIZE):
+    """Fetches a feed's raw actions created within [since, until), paging backwards.
+
+    Returns them chronologically ordered.
+    """
+
+    params = dict(
+        trello.ACTION_FIELDS,
+        filter=','.join(sorted(feed.requested_action_types)),
+        since=since.isoformat(),
+        before=until.isoformat(),
+        limit=page_size,
+    )
+    endpoint = '/boards/{board_id}/actions'.format(board_id=feed.board_id)
+    raw_actions = []
+    while True:
+        page = feed.api.get(endpoint, params=params).json()
+        raw_actions.extend(page)
+        if len(page) < page_size:
+            break
+        # Trello lists actions newest first, continue before the oldest one
+        params['before'] = page[-1]['id']
+    logging.debug("Fetched %d actions of board %s from %s to %s",
+                  len(raw_actions), feed.board_id, since, until)
+    raw_actions.reverse()
+    return raw_actions
+
+
+def fetch_history(feed, since, until, slices=8):
+    """Generator yielding a feed's raw actions within [since, until) chronologically.
+
+    The range is split into time slices fetched concurrently. Slices are yielded in order as
+    soon as they and all earlier ones are fetched.
+    """
+
+    import concurrent.futures
+    seen = set()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=slices) as executor:
+        futures = [
+            executor.submit(fetch_slice, feed, slice_since, slice_until)
+            for slice_since, slice_until in time_slices(since, until, slices)
+        ]
+        try:
+            for future in futures:
+                for raw_action in future.result():
+                    # Actions dated exactly on a slice boundary may be listed by both slices
+                    if raw_action['id'] not in seen:
+                        seen.add(raw_action['id'])
+                        yield raw_action
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def deliver(feed, raw_actions, webhook, coalesce_window=0):
+    """Renders raw actions through a feed's filters and formatters and sends the messages.
+
+    Returns the number of rendered actions and sent messages.
+    """
+
+    actions_count, messages_count = 0, 0
+    for _, message in replay.render(feed, raw_actions, coalesce_window):
+        actions_count = actions_count + 1
+        if not message:
+            continue
+        webhook.send_message(message)
+        messages_count = messages_count + 1
+    return actions_count, messages_count
+
+
+def main(config_path, since, until=None, board_id=None,  # pylint: disable=R0913,R0914
+         slices=8, output_path=None, debug=False, **_):
+    """Backfill command, rendering a board's past actions to its channel or into a file."""
+
+    if debug:
+        logging.getLogger().setLevel(logging.DEBUG)
+
+    current_settings = settings.load(config_path)
+    board = replay.board_settings(current_settings, board_id)
+    since = dates.parse(since)
+    until = dates.parse(until) if until is not None else dates.now()
+    if since >= until:
+        raise settings.InvalidSettings('Backfill range is empty: {} to {}'.format(since, until))
+    if slices < 1:
+        raise settings.InvalidSettings('At least one time slice is required')
+
+    transport = network.from_settings(current_settings.network)
+    feed = trello.TrelloActivityFeed(
+        trello.TrelloAPI(
+            key=current_settings.trello_key,
+            token=current_settings.trello_token,
+            transport=transport,
+        ),
+        board_id=board.board_id,
+        muted_action_types=board.muted_action_types,
+        muted_update_fields=board.muted_update_fields,
+        muted_update_lists=board.muted_update_lists,
+    )
+    raw_actions = fetch_history(feed, since, until, slices=slices)
+
+    started_at = time.perf_counter()
+    if output_path is not None:
+        with replay.open_output(output_path) as output_file:
+            actions_count, messages_count = replay.replay(
+                feed, raw_actions, output_file, coalesce_window=current_settings.coalesce_window,
+            )
+    else:
+        bucket_state = None
+        if current_settings.rate_state_path is not None:
+            bucket_state = ratelimit.SharedBucketState(current_settings.rate_state_path)
+        webhook = discord.open_webhook(
+            board.webhook_url, transport=transport, bucket_state=bucket_state,
+        )
+        actions_count, messages_count = deliver(
+            feed, raw_actions, webhook, coalesce_window=current_settings.coalesce_window,
+        )
+    elapsed = time.perf_counter() - started_at
+
+    print(
+        "Backfilled {} actions into {} messages in {:.3f}s ({:.0f} actions/s)".format(
+            actions_count,
+            messages_count,
+            elapsed,
+            actions_count / elapsed if elapsed else 0,
+        ),
+        file=sys.stderr,
+    )
+    return actions_count, messages_count
+
+#  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
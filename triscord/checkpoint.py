@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+"""Synchronisation cursors checkpointing module."""
+
+import collections
+import logging
+import time
+
+from . import dates
+from . import persistence
+
+# Position of a board's synchronisation: actions up to last_update/last_action_id were
+# delivered, as well as the later ones whose ids are listed in delivered.
+Cursor = collections.namedtuple('Cursor', ['last_update', 'last_action_id', 'delivered'])
+
+
+def _key(name, board_id):
+    """Returns the persistent storage key holding a given board's cursor field."""
+
+    return '{}/{}'.format(name, board_id)
+
+
+class Watermark(object):
+    """Tracks the delivery of a board's actions, which may get acknowledged out of order.
+
+    The watermark is the newest action such that it and all older ones were delivered.
+    """
+
+    def __init__(self, actions):
+        self._actions = sorted(actions, key=lambda action: (action.date, action.id))
+        self._acked = set()
+        self._index = 0
+
+    def ack(self, action):
+        """Marks an action as delivered, returning whether the watermark moved."""
+
+        self._acked.add(action.id)
+        index = self._index
+        while self._index < len(self._actions) and \
+                self._actions[self._index].id in self._acked:
+            self._index = self._index + 1
+        return self._index != index
+
+    @property
+    def complete(self):
+        """Whether every tracked action was delivered."""
+
+        return self._index == len(self._actions)
+
+    @property
+    def position(self):
+        """The newest action up to which everything was delivered, or None."""
+
+        return self._actions[self._index - 1] if self._index else None
+
+    @property
+    def delivered_ahead(self):
+        """Ids of the actions delivered past the watermark."""
+
+        return frozenset(
+            action.id for action in self._actions[self._index:] if action.id in self._acked
+        )
+
+
+def advance_cursor(initial, fetched, watermark):
+    """Returns a board's cursor given its delivery watermark.
+
+    initial is the cursor actions were fetched from, fetched the one past all of them.
+    """
+
+    if watermark.complete:
+        return fetched
+    position = watermark.position
+    if position is None:
+        return initial._replace(delivered=watermark.delivered_ahead)
+    return Cursor(dates.parse(position.date), position.id, watermark.delivered_ahead)
+
+
+class Checkpointer(object):
+    """Loads and group-commits boards' cursors to the persistence file.
+
+    Advanced cursors are written at once every `every` advances or every `interval`
+    seconds, whichever comes first, so that a crash loses at most that much progress.
+    """
+
+    def __init__(self, persist_path, every=20, interval=1.0):
+        self.persist_path = persist_path
+        self.every = every
+        self.interval = interval
+
+        self._pending = dict()
+        self._advances = 0
+        self._flushed_at = time.monotonic()
+
+    def load(self, board_ids):
+        """Returns the persisted {board id: Cursor} of given boards.
+
+        Boards without a cursor of their own fall back to the single-board `last_update`
+        key of earlier versions, or start from now.
+        """
+
+        cursors = dict()
+        if not board_ids:
+            return cursors
+        with persistence.persistent_storage(self.persist_path) as storage:
+            for board_id in board_ids:
+                last_update = storage.get(
+                    _key('last_update', board_id), storage.get('last_update'))
+                if last_update is None:
+                    cursors[board_id] = Cursor(dates.now(), None, frozenset())
+                    continue
+                cursors[board_id] = Cursor(
+                    dates.parse(last_update),
+                    storage.get(_key('last_action', board_id)),
+                    frozenset(storage.get(_key('delivered', board_id), ())),
+                )
+                logging.info('Last run detected for board %s, was on %s',
+                             board_id, cursors[board_id].last_update.isoformat())
+        return cursors
+
+    def advance(self, board_id, cursor):
+        """Records a board's new cursor, committing pending ones if due."""
+
+        self._pending[board_id] = cursor
+        self._advances = self._advances + 1
+        if self._advances >= self.every or \
+                time.monotonic() - self._flushed_at >= self.interval:
+            self.flush()
+
+    def flush(self):
+        """Commits pending cursors to the persistence file."""
+
+        self._flushed_at = time.monotonic()
+        self._advances = 0
+        if not self._pending:
+            return
+        with persistence.persistent_storage(self.persist_path) as storage:
+            for board_id, cursor in self._pending.items():
+                storage[_key('last_update', board_id)] = cursor.last_update.isoformat()
+                if cursor.last_action_id is not None:
+                    storage[_key('last_action', board_id)] = cursor.last_action_id
+                storage[_key('delivered', board_id)] = tuple(sorted(cursor.delivered))
+        self._pending.clear()
+
+#  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
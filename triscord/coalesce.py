@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+"""Rapid card updates coalescing module."""
+
+import collections
+
+from . import dates
+
+MEMBER_ACTION_TYPES = ('addMemberToCard', 'removeMemberFromCard')
+
+
+def _coalescing_key(action):
+    """Returns the key under which successive actions are merged, or None."""
+
+    if action.type == 'updateCard' and action.old:
+        return 'updateCard', action.card_id, action.old[0]
+    if action.type in MEMBER_ACTION_TYPES:
+        return 'member', action.card_id, action.member_id
+    return None
+
+
+def _merge(group):
+    """Returns the action summarizing a group of coalesced actions, or None if they cancel."""
+
+    first, last = group[0], group[-1]
+    if len(group) == 1:
+        return last
+    if last.type in MEMBER_ACTION_TYPES:
+        # An add/remove flip-flop leaves the card as it was before the first action
+        return last if first.type == last.type else None
+    return last.replace(list_before=first.list_before)
+
+
+def iter_coalesced(actions, window):
+    """Generator merging successive updates of the same card field happening within window seconds.
+
+    Each chain of `updateCard` actions on a given card field is replaced by a single action
+    holding the chain's final value and original list. Likewise, member addition/removal chains
+    on a card are reduced to their net effect. Merged actions take the place of the chain's
+    latest action, so that ordering remains chronological.
+
+    Actions are expected chronologically, and a chain is yielded as soon as an action more than
+    window seconds newer than its latest one is read, so that only the actions of the last
+    window seconds are held in memory.
+    """
+
+    if not window:
+        yield from actions
+        return
+
+    pending = collections.OrderedDict()
+    open_groups = dict()
+    for action in actions:
+        key = _coalescing_key(action)
+        date = dates.parse(action.date)
+        group = open_groups.get(key) if key is not None else None
+        if group is not None and (date - group['last_date']).total_seconds() <= window:
+            group['actions'].append(action)
+            group['last_date'] = date
+            pending.move_to_end(id(group))
+        else:
+            group = {'actions': [action], 'last_date': date, 'key': key}
+            pending[id(group)] = group
+            if key is not None:
+                open_groups[key] = group
+        yield from _flush(pending, open_groups, date, window)
+    yield from _flush(pending, open_groups, None, window)
+
+
+def _flush(pending, open_groups, date, window):
+    """Generator yielding the merged pending groups which can no longer grow, oldest first.
+
+    A group is only yielded once those before it are, date being that of the latest read
+    action, or None to flush every group.
+    """
+
+    while pending:
+        group = next(iter(pending.values()))
+        key = group['key']
+        still_open = (
+            date is not None and key is not None and open_groups.get(key) is group
+            and (date - group['last_date']).total_seconds() <= window
+        )
+        if still_open:
+            return
+        del pending[id(group)]
+        if key is not None and open_groups.get(key) is group:
+            del open_groups[key]
+        merged = _merge(group['actions'])
+        if merged is not None:
+            yield merged
+
+
+def coalesce_actions(actions, window):
+    """Returns the list of actions coalesced within window seconds, see iter_coalesced."""
+
+    return list(iter_coalesced(actions, window))
+
+#  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+"""Lightweight ISO 8601 dates handling.
+
+Trello's action dates and persisted cursors are parsed with the standard library, so that
+one-shot runs do not pay for importing arrow. Other formats are still handed over to arrow.
+"""
+
+import datetime
+import re
+
+ISO_8601 = re.compile(
+    r'(\d{4})-(\d\d)-(\d\d)'
+    r'(?:[T ](\d\d):(\d\d)(?::(\d\d)(?:\.(\d{1,6})\d*)?)?)?'
+    r'(?:Z|([+-])(\d\d):?(\d\d))?$'
+)
+
+
+def now():
+    """Returns the current date, in UTC."""
+
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def parse(value):
+    """Returns a timezone-aware datetime out of an ISO 8601 string, a datetime or an arrow date.
+
+    Dates without a timezone are taken as UTC.
+    """
+
+    if isinstance(value, datetime.datetime):
+        date = value
+    elif not isinstance(value, str):
+        date = value.datetime
+    else:
+        match = ISO_8601.match(value)
+        if match is None:
+            import arrow
+            return arrow.get(value).datetime
+        (year, month, day, hour, minute, second, fraction,
+         sign, offset_hours, offset_minutes) = match.groups()
+        tzinfo = datetime.timezone.utc
+        if sign is not None:
+            offset = datetime.timedelta(hours=int(offset_hours), minutes=int(offset_minutes))
+            tzinfo = datetime.timezone(-offset if sign == '-' else offset)
+        date = datetime.datetime(
+            int(year), int(month), int(day),
+            int(hour or 0), int(minute or 0), int(second or 0),
+            int((fraction or '0').ljust(6, '0')),
+            tzinfo=tzinfo,
+        )
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return date
+
+
+def timestamp(value):
+    """Returns the POSIX timestamp of an ISO 8601 string, a datetime or an arrow date."""
+
+    return parse(value).timestamp()
+
+#  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
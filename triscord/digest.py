@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+"""Catch-up digest rendering module."""
+
+import collections
+
+# See https://discordapp.com/developers/docs/resources/channel#create-message
+MESSAGE_MAX_LENGTH = 2000
+
+
+def action_list(action):
+    """Returns the name of the list an action relates to, if any."""
+
+    return action.list_after or action.list_name
+
+
+def top_lines(title, counter, top_items):
+    """Renders the top_items most common entries of a counter as a titled list."""
+
+    lines = ["**{}**".format(title)]
+    for name, count in counter.most_common(top_items):
+        lines.append("- `{}`: {}".format(name, count))
+    remainder = len(counter) - top_items
+    if remainder > 0:
+        lines.append("- ...and {} more".format(remainder))
+    return lines
+
+
+def pack_lines(lines, max_length):
+    """Joins lines into as few messages as possible, none longer than max_length."""
+
+    messages = []
+    current = ""
+    for line in lines:
+        line = line[:max_length]
+        if current and len(current) + 1 + len(line) > max_length:
+            messages.append(current)
+            current = ""
+        current = current + "\n" + line if current else line
+    if current:
+        messages.append(current)
+    return messages
+
+
+def digest_messages(actions, top_items=5, max_length=MESSAGE_MAX_LENGTH):
+    """Summarizes a chronological list of trello.Action into a few messages.
+
+    Actions are counted per type, card, list and member, and only the top_items most active
+    of each are listed.
+    """
+
+    per_type = collections.Counter(action.type for action in actions)
+    per_card = collections.Counter(filter(None, (action.card_name for action in actions)))
+    per_list = collections.Counter(filter(None, map(action_list, actions)))
+    per_member = collections.Counter(filter(None, (action.creator for action in actions)))
+
+    lines = [
+        "Catch-up digest of {} actions, from {} to {}.".format(
+            len(actions),
+            actions[0].date,
+            actions[-1].date,
+        ),
+    ]
+    lines.extend(top_lines("Action types", per_type, top_items))
+    lines.extend(top_lines("Cards", per_card, top_items))
+    lines.extend(top_lines("Lists", per_list, top_items))
+    lines.extend(top_lines("Members", per_member, top_items))
+    return pack_lines(lines, max_length)
+
+#  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
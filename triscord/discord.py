@@ -4,70 +4,209 @@
 
 import logging
 import time
+import urllib.parse
 
-import arrow
-import requests
+from . import network
 
 
 class DiscordWebhook(object):  # pylint: disable=R0903
     """Discord webhook-based interaction class."""
 
-    def __init__(self, url):
+    def __init__(self, url, transport=None, bucket_state=None):
         self.url = url
 
+        if transport is None:
+            transport = network.Transport()
+        self.transport = transport
+        self.bucket_state = bucket_state
+
         self.rate_exhausted = False
         self.next_reset = None
+        self.remaining = None
+
+    def budget(self, now):
+        """Returns how many more messages can be sent right away, as far as known.
+
+        Exhausted webhooks have a negative budget, the longer until their reset the lower.
+        """
+
+        if self.rate_exhausted and self.next_reset > now:
+            return now - self.next_reset
+        if self.remaining is None or self.rate_exhausted:
+            return float('inf')
+        return self.remaining
+
+    @property
+    def webhook_ids(self):
+        """Ids of the webhook, as referenced by the messages it sends."""
+
+        return (urllib.parse.urlsplit(self.url).path.rstrip('/').split('/')[-2], )
 
     def send_message(self, message):
         """Send a message through the Discord webhook.
 
         See https://discordapp.com/developers/docs/resources/webhook#execute-webhook
+
+        When a shared bucket state is set, it is consulted before each request and updated
+        with the rate limit headers of each response, so that other processes and later runs
+        posting to the same webhook wait for the bucket to reset.
         """
 
         logging.debug("DiscordWebhook.send_message(%s)", message)
-        message_submitted = False
+        return self._request(
+            'post',
+            self.url,
+            params={
+                'wait': True,
+            },
+            data={
+                'content': message,
+            },
+        )
+
+    def edit_message(self, webhook_id, message_id, message):
+        """Replaces the content of a message previously sent through the webhook.
+
+        See https://discordapp.com/developers/docs/resources/webhook#edit-webhook-message
+
+        webhook_id must be the webhook's own, as given by webhook_ids.
+        """
+
+        logging.debug("DiscordWebhook.edit_message(%s, %s, %s)", webhook_id, message_id, message)
+        return self._request(
+            'patch',
+            '{}/messages/{}'.format(self.url, message_id),
+            json={
+                'content': message,
+            },
+        )
+
+    def _request(self, method, url, **kwargs):
+        """Executes a request against the webhook's rate limits, returning decoded JSON."""
+
         request_delay = 0
         if self.rate_exhausted:
-            request_delay = self.next_reset - arrow.now().timestamp
-            logging.debug('DiscordWebhook.send_message(%s), rate was exhausted, delay=%d',
-                          message, request_delay)
+            request_delay = self.next_reset - time.time()
+            logging.debug('DiscordWebhook._request(%s), rate was exhausted, delay=%d',
+                          method, request_delay)
             if request_delay < 0:
                 request_delay = 0
-        response = None
-        while not message_submitted:
+        while True:
             if request_delay:
-                time.sleep(request_delay)
+                self.transport.sleep(request_delay)
                 request_delay = 0
                 self.rate_exhausted = False
                 self.next_reset = None
-            response = requests.post(
-                self.url,
-                params={
-                    'wait': True,
-                },
-                data={
-                    'content': message,
-                },
+            if self.bucket_state is not None:
+                request_delay = self.bucket_state.reserve(self.url, time.time())
+                if request_delay:
+                    logging.debug('DiscordWebhook._request(%s):Shared bucket exhausted, '
+                                  'retrying in %ds', method, request_delay)
+                    continue
+            response = self.transport.request(method, url, **kwargs)
+            if response.status_code != 429:
+                break
+            request_delay = int(response.headers['Retry-After']) / 1000
+            self.remaining = 0
+            if self.bucket_state is not None:
+                self.bucket_state.update(self.url, 0, time.time() + request_delay)
+            logging.debug(
+                'DiscordWebhook._request(%s):Rate limited, retrying in %ds',
+                method,
+                request_delay,
             )
-            if response.status_code == 429:
-                request_delay = int(response.headers['Retry-After']) / 1000
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        if remaining is not None:
+            remaining = int(remaining)
+            self.remaining = remaining
+            next_reset = float(response.headers['X-RateLimit-Reset'])
+            if self.bucket_state is not None:
+                self.bucket_state.update(self.url, remaining, next_reset)
+            if remaining == 0:
+                self.rate_exhausted = True
+                self.next_reset = next_reset
                 logging.debug(
-                    'DiscordWebhook.send_message(%s):Rate limited, retrying in %ds',
-                    message,
-                    request_delay,
+                    'DiscordWebhook._request(%s):Last request exhausted rate, reset=%d',
+                    method,
+                    self.next_reset,
                 )
-                continue
-            else:
-                message_submitted = True
-        if response.headers['X-RateLimit-Remaining'] == 0:
-            self.rate_exhausted = True
-            self.next_reset = int(response.headers['X-RateLimit-Reset'])
-            logging.debug(
-                'DiscordWebhook.send_message(%s):Last request exhausted rate, reset=%d',
-                message,
-                self.next_reset,
-            )
         response.raise_for_status()
         return response.json()
 
+
+class WebhookPool(object):
+    """Several webhooks posting to a same channel, used as a single DiscordWebhook.
+
+    Discord rate limits each webhook separately: each message is sent through the webhook
+    with the most remaining budget, in turn when several have the same. As messages are
+    sent one after the other, each once the previous one was acknowledged, their ordering
+    within the channel is preserved.
+    """
+
+    def __init__(self, urls, transport=None, bucket_state=None):
+        if transport is None:
+            transport = network.Transport()
+        self.webhooks = [
+            DiscordWebhook(url, transport=transport, bucket_state=bucket_state)
+            for url in urls
+        ]
+        self._next = 0
+
+    @property
+    def transport(self):
+        """network.Transport shared by the pool's webhooks."""
+
+        return self.webhooks[0].transport
+
+    @transport.setter
+    def transport(self, transport):
+        for webhook in self.webhooks:
+            webhook.transport = transport
+
+    @property
+    def bucket_state(self):
+        """ratelimit.SharedBucketState shared by the pool's webhooks."""
+
+        return self.webhooks[0].bucket_state
+
+    @bucket_state.setter
+    def bucket_state(self, bucket_state):
+        for webhook in self.webhooks:
+            webhook.bucket_state = bucket_state
+
+    def pick(self):
+        """Returns the webhook to send the next message through."""
+
+        now = time.time()
+        rotation = self.webhooks[self._next:] + self.webhooks[:self._next]
+        webhook = max(rotation, key=lambda webhook: webhook.budget(now))
+        self._next = (self.webhooks.index(webhook) + 1) % len(self.webhooks)
+        return webhook
+
+    @property
+    def webhook_ids(self):
+        """Ids of the pool's webhooks, as referenced by the messages they send."""
+
+        return tuple(webhook.webhook_ids[0] for webhook in self.webhooks)
+
+    def send_message(self, message):
+        """Sends a message through the webhook with the most remaining budget."""
+
+        return self.pick().send_message(message)
+
+    def edit_message(self, webhook_id, message_id, message):
+        """Replaces the content of a message previously sent through the webhook of given id."""
+
+        webhook = self.webhooks[self.webhook_ids.index(webhook_id)]
+        return webhook.edit_message(webhook_id, message_id, message)
+
+
+def open_webhook(webhook_url, transport=None, bucket_state=None):
+    """Returns a DiscordWebhook, or a WebhookPool for comma-separated URLs."""
+
+    urls = [url.strip() for url in webhook_url.split(',') if url.strip()]
+    if len(urls) > 1:
+        return WebhookPool(urls, transport=transport, bucket_state=bucket_state)
+    return DiscordWebhook(urls[0], transport=transport, bucket_state=bucket_state)
+
 #  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
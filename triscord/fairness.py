@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+"""Fair scheduling of outbound items across boards."""
+
+import collections
+
+
+class FairScheduler(object):
+    """Deficit round-robin scheduler over boards' outbox.Outbox queues.
+
+    Boards take turns by rounds. Each round credits every board with pending items its
+    weight, and a board delivers one item per whole credit it holds, so that a board with
+    a large backlog gets no more than its weighted share of deliveries while others have
+    items pending. Within a round, boards go by order of their next item's priority.
+    Boards delivering their budget of items stop being scheduled until the next cycle.
+    """
+
+    def __init__(self):
+        self._queues = collections.OrderedDict()
+        self._weights = dict()
+        self._budgets = dict()
+        self._deficits = dict()
+        self._round = collections.deque()
+        self.delivered = collections.Counter()
+
+    def add_board(self, board_id, queue, weight=1, budget=0):
+        """Schedules a board's Outbox, returning it.
+
+        weight must be positive, and budget caps the board's deliveries (0 disables it).
+        """
+
+        self._queues[board_id] = queue
+        self._weights[board_id] = weight
+        self._budgets[board_id] = budget
+        self._deficits[board_id] = 0
+        return queue
+
+    def _schedulable(self, board_id):
+        """Whether a board has pending items and is within its budget."""
+
+        budget = self._budgets[board_id]
+        return bool(self._queues[board_id]) and \
+            (not budget or self.delivered[board_id] < budget)
+
+    def __len__(self):
+        return sum(
+            len(queue) for board_id, queue in self._queues.items()
+            if self._schedulable(board_id)
+        )
+
+    def depths(self):
+        """Returns the {board id: number of queued items} dict of every board."""
+
+        return {board_id: len(queue) for board_id, queue in self._queues.items()}
+
+    def _start_round(self):
+        """Credits boards with pending items and lines them up for a new round."""
+
+        boards = []
+        for board_id in self._queues:
+            if self._schedulable(board_id):
+                self._deficits[board_id] = self._deficits[board_id] + self._weights[board_id]
+                boards.append(board_id)
+            else:
+                self._deficits[board_id] = 0
+        boards.sort(key=lambda board_id: -self._queues[board_id].head_priority())
+        self._round.extend(boards)
+
+    def pop(self):
+        """Returns the next item to deliver."""
+
+        if not len(self):
+            raise IndexError('pop from an empty FairScheduler')
+        while True:
+            if not self._round:
+                self._start_round()
+            board_id = self._round[0]
+            if self._schedulable(board_id) and self._deficits[board_id] >= 1:
+                self._deficits[board_id] = self._deficits[board_id] - 1
+                self.delivered[board_id] = self.delivered[board_id] + 1
+                return self._queues[board_id].pop()
+            self._round.popleft()
+
+#  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+"""Living messages, edited in place as their card keeps changing."""
+
+import collections
+import logging
+import time
+
+from . import digest
+from . import network
+from . import persistence
+
+# Latest message of a card: the webhook which sent it, its id, when it was first sent and its
+# current content
+LivingMessage = collections.namedtuple(
+    'LivingMessage', ['webhook_id', 'message_id', 'posted_at', 'content'])
+
+
+def _key(board_id):
+    """Returns the persistent storage key holding a board's living messages."""
+
+    return 'living/{}'.format(board_id)
+
+
+class LivingMessages(object):
+    """Appends a card's messages to its latest Discord message rather than posting anew.
+
+    A card's message is edited for window seconds after it was first sent, as long as it
+    fits within Discord's message length limit; a new message is posted otherwise. The
+    {card id: LivingMessage} mapping of each board is kept in the persistence file.
+    """
+
+    def __init__(self, persist_path, window=0, max_length=digest.MESSAGE_MAX_LENGTH):
+        self.persist_path = persist_path
+        self.window = window
+        self.max_length = max_length
+
+        self._boards = dict()
+        self._dirty = set()
+
+    def _messages(self, board_id):
+        """Returns the {card id: LivingMessage} dict of a board, loading it if needed."""
+
+        if board_id not in self._boards:
+            with persistence.persistent_storage(self.persist_path) as storage:
+                self._boards[board_id] = dict(storage.get(_key(board_id), dict()))
+        return self._boards[board_id]
+
+    def deliver(self, webhook, board_id, message, actions):
+        """Sends a message holding given trello.Action instances, returning the response.
+
+        Messages about a single card are appended to the card's living message if any.
+        """
+
+        if not self.window or len(actions) != 1 or actions[0].card_id is None:
+            return webhook.send_message(message)
+        card_id = actions[0].card_id
+        messages = self._messages(board_id)
+        now = time.time()
+        living = messages.get(card_id)
+        if living is not None and now - living.posted_at <= self.window and \
+                living.webhook_id in webhook.webhook_ids and \
+                len(living.content) + 1 + len(message) <= self.max_length:
+            content = living.content + "\n" + message
+            try:
+                response = webhook.edit_message(living.webhook_id, living.message_id, content)
+            except network.errors() as exc:
+                if getattr(exc, 'response', None) is None or exc.response.status_code != 404:
+                    raise
+                logging.info("Living message of card %s was deleted, posting anew", card_id)
+            else:
+                messages[card_id] = living._replace(content=content)
+                self._dirty.add(board_id)
+                return response
+
+        response = webhook.send_message(message)
+        if isinstance(response, dict) and response.get('id') and response.get('webhook_id'):
+            messages[card_id] = LivingMessage(
+                response['webhook_id'], response['id'], now, message)
+            self._dirty.add(board_id)
+        return response
+
+    def flush(self):
+        """Writes changed boards' living messages, dropping those past the window."""
+
+        if not self._dirty:
+            return
+        now = time.time()
+        with persistence.persistent_storage(self.persist_path) as storage:
+            for board_id in self._dirty:
+                messages = self._boards[board_id]
+                for card_id, living in list(messages.items()):
+                    if now - living.posted_at > self.window:
+                        del messages[card_id]
+                storage[_key(board_id)] = messages
+        self._dirty.clear()
+
+#  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+"""Delivery metrics module."""
+
+import collections
+import logging
+import math
+import time
+
+from . import dates
+
+PERCENTILES = (50, 90, 99)
+
+
+def acknowledged_at(response):
+    """Returns when Discord acknowledged a message, out of send_message's response.
+
+    The edition timestamp of edited messages is preferred, and the current time is used
+    when the response holds no message timestamp.
+    """
+
+    if isinstance(response, dict) and response.get('edited_timestamp'):
+        return dates.parse(response['edited_timestamp'])
+    if isinstance(response, dict) and response.get('timestamp'):
+        return dates.parse(response['timestamp'])
+    return dates.now()
+
+
+def percentile(sorted_values, rank):
+    """Returns the nearest-rank rank-th percentile of a sorted, non-empty list."""
+
+    index = max(int(math.ceil(rank / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[index]
+
+
+class LagTracker(object):
+    """Tracks the freshness lag of delivered actions, per board and action type.
+
+    The lag of an action is the time elapsed between its Trello date and Discord's
+    acknowledgment of the message holding it. Percentiles are computed over the last
+    `window` samples of each (board id, action type) pair, and lags above `slo` seconds
+    are reported as warnings. Boards' outbound queue depths are tracked along.
+    """
+
+    def __init__(self, slo=0, summary_interval=300, window=1000):
+        self.slo = slo
+        self.summary_interval = summary_interval
+        self.window = window
+
+        self.counts = collections.Counter()
+        self.slo_breaches = collections.Counter()
+        self.queue_depths = dict()
+        self.max_queue_depths = collections.Counter()
+        self._samples = dict()
+        self._last_summary = time.monotonic()
+
+    def record(self, board_id, action_type, lag):
+        """Records the lag, in seconds, of a delivered action."""
+
+        key = (board_id, action_type)
+        if key not in self._samples:
+            self._samples[key] = collections.deque(maxlen=self.window)
+        self._samples[key].append(lag)
+        self.counts[key] = self.counts[key] + 1
+        if self.slo and lag > self.slo:
+            self.slo_breaches[key] = self.slo_breaches[key] + 1
+            logging.warning("Board %s %s action delivered %.1fs after it happened, over %ss SLO",
+                            board_id, action_type, lag, self.slo)
+
+    def record_delivery(self, board_id, actions, acked_at):
+        """Records the lag of every trello.Action held by a message acknowledged at acked_at."""
+
+        for action in actions:
+            lag = acked_at - dates.parse(action.date)
+            self.record(board_id, action.type, lag.total_seconds())
+
+    def record_depths(self, depths):
+        """Records boards' current outbound queue depths, out of a {board id: depth} dict."""
+
+        for board_id, depth in depths.items():
+            self.queue_depths[board_id] = depth
+            self.max_queue_depths[board_id] = max(self.max_queue_depths[board_id], depth)
+
+    def percentiles(self, board_id, action_type):
+        """Returns a {percentile: lag} dict of a given board and action type's recent lags."""
+
+        samples = sorted(self._samples.get((board_id, action_type), ()))
+        if not samples:
+            return dict()
+        return {rank: percentile(samples, rank) for rank in PERCENTILES}
+
+    def snapshot(self):
+        """Returns {(board id, action type): {percentile: lag}} for every tracked pair."""
+
+        return {key: self.percentiles(*key) for key in sorted(self._samples)}
+
+    def log_summary(self):
+        """Logs the lag percentiles of every tracked board and action type."""
+
+        self._last_summary = time.monotonic()
+        for (board_id, action_type), lags in self.snapshot().items():
+            logging.info(
+                "Board %s %s lag: %s (%d delivered, %d over SLO)",
+                board_id,
+                action_type,
+                ', '.join('p{}={:.1f}s'.format(rank, lags[rank]) for rank in PERCENTILES),
+                self.counts[(board_id, action_type)],
+                self.slo_breaches[(board_id, action_type)],
+            )
+        for board_id, depth in sorted(self.queue_depths.items()):
+            logging.info("Board %s queue depth: %d (max %d)",
+                         board_id, depth, self.max_queue_depths[board_id])
+
+    def maybe_log_summary(self):
+        """Logs a summary if summary_interval seconds went by since the previous one."""
+
+        if self.summary_interval and \
+                time.monotonic() - self._last_summary >= self.summary_interval:
+            self.log_summary()
+
+#  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
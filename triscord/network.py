@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+
+"""HTTP transport resilience module.
+
+`requests` is imported by the functions using it, as importing it slows startup down.
+"""
+
+import logging
+import random
+import time
+import urllib.parse
+
+# Methods which may safely be retried once a request might have reached the server
+IDEMPOTENT_METHODS = frozenset(['get', 'head', 'options', 'put', 'delete'])
+
+
+class DeadlineExceeded(RuntimeError):
+    """Raised when the current cycle ran out of time."""
+
+
+class CircuitOpen(RuntimeError):
+    """Raised when requesting an endpoint whose circuit breaker is open."""
+
+
+class Deadline(object):
+    """Total time budget shared by every request of a synchronisation cycle."""
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget
+
+    @property
+    def remaining(self):
+        """Seconds left before the deadline, never negative."""
+        return max(self.expires_at - time.monotonic(), 0)
+
+    def check(self):
+        """Raises DeadlineExceeded if the deadline has been reached."""
+
+        if not self.remaining:
+            raise DeadlineExceeded('Cycle deadline of {}s exceeded'.format(self.budget))
+
+    def sleep(self, delay):
+        """Sleeps for delay seconds, raising DeadlineExceeded if it would outlast the deadline."""
+
+        if delay > self.remaining:
+            raise DeadlineExceeded('Cannot wait {:.1f}s, cycle deadline of {}s would be '
+                                   'exceeded'.format(delay, self.budget))
+        time.sleep(delay)
+
+
+class CircuitBreaker(object):
+    """Stops requesting an endpoint after too many consecutive failures.
+
+    Once open, the circuit lets a single trial request through after `cooldown` seconds,
+    closing again on its success.
+    """
+
+    def __init__(self, threshold=5, cooldown=60):
+        self.threshold = threshold
+        self.cooldown = cooldown
+
+        self._failures = dict()
+        self._opened_at = dict()
+
+    def check(self, endpoint):
+        """Raises CircuitOpen if requests to endpoint are currently not allowed."""
+
+        opened_at = self._opened_at.get(endpoint)
+        if opened_at is None:
+            return
+        if time.monotonic() - opened_at < self.cooldown:
+            raise CircuitOpen('Circuit open for endpoint {}'.format(endpoint))
+        # Half-open: let this trial request through, re-open right away should it fail.
+        self._failures[endpoint] = self.threshold - 1
+        del self._opened_at[endpoint]
+
+    def success(self, endpoint):
+        """Records a successful request to endpoint."""
+
+        self._failures.pop(endpoint, None)
+
+    def failure(self, endpoint):
+        """Records a failed request to endpoint, opening its circuit past the threshold."""
+
+        self._failures[endpoint] = self._failures.get(endpoint, 0) + 1
+        if self._failures[endpoint] >= self.threshold:
+            logging.warning("CircuitBreaker: opening circuit for %s", endpoint)
+            self._opened_at[endpoint] = time.monotonic()
+
+
+class Transport(object):  # pylint: disable=R0902
+    """Executes HTTP requests with timeouts, retries, circuit breaking and a cycle deadline.
+
+    Requests share a `requests.Session`, reusing its connections for as long as the transport
+    is in use.
+    """
+
+    def __init__(self,  # pylint: disable=R0913
+                 connect_timeout=5,
+                 read_timeout=30,
+                 max_retries=3,
+                 backoff_base=0.5,
+                 backoff_max=30,
+                 breaker=None,
+                 deadline=None):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        if breaker is None:
+            breaker = CircuitBreaker()
+        self.breaker = breaker
+        self.deadline = deadline
+        self._session = None
+
+    @staticmethod
+    def endpoint(url):
+        """Returns the circuit breaker key of a given URL."""
+
+        parts = urllib.parse.urlsplit(url)
+        return parts.netloc + parts.path
+
+    @property
+    def session(self):
+        """`requests.Session` executing the requests, created upon the first one."""
+
+        if self._session is None:
+            import requests
+            self._session = requests.Session()
+        return self._session
+
+    @property
+    def timeout(self):
+        """(connect, read) timeout pair for the next request, capped by the deadline."""
+
+        connect_timeout, read_timeout = self.connect_timeout, self.read_timeout
+        if self.deadline is not None:
+            remaining = self.deadline.remaining
+            connect_timeout = min(connect_timeout, remaining)
+            read_timeout = min(read_timeout, remaining)
+        return connect_timeout, read_timeout
+
+    def backoff(self, attempt):
+        """Returns the jittered delay to wait before a given retry attempt."""
+
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def sleep(self, delay):
+        """Sleeps for delay seconds, within the cycle deadline if any."""
+
+        if self.deadline is not None:
+            self.deadline.sleep(delay)
+        else:
+            time.sleep(delay)
+
+    def request(self, name, url, *args, **kwargs):
+        """Executes a request of a given method, retrying on connection errors and 5xx responses.
+
+        Requests of methods which are not idempotent, such as posting a message, are only
+        retried when they could not reach the server, as they might have been processed.
+        """
+
+        import requests
+        endpoint = self.endpoint(url)
+        attempt = 0
+        while True:
+            if self.deadline is not None:
+                self.deadline.check()
+            self.breaker.check(endpoint)
+            try:
+                response = self.session.request(
+                    name, url, *args, timeout=self.timeout, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as exc:
+                error, response = exc, None
+            else:
+                if response.status_code < 500:
+                    self.breaker.success(endpoint)
+                    return response
+                error = requests.exceptions.HTTPError(
+                    '{} Server Error for url: {}'.format(response.status_code, endpoint),
+                    response=response,
+                )
+            self.breaker.failure(endpoint)
+            retryable = name in IDEMPOTENT_METHODS or (response is None and unsent(error))
+            if attempt >= self.max_retries or not retryable:
+                if response is not None:
+                    return response
+                raise error
+            delay = self.backoff(attempt)
+            attempt = attempt + 1
+            logging.warning("Transport.request(%s): %s, retry %d/%d in %.1fs",
+                            endpoint, error, attempt, self.max_retries, delay)
+            self.sleep(delay)
+
+
+def unsent(exc):
+    """Whether a failed request is known not to have reached the server.
+
+    Only connection establishment failures qualify: a request may have been processed
+    despite a read timeout or a dropped connection.
+    """
+
+    import requests
+    import urllib3
+    if isinstance(exc, requests.exceptions.ConnectTimeout):
+        return True
+    if not isinstance(exc, requests.exceptions.ConnectionError) or \
+            isinstance(exc, requests.exceptions.Timeout) or not exc.args:
+        return False
+    reason = getattr(exc.args[0], 'reason', exc.args[0])
+    return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+
+def errors():
+    """Returns the exception types raised by requests failing or running out of time."""
+
+    import requests
+    return (
+        requests.exceptions.HTTPError,
+        requests.exceptions.ConnectionError,
+        requests.exceptions.Timeout,
+        CircuitOpen,
+        DeadlineExceeded,
+    )
+
+
+def from_settings(network_settings):
+    """Returns a Transport configured from settings.NetworkSettings."""
+
+    return Transport(
+        connect_timeout=network_settings.connect_timeout,
+        read_timeout=network_settings.read_timeout,
+        max_retries=network_settings.max_retries,
+        backoff_base=network_settings.backoff_base,
+        backoff_max=network_settings.backoff_max,
+        breaker=CircuitBreaker(
+            threshold=network_settings.breaker_threshold,
+            cooldown=network_settings.breaker_cooldown,
+        ),
+    )
+
+#  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
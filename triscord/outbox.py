@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+"""Outbound messages prioritization module."""
+
+import collections
+import heapq
+import itertools
+import logging
+
+# Higher priorities are delivered first
+DEFAULT_PRIORITIES = {
+    'digest': 40,
+    'createCard': 30,
+    'commentCard': 30,
+    'moveCardToBoard': 20,
+    'updateCard': 20,
+    'addMemberToCard': 10,
+    'removeMemberFromCard': 10,
+    'updateCheckItemStateOnCard': 0,
+}
+DEFAULT_PRIORITY = 10
+
+
+class _Entry(object):  # pylint: disable=R0903
+    """Queued item bookkeeping."""
+
+    __slots__ = ('priority', 'sequence', 'action_type', 'item', 'alive')
+
+    def __init__(self, priority, sequence, action_type, item):
+        self.priority = priority
+        self.sequence = sequence
+        self.action_type = action_type
+        self.item = item
+        self.alive = True
+
+
+class Outbox(object):
+    """Priority queue of outbound items, preserving the ordering of items of a same card.
+
+    A card's pending items are delivered in order: a card's queue is scheduled with the
+    priority of its most important item, pulling less important predecessors along.
+    When a maximum depth is set, the oldest items among the least important sheddable
+    action types are dropped to stay within it. Dropped items are appended to `shed`, for
+    the caller to acknowledge them as handled.
+    """
+
+    def __init__(self, priorities=None, max_depth=0, sheddable_types=()):
+        # Action types are matched case-insensitively, as INI option names are lowercased
+        self.priorities = {
+            action_type.lower(): priority
+            for action_type, priority in DEFAULT_PRIORITIES.items()
+        }
+        self.priorities.update({
+            action_type.lower(): priority
+            for action_type, priority in (priorities or dict()).items()
+        })
+        self.max_depth = max_depth
+        self.sheddable_types = frozenset(sheddable_types)
+        self.shed_count = 0
+        self.shed = []
+
+        self._sequence = itertools.count()
+        self._length = 0
+        self._cards = dict()
+        self._heap = []
+        self._scheduled = dict()
+        self._sheddable = collections.defaultdict(collections.deque)
+
+    def __len__(self):
+        return self._length
+
+    def _schedule(self, card_key):
+        """Pushes a card's queue into the heap according to its current head and priority."""
+
+        entries = self._cards[card_key]
+        while entries and not entries[0].alive:
+            entries.popleft()
+        if not entries:
+            del self._cards[card_key]
+            self._scheduled.pop(card_key, None)
+            return
+        priority = max(entry.priority for entry in entries if entry.alive)
+        schedule = (-priority, entries[0].sequence)
+        if self._scheduled.get(card_key) != schedule:
+            self._scheduled[card_key] = schedule
+            heapq.heappush(self._heap, schedule + (card_key, ))
+
+    def push(self, item, action_type, card_id=None):
+        """Queues an item, related to a given action type and card if any."""
+
+        priority = self.priorities.get(action_type.lower(), DEFAULT_PRIORITY)
+        sequence = next(self._sequence)
+        entry = _Entry(priority, sequence, action_type, item)
+        card_key = card_id if card_id is not None else ('sequence', sequence)
+        self._cards.setdefault(card_key, collections.deque()).append(entry)
+        self._length = self._length + 1
+        if action_type in self.sheddable_types:
+            self._sheddable[priority].append(entry)
+        self._schedule(card_key)
+        if self.max_depth and self._length > self.max_depth:
+            self._shed()
+
+    def _shed(self):
+        """Drops the oldest least important sheddable items until within max_depth."""
+
+        for priority in sorted(self._sheddable):
+            entries = self._sheddable[priority]
+            while entries and self._length > self.max_depth:
+                entry = entries.popleft()
+                if entry.alive:
+                    entry.alive = False
+                    self._length = self._length - 1
+                    self.shed_count = self.shed_count + 1
+                    self.shed.append(entry.item)
+                    logging.warning("Outbox: queue depth over %d, dropped a %s message",
+                                    self.max_depth, entry.action_type)
+            if self._length <= self.max_depth:
+                return
+
+    def pop(self):
+        """Returns the next item to deliver."""
+
+        while self._heap:
+            priority, sequence, card_key = heapq.heappop(self._heap)
+            if self._scheduled.get(card_key) != (priority, sequence):
+                continue
+            entries = self._cards[card_key]
+            entry = entries.popleft()
+            if not entry.alive:
+                self._schedule(card_key)
+                continue
+            entry.alive = False
+            self._length = self._length - 1
+            del self._scheduled[card_key]
+            self._schedule(card_key)
+            return entry.item
+        raise IndexError('pop from an empty Outbox')
+
+    def head_priority(self):
+        """Returns the priority the next item to deliver is scheduled with, None if empty."""
+
+        while self._heap:
+            priority, sequence, card_key = self._heap[0]
+            if self._scheduled.get(card_key) == (priority, sequence):
+                return -priority
+            heapq.heappop(self._heap)
+        return None
+
+    def items(self):
+        """Returns all queued items, in no particular order."""
+
+        return [
+            entry.item
+            for entries in self._cards.values()
+            for entry in entries
+            if entry.alive
+        ]
+
+#  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
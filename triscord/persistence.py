@@ -3,9 +3,20 @@
 """Data persistence module."""
 
 import contextlib
+import fcntl
+import logging
 import os
 import shelve
 import stat
+import time
+
+
+class LeaseHeld(RuntimeError):
+    """Raised when another runner holds a persistence file's lease."""
+
+
+class LeaseLost(RuntimeError):
+    """Raised when a runner's lease was taken over by another one."""
 
 
 @contextlib.contextmanager
@@ -20,4 +31,119 @@ def persistent_storage(file_path, *args, **kwargs):
         yield storage
 
 
+class Lease(object):
+    """Exclusive lease over a persistence file, so that a single runner uses it at a time.
+
+    The lease is an fcntl lock over a `.lease` file next to the persistence file, holding
+    its owner's pid and heartbeat timestamp. Locks of dead runners are released by the
+    system; runners stalled for more than ttl seconds without a heartbeat lose their lease
+    to the next one, which replaces the lease file, and find out on their next heartbeat.
+    """
+
+    def __init__(self, file_path, ttl=600, wait=0, poll_interval=1):
+        self.file_path = file_path + '.lease'
+        self.ttl = ttl
+        self.wait = wait
+        self.poll_interval = poll_interval
+
+        self._file = None
+        self._beaten_at = None
+
+    def _owned(self):
+        """Whether the lease file is still the one this runner locked."""
+
+        try:
+            return os.stat(self.file_path).st_ino == os.fstat(self._file.fileno()).st_ino
+        except FileNotFoundError:
+            return False
+
+    def _write(self):
+        """Writes the owner's pid and heartbeat timestamp into the lease file."""
+
+        self._beaten_at = time.time()
+        self._file.seek(0)
+        self._file.truncate()
+        self._file.write('{} {}'.format(os.getpid(), self._beaten_at))
+        self._file.flush()
+
+    @staticmethod
+    def _heartbeat_of(lease_file):
+        """Returns the (pid, heartbeat timestamp) written in a lease file, or None."""
+
+        try:
+            pid, beaten_at = lease_file.read().split()
+            return int(pid), float(beaten_at)
+        except ValueError:
+            return None
+
+    def _try_acquire(self):
+        """Attempts to lock the lease file, taking stale leases over.
+
+        Returns whether the lease was acquired.
+        """
+
+        file_descriptor = os.open(self.file_path, os.O_RDWR | os.O_CREAT, 0o600)
+        lease_file = os.fdopen(file_descriptor, 'r+')
+        try:
+            fcntl.flock(lease_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            heartbeat = self._heartbeat_of(lease_file)
+            if heartbeat is not None and time.time() - heartbeat[1] > self.ttl and \
+                    os.stat(self.file_path).st_ino == os.fstat(file_descriptor).st_ino:
+                logging.warning("Lease %s of pid %d is stale, taking it over",
+                                self.file_path, heartbeat[0])
+                os.unlink(self.file_path)
+            lease_file.close()
+            return False
+        self._file = lease_file
+        if not self._owned():
+            # Taken over between opening and locking it
+            self._file = None
+            lease_file.close()
+            return False
+        self._write()
+        return True
+
+    def acquire(self):
+        """Acquires the lease, waiting up to wait seconds, or raises LeaseHeld."""
+
+        deadline = time.monotonic() + self.wait
+        while True:
+            if self._try_acquire():
+                return
+            if not os.path.exists(self.file_path):
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise LeaseHeld('{} is held by another runner'.format(self.file_path))
+            time.sleep(min(self.poll_interval, remaining))
+
+    def heartbeat(self):
+        """Refreshes the lease's heartbeat, or raises LeaseLost if it was taken over.
+
+        The heartbeat timestamp is only written every quarter of the ttl.
+        """
+
+        if not self._owned():
+            raise LeaseLost('{} was taken over by another runner'.format(self.file_path))
+        if time.time() - self._beaten_at >= self.ttl / 4:
+            self._write()
+
+    def release(self):
+        """Releases the lease."""
+
+        if self._owned():
+            os.unlink(self.file_path)
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *_):
+        self.release()
+
+
 #  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+"""Client-side rate limiting module."""
+
+import collections
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+
+class SlidingWindowLimiter(object):
+    """Delays callers so that no key is used more than its limit within a sliding period.
+
+    A single instance is meant to be shared by every user of a given quota, e.g. all API
+    clients of a process, and is safe to use from several threads.
+    """
+
+    def __init__(self, period):
+        self.period = period
+
+        self._lock = threading.Lock()
+        self._history = collections.defaultdict(collections.deque)
+        self._blocked_until = dict()
+
+    def _delay(self, key, limit, now):
+        """Returns how long to wait before a request can be made on a given key."""
+
+        history = self._history[key]
+        while history and history[0] <= now - self.period:
+            history.popleft()
+
+        delay = self._blocked_until.get(key, now) - now
+        if len(history) >= limit:
+            delay = max(delay, history[-limit] + self.period - now)
+        return max(delay, 0)
+
+    def acquire(self, limits):
+        """Blocks until every (key, limit) pair allows one more request, then records it."""
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                delay = max(self._delay(key, limit, now) for key, limit in limits)
+                if not delay:
+                    for key, _ in limits:
+                        self._history[key].append(now)
+                    return
+            logging.debug("SlidingWindowLimiter.acquire: quota reached, waiting %.3fs", delay)
+            time.sleep(delay)
+
+    def block(self, keys, delay):
+        """Prevents any request on the given keys for delay seconds, e.g. after a 429."""
+
+        with self._lock:
+            blocked_until = time.monotonic() + delay
+            for key in keys:
+                self._blocked_until[key] = max(self._blocked_until.get(key, 0), blocked_until)
+
+
+class SharedBucketState(object):
+    """Rate limit buckets state shared by all processes through a lock-protected file.
+
+    Buckets are identified by a hash of their key, so that secrets such as webhook URLs are
+    never written to disk. Timestamps are expressed in seconds since the epoch.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+
+    @staticmethod
+    def _bucket_id(key):
+        """Returns the identifier under which a key's bucket is stored."""
+
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    @contextlib.contextmanager
+    def _locked_state(self):
+        """Yields the exclusively locked state dict, writing it back afterwards."""
+
+        file_descriptor = os.open(self.file_path, os.O_RDWR | os.O_CREAT, 0o600)
+        with os.fdopen(file_descriptor, 'r+') as state_file:
+            fcntl.flock(state_file, fcntl.LOCK_EX)
+            try:
+                try:
+                    state = json.loads(state_file.read() or '{}')
+                except ValueError:
+                    logging.warning("SharedBucketState: discarding corrupted %s", self.file_path)
+                    state = dict()
+                yield state
+                state_file.seek(0)
+                state_file.truncate()
+                json.dump(state, state_file)
+                state_file.flush()
+            finally:
+                fcntl.flock(state_file, fcntl.LOCK_UN)
+
+    def reserve(self, key, now):
+        """Reserves a request slot in key's bucket.
+
+        Returns 0 if a request can be made right away, or the delay until the bucket resets.
+        """
+
+        with self._locked_state() as state:
+            bucket = state.get(self._bucket_id(key))
+            if bucket is None or bucket['reset'] <= now:
+                return 0
+            if bucket['remaining'] > 0:
+                bucket['remaining'] = bucket['remaining'] - 1
+                return 0
+            return bucket['reset'] - now
+
+    def update(self, key, remaining, reset):
+        """Records a bucket's state as reported by the server."""
+
+        with self._locked_state() as state:
+            state[self._bucket_id(key)] = {'remaining': remaining, 'reset': reset}
+
+#  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
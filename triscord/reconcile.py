@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+
+"""Board snapshots reconciliation, catching up on changes the actions feed missed."""
+
+import collections
+import hashlib
+import json
+import logging
+
+from . import dates
+from . import persistence
+from . import trello
+
+CARD_FIELDS = 'name,idList,idLabels,idMembers,due,dateLastActivity'
+
+# Card state tuples, as stored along with their content hash
+CardState = collections.namedtuple('CardState', ['name', 'list_id', 'label_ids', 'member_ids',
+                                                 'due'])
+
+# CardState fields updated by updateCard actions' fields
+UPDATE_FIELDS = {
+    'idList': 'list_id',
+    'name': 'name',
+    'due': 'due',
+}
+
+# Creator of synthetic actions, the actual one being unknown
+SYNTHETIC_CREATOR = 'someone'
+
+
+def _key(board_id):
+    """Returns the persistent storage key holding a board's last snapshot."""
+
+    return 'snapshot/{}'.format(board_id)
+
+
+def card_state(card):
+    """Returns the CardState of a card, as returned by Trello."""
+
+    return CardState(
+        card['name'],
+        card['idList'],
+        tuple(sorted(card['idLabels'])),
+        tuple(sorted(card['idMembers'])),
+        card['due'],
+    )
+
+
+def content_hash(state):
+    """Returns the content hash of a CardState."""
+
+    return hashlib.sha1(json.dumps(state).encode('utf-8')).hexdigest()
+
+
+def _apply(state, action):
+    """Returns a card's CardState once updated with a delivered trello.Action, or None."""
+
+    if action.type == 'addMemberToCard':
+        return state._replace(member_ids=tuple(sorted(set(state.member_ids) | {action.member_id})))
+    if action.type == 'removeMemberFromCard':
+        return state._replace(member_ids=tuple(
+            member_id for member_id in state.member_ids if member_id != action.member_id))
+    if action.type != 'updateCard':
+        return state
+    for field in action.old:
+        if field == 'closed' and action.new.get('closed'):
+            return None
+        if field in UPDATE_FIELDS:
+            state = state._replace(**{UPDATE_FIELDS[field]: action.new.get(field)})
+    return state
+
+
+def _synthetic_action(action_type, card_id, state, date,  # pylint: disable=R0913
+                      update=None, member=None, **data):
+    """Returns a raw action, as Trello would, of a change found by reconciliation.
+
+    update is the (field, old value, new value) triple of an updateCard action.
+    """
+
+    raw_action = {
+        'id': None,
+        'type': action_type,
+        'date': date,
+        'memberCreator': {'username': SYNTHETIC_CREATOR},
+        'data': dict(data, card={'id': card_id, 'name': state.name}),
+    }
+    if update is not None:
+        field, old_value, new_value = update
+        raw_action['data']['card'][field] = new_value
+        raw_action['data']['old'] = {field: old_value}
+    if member is not None:
+        raw_action['member'] = member
+    return raw_action
+
+
+class Lookups(object):  # pylint: disable=R0903
+    """Names of a board's lists, labels and members, by id."""
+
+    def __init__(self, lists, labels, members):
+        self.lists = {board_list['id']: board_list['name'] for board_list in lists}
+        self.labels = {
+            label['id']: label['name'] or label['color'] or label['id'] for label in labels
+        }
+        self.members = {member['id']: member['username'] for member in members}
+
+    def list_name(self, list_id):
+        """Returns the name of a given list, its id if unknown."""
+
+        return self.lists.get(list_id, list_id)
+
+    def label_names(self, label_ids):
+        """Returns the sorted, comma-separated names of given labels, or `none`."""
+
+        names = sorted(self.labels.get(label_id, label_id) for label_id in label_ids)
+        return ', '.join(names) or 'none'
+
+    def member(self, member_id):
+        """Returns a raw member of a given id."""
+
+        return {'id': member_id, 'username': self.members.get(member_id, member_id)}
+
+
+def diff(card_id, old, new, lookups, date):
+    """Returns the raw actions turning a card's old CardState into its new one."""
+
+    raw_actions = []
+    if new.list_id != old.list_id:
+        raw_actions.append(_synthetic_action(
+            'updateCard', card_id, new, date,
+            update=('idList', old.list_id, new.list_id),
+            listBefore={'id': old.list_id, 'name': lookups.list_name(old.list_id)},
+            listAfter={'id': new.list_id, 'name': lookups.list_name(new.list_id)},
+        ))
+    if new.name != old.name:
+        raw_actions.append(_synthetic_action(
+            'updateCard', card_id, new, date, update=('name', old.name, new.name)))
+    if new.due != old.due:
+        raw_actions.append(_synthetic_action(
+            'updateCard', card_id, new, date, update=('due', old.due, new.due)))
+    if new.label_ids != old.label_ids:
+        raw_actions.append(_synthetic_action(
+            'updateCard', card_id, new, date, update=(
+                'labels', lookups.label_names(old.label_ids), lookups.label_names(new.label_ids),
+            )))
+    for member_id in sorted(set(new.member_ids) - set(old.member_ids)):
+        raw_actions.append(_synthetic_action(
+            'addMemberToCard', card_id, new, date, member=lookups.member(member_id)))
+    for member_id in sorted(set(old.member_ids) - set(new.member_ids)):
+        raw_actions.append(_synthetic_action(
+            'removeMemberFromCard', card_id, new, date, member=lookups.member(member_id)))
+    return raw_actions
+
+
+class Reconciler(object):
+    """Compares boards' snapshots with the previous ones to find changes the feed missed.
+
+    Each card's state is stored along with its content hash, kept up to date with the
+    actions the feed delivers. A new snapshot is only compared field by field for cards
+    whose hash changed, turning differences into synthetic raw actions. Cards active
+    since the feed's last fetch are left for the next reconciliation, as their actions
+    may not have been delivered yet.
+    """
+
+    def __init__(self, persist_path, interval=0):
+        self.persist_path = persist_path
+        self.interval = interval
+
+        self._pending = collections.defaultdict(list)
+
+    def add(self, board_id, actions):
+        """Records delivered trello.Action instances of a board."""
+
+        if self.interval:
+            self._pending[board_id].extend(
+                action for action in actions if action.card_id is not None)
+
+    def flush(self):
+        """Applies delivered actions to the stored snapshots."""
+
+        if not self._pending:
+            return
+        with persistence.persistent_storage(self.persist_path) as storage:
+            for board_id, actions in self._pending.items():
+                cards = storage.get(_key(board_id))
+                if cards is None:
+                    continue
+                for action in actions:
+                    if action.card_id not in cards:
+                        continue
+                    state = _apply(cards[action.card_id][1], action)
+                    if state is None:
+                        del cards[action.card_id]
+                    else:
+                        cards[action.card_id] = (content_hash(state), state)
+                storage[_key(board_id)] = cards
+        self._pending.clear()
+
+    def due(self, board_ids, now):
+        """Returns the boards whose reconciliation is due, marking them reconciled."""
+
+        due = []
+        if not self.interval:
+            return due
+        with persistence.persistent_storage(self.persist_path) as storage:
+            for board_id in board_ids:
+                key = 'reconciled/{}'.format(board_id)
+                reconciled = storage.get(key)
+                if reconciled is not None and \
+                        (now - dates.parse(reconciled)).total_seconds() < self.interval:
+                    continue
+                storage[key] = now.isoformat()
+                due.append(board_id)
+        return due
+
+    @staticmethod
+    def snapshot(feed):
+        """Fetches a board's open cards and lookups in a single batch request.
+
+        Returns a ({card id: card} dict, Lookups) pair, or None if any route failed.
+        """
+
+        board = '/boards/{board_id}'.format(board_id=feed.board_id)
+        results = feed.api.batch([
+            trello.TrelloAPI.route(board + '/cards', {'fields': CARD_FIELDS}),
+            trello.TrelloAPI.route(board + '/lists', {'fields': 'name', 'filter': 'all'}),
+            trello.TrelloAPI.route(board + '/labels', {'fields': 'name,color'}),
+            trello.TrelloAPI.route(board + '/members', {'fields': 'username'}),
+        ])
+        if None in results:
+            return None
+        cards, lists, labels, members = results
+        return {card['id']: card for card in cards}, Lookups(lists, labels, members)
+
+    def reconcile(self, feed, fetched_at):
+        """Snapshots a board, returning raw actions for the changes the feed missed.
+
+        fetched_at is when the feed last fetched actions, all of which were delivered.
+        Synthetic actions are chronological, and the board's first snapshot yields none.
+        """
+
+        snapshot = self.snapshot(feed)
+        if snapshot is None:
+            logging.warning("Could not snapshot board %s, skipping reconciliation", feed.board_id)
+            return []
+        cards, lookups = snapshot
+        date = fetched_at.isoformat()
+
+        raw_actions = []
+        with persistence.persistent_storage(self.persist_path) as storage:
+            previous = storage.get(_key(feed.board_id))
+            stored = dict()
+            for card_id, card in cards.items():
+                state = card_state(card)
+                stored[card_id] = (content_hash(state), state)
+                if previous is None or card_id not in previous or \
+                        previous[card_id][0] == stored[card_id][0]:
+                    continue
+                last_activity = card.get('dateLastActivity')
+                if last_activity is not None and dates.parse(last_activity) > fetched_at:
+                    stored[card_id] = previous[card_id]
+                    continue
+                raw_actions.extend(diff(card_id, previous[card_id][1], state, lookups, date))
+            storage[_key(feed.board_id)] = stored
+        if raw_actions:
+            logging.info("Reconciliation of board %s found %d missed changes",
+                         feed.board_id, len(raw_actions))
+        return raw_actions
+
+#  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
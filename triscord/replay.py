@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+"""Offline replay of recorded Trello actions."""
+
+import contextlib
+import json
+import logging
+import sys
+import time
+
+from . import actionlog
+from . import coalesce
+from . import settings
+from . import trello
+
+
+def read_actions(input_path):
+    """Generator yielding raw actions chronologically out of a recorded dump.
+
+    `.jsonl` files hold one action per line, in chronological order, and are streamed.
+    Other files hold a JSON array as returned by Trello's API, newest first.
+    """
+
+    if input_path.endswith('.jsonl'):
+        with open(input_path, 'r') as input_file:
+            for line in input_file:
+                if line.strip():
+                    yield json.loads(line)
+        return
+    with open(input_path, 'r') as input_file:
+        actions = json.load(input_file)
+    while actions:
+        yield actions.pop()
+
+
+@contextlib.contextmanager
+def open_output(output_path):
+    """Opens output_path for writing, `-` standing for the standard output."""
+
+    if output_path == '-':
+        yield sys.stdout
+    else:
+        with open(output_path, 'w') as output_file:
+            yield output_file
+
+
+def render(feed, raw_actions, coalesce_window=0):
+    """Generator rendering chronological raw actions through a feed's filters and formatters.
+
+    Yields (action, message) pairs, message being None for actions rendering to nothing.
+    """
+
+    actions = feed.filter_actions(raw_actions)
+    if coalesce_window:
+        actions = coalesce.iter_coalesced(actions, coalesce_window)
+    for action in actions:
+        yield action, feed.format_action(action)
+
+
+def replay(feed, raw_actions, output_file, coalesce_window=0):
+    """Renders raw actions through a feed's filters and formatters into JSON lines.
+
+    Returns the number of replayed actions and written messages.
+    """
+
+    actions_count, messages_count = 0, 0
+    for action, message in render(feed, raw_actions, coalesce_window):
+        actions_count = actions_count + 1
+        if not message:
+            continue
+        messages_count = messages_count + 1
+        output_file.write(json.dumps({
+            'id': action.id,
+            'type': action.type,
+            'date': action.date,
+            'board_id': feed.board_id,
+            'message': message,
+        }) + '\n')
+    return actions_count, messages_count
+
+
+def board_settings(current_settings, board_id):
+    """Returns the settings of a given board, or of the first configured one."""
+
+    if board_id is None:
+        return current_settings.boards[0]
+    for board in current_settings.boards:
+        if board.board_id == board_id:
+            return board
+    raise settings.InvalidSettings('Board {} is not configured'.format(board_id))
+
+
+def main(config_path, input_path=None, output_path='-',  # pylint: disable=R0913
+         board_id=None, since=None, until=None, debug=False, **_):
+    """Replay command, rendering a recorded dump with a configured board's rules.
+
+    Without input_path, the board's actions between since and until are read from the
+    configured action log.
+    """
+
+    if debug:
+        logging.getLogger().setLevel(logging.DEBUG)
+
+    current_settings = settings.load(config_path)
+    board = board_settings(current_settings, board_id)
+    if input_path is not None:
+        raw_actions = read_actions(input_path)
+    elif current_settings.action_log.path is not None:
+        raw_actions = actionlog.ActionLog(current_settings.action_log.path).scan(
+            board.board_id, since=since, until=until)
+    else:
+        raise settings.InvalidSettings('No input given and no [ActionLog] path configured')
+    feed = trello.TrelloActivityFeed(
+        None,
+        board_id=board.board_id,
+        muted_action_types=board.muted_action_types,
+        muted_update_fields=board.muted_update_fields,
+        muted_update_lists=board.muted_update_lists,
+    )
+
+    started_at = time.perf_counter()
+    with open_output(output_path) as output_file:
+        actions_count, messages_count = replay(
+            feed,
+            raw_actions,
+            output_file,
+            coalesce_window=current_settings.coalesce_window,
+        )
+    elapsed = time.perf_counter() - started_at
+
+    print(
+        "Replayed {} actions into {} messages in {:.3f}s ({:.0f} actions/s)".format(
+            actions_count,
+            messages_count,
+            elapsed,
+            actions_count / elapsed if elapsed else 0,
+        ),
+        file=sys.stderr,
+    )
+    return actions_count, messages_count
+
+#  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
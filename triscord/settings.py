@@ -2,7 +2,10 @@
 
 """INI settings wrapper module."""
 
+import collections
 import configparser
+import logging
+import os
 
 
 class TriscordConfigParser(configparser.ConfigParser):  # pylint: disable=R0901
@@ -19,6 +22,280 @@ class TriscordConfigParser(configparser.ConfigParser):  # pylint: disable=R0901
         self._loaded = True
         return super()._read(*args, **kwargs)
 
-CONFIG = TriscordConfigParser()
+
+class InvalidSettings(RuntimeError):
+    """Raised when a configuration file cannot be loaded or holds invalid values."""
+
+
+NetworkSettings = collections.namedtuple('NetworkSettings', [
+    'connect_timeout',
+    'read_timeout',
+    'cycle_deadline',
+    'max_retries',
+    'backoff_base',
+    'backoff_max',
+    'breaker_threshold',
+    'breaker_cooldown',
+])
+
+MetricsSettings = collections.namedtuple('MetricsSettings', [
+    'lag_slo',
+    'summary_interval',
+    'window',
+])
+
+ActionLogSettings = collections.namedtuple('ActionLogSettings', [
+    'path',
+    'segment_size',
+    'retention_days',
+])
+
+BoardSettings = collections.namedtuple('BoardSettings', [
+    'board_id',
+    'webhook_url',
+    'muted_action_types',
+    'muted_update_fields',
+    'muted_update_lists',
+    'weight',
+    'cycle_budget',
+])
+
+Settings = collections.namedtuple('Settings', [
+    'trello_key',
+    'trello_token',
+    'batch_requests',
+    'boards',
+    'digest_threshold',
+    'digest_top_items',
+    'coalesce_window',
+    'priorities',
+    'queue_max_depth',
+    'shed_action_types',
+    'rate_state_path',
+    'poll_interval',
+    'workers',
+    'shutdown_grace',
+    'checkpoint_every',
+    'checkpoint_interval',
+    'network',
+    'metrics',
+    'action_log',
+    'stats_digest_days',
+    'reconcile_interval',
+    'living_window',
+    'lease_ttl',
+    'lease_wait',
+])
+
+
+def split_values(value):
+    """Returns a comma-separated setting as a tuple of stripped, non-empty values."""
+
+    return tuple(item.strip() for item in str(value).split(',') if item.strip())
+
+
+def _positive(value, name):
+    """Returns value, raising InvalidSettings if it is negative."""
+
+    if value < 0:
+        raise InvalidSettings('Setting {} must not be negative, got {}'.format(name, value))
+    return value
+
+
+def _network_settings(config):
+    """Builds the NetworkSettings out of the `Network` section."""
+
+    section = 'Network'
+    return NetworkSettings(
+        connect_timeout=_positive(
+            config.getfloat(section, 'connect_timeout', fallback=5), 'connect_timeout'),
+        read_timeout=_positive(
+            config.getfloat(section, 'read_timeout', fallback=30), 'read_timeout'),
+        cycle_deadline=_positive(
+            config.getfloat(section, 'cycle_deadline', fallback=0), 'cycle_deadline'),
+        max_retries=_positive(
+            config.getint(section, 'max_retries', fallback=3), 'max_retries'),
+        backoff_base=_positive(
+            config.getfloat(section, 'backoff_base', fallback=0.5), 'backoff_base'),
+        backoff_max=_positive(
+            config.getfloat(section, 'backoff_max', fallback=30), 'backoff_max'),
+        breaker_threshold=_positive(
+            config.getint(section, 'breaker_threshold', fallback=5), 'breaker_threshold'),
+        breaker_cooldown=_positive(
+            config.getfloat(section, 'breaker_cooldown', fallback=60), 'breaker_cooldown'),
+    )
+
+
+def _metrics_settings(config):
+    """Builds the MetricsSettings out of the `Metrics` section."""
+
+    section = 'Metrics'
+    return MetricsSettings(
+        lag_slo=_positive(config.getfloat(section, 'lag_slo', fallback=0), 'lag_slo'),
+        summary_interval=_positive(
+            config.getfloat(section, 'summary_interval', fallback=300), 'summary_interval'),
+        window=_positive(config.getint(section, 'window', fallback=1000), 'window') or 1,
+    )
+
+
+def _action_log_settings(config):
+    """Builds the ActionLogSettings out of the `ActionLog` section."""
+
+    section = 'ActionLog'
+    return ActionLogSettings(
+        path=config.get(section, 'path', fallback=None) or None,
+        segment_size=_positive(
+            config.getint(section, 'segment_size', fallback=64 * 1024 * 1024), 'segment_size'),
+        retention_days=_positive(
+            config.getint(section, 'retention_days', fallback=0), 'retention_days'),
+    )
+
+
+def _board_settings(config, board_id):
+    """Builds a board's BoardSettings, `Board:<board_id>` section overriding defaults."""
+
+    section = 'Board:{}'.format(board_id)
+
+    def _get(option, default_section, fallback=None):
+        """Returns an option from the board section or from the default one."""
+        return config.get(section, option, fallback=config.get(
+            default_section, option, fallback=fallback,
+        ))
+
+    webhook_url = _get('webhook_url', 'Discord')
+    if not webhook_url:
+        raise InvalidSettings('No webhook_url configured for board {}'.format(board_id))
+    weight = float(_get('weight', 'Scheduling', 1))
+    if weight <= 0:
+        raise InvalidSettings('Setting weight must be positive, got {}'.format(weight))
+    return BoardSettings(
+        board_id=board_id,
+        webhook_url=webhook_url,
+        muted_action_types=frozenset(split_values(_get('muted_action_types', 'Trello', ""))),
+        muted_update_fields=frozenset(split_values(_get('muted_update_fields', 'Trello', ""))),
+        muted_update_lists=frozenset(split_values(_get('muted_update_lists', 'Trello', ""))),
+        weight=weight,
+        cycle_budget=_positive(int(_get('cycle_budget', 'Scheduling', 0)), 'cycle_budget'),
+    )
+
+
+def select_boards(current_settings, board_ids):
+    """Returns settings restricted to the given boards, or unchanged if board_ids is None."""
+
+    if board_ids is None:
+        return current_settings
+    return current_settings._replace(boards=tuple(
+        board for board in current_settings.boards if board.board_id in board_ids
+    ))
+
+
+def from_config(config):
+    """Builds a frozen Settings instance out of a loaded TriscordConfigParser."""
+
+    try:
+        board_ids = split_values(config.get('Trello', 'board_id'))
+        if not board_ids:
+            raise InvalidSettings('No board_id configured')
+        return Settings(
+            trello_key=config.get('Trello', 'key'),
+            trello_token=config.get('Trello', 'token'),
+            batch_requests=config.getboolean('Trello', 'batch_requests', fallback=True),
+            boards=tuple(_board_settings(config, board_id) for board_id in board_ids),
+            digest_threshold=_positive(
+                config.getint('Discord', 'digest_threshold', fallback=100), 'digest_threshold'),
+            digest_top_items=_positive(
+                config.getint('Discord', 'digest_top_items', fallback=5), 'digest_top_items'),
+            coalesce_window=_positive(
+                config.getfloat('Discord', 'coalesce_window', fallback=60), 'coalesce_window'),
+            priorities=tuple(sorted(
+                (action_type, config.getint('Priorities', action_type))
+                for action_type in config.options('Priorities')
+            )) if config.has_section('Priorities') else (),
+            queue_max_depth=_positive(
+                config.getint('Discord', 'queue_max_depth', fallback=0), 'queue_max_depth'),
+            shed_action_types=frozenset(split_values(
+                config.get('Discord', 'shed_action_types', fallback=""))),
+            rate_state_path=config.get('Discord', 'rate_state_path', fallback=None),
+            poll_interval=_positive(
+                config.getfloat('Daemon', 'poll_interval', fallback=60), 'poll_interval'),
+            workers=_positive(config.getint('Daemon', 'workers', fallback=0), 'workers'),
+            shutdown_grace=_positive(
+                config.getfloat('Daemon', 'shutdown_grace', fallback=10), 'shutdown_grace'),
+            checkpoint_every=_positive(
+                config.getint('Checkpoint', 'every', fallback=20), 'checkpoint_every'),
+            checkpoint_interval=_positive(
+                config.getfloat('Checkpoint', 'interval', fallback=1), 'checkpoint_interval'),
+            network=_network_settings(config),
+            metrics=_metrics_settings(config),
+            action_log=_action_log_settings(config),
+            stats_digest_days=_positive(
+                config.getint('Stats', 'digest_days', fallback=0), 'stats_digest_days'),
+            reconcile_interval=_positive(
+                config.getfloat('Reconcile', 'interval', fallback=0), 'reconcile_interval'),
+            living_window=_positive(
+                config.getfloat('Discord', 'living_window', fallback=0), 'living_window'),
+            lease_ttl=_positive(config.getfloat('Lease', 'ttl', fallback=600), 'lease_ttl'),
+            lease_wait=_positive(config.getfloat('Lease', 'wait', fallback=0), 'lease_wait'),
+        )
+    except (configparser.Error, ValueError) as exc:
+        raise InvalidSettings(str(exc))
+
+
+def load(config_path):
+    """Reads and validates a configuration file, returning its frozen Settings."""
+
+    config = TriscordConfigParser()
+    try:
+        if not config.read(config_path):
+            raise InvalidSettings('Could not read configuration file {}'.format(config_path))
+    except configparser.Error as exc:
+        raise InvalidSettings(str(exc))
+    return from_config(config)
+
+
+class SettingsWatcher(object):
+    """Watches a configuration file, reloading it on modification or on demand."""
+
+    def __init__(self, config_path, current):
+        self.config_path = config_path
+        self.current = current
+
+        self._mtime = self._modification_time()
+        self._reload_requested = False
+
+    def _modification_time(self):
+        """Returns the configuration file's modification time, or None if unavailable."""
+
+        try:
+            return os.stat(self.config_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def request_reload(self, *_):
+        """Forces a reload on next poll, suitable as a SIGHUP handler."""
+
+        self._reload_requested = True
+
+    def poll(self):
+        """Returns freshly loaded settings if they changed since last poll, None otherwise.
+
+        Invalid configuration files are reported and ignored, keeping current settings.
+        """
+
+        mtime = self._modification_time()
+        if mtime == self._mtime and not self._reload_requested:
+            return None
+        self._mtime = mtime
+        self._reload_requested = False
+
+        try:
+            new_settings = load(self.config_path)
+        except InvalidSettings as exc:
+            logging.error("Configuration reload failed, keeping current settings: %s", exc)
+            return None
+        if new_settings == self.current:
+            return None
+        self.current = new_settings
+        return new_settings
 
 #  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
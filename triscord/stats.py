@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+"""Incrementally maintained boards activity statistics."""
+
+import collections
+import datetime
+import logging
+
+from . import dates
+from . import digest
+from . import discord
+from . import network
+from . import persistence
+from . import ratelimit
+from . import replay
+from . import settings
+from . import supervisor
+
+CARD_EVENTS = ('created', 'moved', 'closed')
+
+
+def _key(day, board_id):
+    """Returns the persistent storage key holding a board's statistics of a given day."""
+
+    return 'stats/{}/{}'.format(day, board_id)
+
+
+def _card_event(action):
+    """Returns the card event, among CARD_EVENTS, an action stands for, if any."""
+
+    if action.type in ('createCard', 'moveCardToBoard'):
+        return 'created'
+    if action.type == 'updateCard':
+        if 'idList' in action.old:
+            return 'moved'
+        if 'closed' in action.old and action.new.get('closed'):
+            return 'closed'
+    return None
+
+
+def count(counters, action):
+    """Adds a trello.Action to a Counter of (kind, name) keys."""
+
+    counters[('type', action.type)] += 1
+    if action.creator:
+        counters[('member', action.creator)] += 1
+    list_name = digest.action_list(action)
+    if list_name:
+        counters[('list', list_name)] += 1
+    event = _card_event(action)
+    if event:
+        counters[('cards', event)] += 1
+
+
+class StatsRecorder(object):
+    """Maintains per board and per day activity counters in the persistence file.
+
+    Actions are counted in memory as they get delivered, and merged into the persisted
+    counters of their day on flush.
+    """
+
+    def __init__(self, persist_path):
+        self.persist_path = persist_path
+
+        self._pending = collections.defaultdict(collections.Counter)
+
+    def add(self, board_id, actions):
+        """Counts delivered trello.Action instances of a board."""
+
+        for action in actions:
+            date = dates.parse(action.date).astimezone(datetime.timezone.utc)
+            day = date.strftime('%Y-%m-%d')
+            count(self._pending[(day, board_id)], action)
+
+    def flush(self):
+        """Merges pending counters into the persisted ones."""
+
+        if not self._pending:
+            return
+        with persistence.persistent_storage(self.persist_path) as storage:
+            for (day, board_id), counters in self._pending.items():
+                key = _key(day, board_id)
+                storage[key] = storage.get(key, collections.Counter()) + counters
+        self._pending.clear()
+
+    def due_digests(self, board_ids, days, now):
+        """Returns the boards whose scheduled digest of the last days is due, marking them sent.
+
+        Boards are first scheduled days after they are first seen.
+        """
+
+        due = []
+        with persistence.persistent_storage(self.persist_path) as storage:
+            for board_id in board_ids:
+                key = 'stats_posted/{}'.format(board_id)
+                posted = storage.get(key)
+                if posted is not None and \
+                        now < dates.parse(posted) + datetime.timedelta(days=days):
+                    continue
+                storage[key] = now.isoformat()
+                if posted is not None:
+                    due.append(board_id)
+        return due
+
+
+def load(persist_paths, board_id, since, until):
+    """Returns the summed counters of a board for the days within [since, until)."""
+
+    since = dates.parse(since).astimezone(datetime.timezone.utc)
+    until = dates.parse(until).astimezone(datetime.timezone.utc)
+    days = []
+    day = since.date()
+    while since < until and day <= (until - datetime.timedelta(microseconds=1)).date():
+        days.append(day.isoformat())
+        day = day + datetime.timedelta(days=1)
+    counters = collections.Counter()
+    for persist_path in persist_paths:
+        with persistence.persistent_storage(persist_path) as storage:
+            for day in days:
+                counters.update(storage.get(_key(day, board_id), collections.Counter()))
+    return counters
+
+
+def summary_messages(board_id, counters, since, until, top_items=5,
+                     max_length=digest.MESSAGE_MAX_LENGTH):
+    """Renders a board's counters as a few messages."""
+
+    lines = [
+        "Activity of board {} from {} to {}: {}.".format(
+            board_id,
+            since.strftime('%Y-%m-%d'),
+            until.strftime('%Y-%m-%d'),
+            ', '.join('{} cards {}'.format(counters[('cards', event)], event)
+                      for event in CARD_EVENTS),
+        ),
+    ]
+    for kind, title in (('type', "Action types"), ('member', "Members"), ('list', "Lists")):
+        lines.extend(digest.top_lines(title, collections.Counter({
+            name: value for (counter_kind, name), value in counters.items() if counter_kind == kind
+        }), top_items))
+    return digest.pack_lines(lines, max_length)
+
+
+def main(config_path, persist_path, board_id=None,  # pylint: disable=R0913,R0914
+         since=None, until=None, post=False, debug=False, **_):
+    """Stats command, printing or posting boards' activity statistics."""
+
+    if debug:
+        logging.getLogger().setLevel(logging.DEBUG)
+
+    current_settings = settings.load(config_path)
+    until = dates.parse(until) if until is not None else dates.now()
+    since = dates.parse(since) if since is not None else until - datetime.timedelta(days=7)
+    # Boards' state lives in the shard of the worker synchronising them, if any
+    shards = supervisor.load_shards(persist_path)
+    boards = current_settings.boards
+    if board_id is not None:
+        boards = [replay.board_settings(current_settings, board_id)]
+    transport = bucket_state = None
+    if post:
+        transport = network.from_settings(current_settings.network)
+        bucket_state = ratelimit.SharedBucketState(
+            current_settings.rate_state_path or persist_path + '.ratelimit')
+
+    for board in boards:
+        persist_paths = [persist_path]
+        if board.board_id in shards:
+            persist_paths.append(
+                supervisor.shard_persist_path(persist_path, shards[board.board_id]))
+        counters = load(persist_paths, board.board_id, since, until)
+        messages = summary_messages(board.board_id, counters, since, until,
+                                    top_items=current_settings.digest_top_items)
+        if not post:
+            for message in messages:
+                print(message + "\n")
+            continue
+        webhook = discord.open_webhook(
+            board.webhook_url, transport=transport, bucket_state=bucket_state)
+        for message in messages:
+            webhook.send_message(message)
+
+#  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+
+"""Multi-process sharding of boards synchronisation."""
+
+import bisect
+import hashlib
+import logging
+import multiprocessing
+import signal
+import time
+
+from . import persistence
+from . import settings
+
+# Workers running longer than this many seconds before crashing are restarted right away
+STABLE_RUN_DURATION = 60
+
+
+class HashRing(object):  # pylint: disable=R0903
+    """Consistent hashing ring spreading keys over a number of shards.
+
+    Changing the number of shards only moves the keys of the added or removed shards.
+    """
+
+    def __init__(self, shards, replicas=64):
+        self.shards = shards
+        self._ring = sorted(
+            (self._hash('{}-{}'.format(shard, replica)), shard)
+            for shard in range(shards)
+            for replica in range(replicas)
+        )
+        self._hashes = [point for point, _ in self._ring]
+
+    @staticmethod
+    def _hash(key):
+        """Returns the position of a key on the ring."""
+
+        return int(hashlib.md5(key.encode('utf-8')).hexdigest(), 16)
+
+    def shard(self, key):
+        """Returns the shard a given key belongs to."""
+
+        index = bisect.bisect(self._hashes, self._hash(key)) % len(self._ring)
+        return self._ring[index][1]
+
+
+def assign(board_ids, shards):
+    """Returns a {shard: board ids tuple} assignment of boards, omitting empty shards."""
+
+    ring = HashRing(shards)
+    assignment = dict()
+    for board_id in board_ids:
+        shard = ring.shard(board_id)
+        assignment[shard] = assignment.get(shard, ()) + (board_id, )
+    return assignment
+
+
+def shard_persist_path(persist_path, shard):
+    """Returns the persistence file path of a given shard, the main one if shard is None."""
+
+    if shard is None:
+        return persist_path
+    return '{}.shard{}'.format(persist_path, shard)
+
+
+def load_shards(persist_path):
+    """Returns the persisted {board id: shard} mapping of the previous assignment."""
+
+    with persistence.persistent_storage(persist_path) as storage:
+        return dict(storage.get('shards', dict()))
+
+
+def migrate_board_state(persist_path, board_id, from_shard, to_shard):
+    """Moves a board's persisted state between two shards' persistence files.
+
+    A None shard stands for the main persistence file, used without workers.
+    """
+
+    suffix = '/{}'.format(board_id)
+    with persistence.persistent_storage(shard_persist_path(persist_path, from_shard)) as source:
+        moved = {key: source[key] for key in source.keys() if key.endswith(suffix)}
+        for key in moved:
+            del source[key]
+        if from_shard is None and 'last_update' in source:
+            # Single-board cursor of earlier versions, which boards without their own use
+            moved.setdefault('last_update' + suffix, source['last_update'])
+    with persistence.persistent_storage(shard_persist_path(persist_path, to_shard)) as target:
+        target.update(moved)
+    logging.info("Moved board %s state from shard %s to %s", board_id, from_shard, to_shard)
+
+
+def unshard(persist_path):
+    """Moves boards' state back from shards' persistence files into the main one.
+
+    Runs without workers call it, in case workers were used before.
+    """
+
+    for board_id, shard in sorted(load_shards(persist_path).items()):
+        migrate_board_state(persist_path, board_id, shard, None)
+    with persistence.persistent_storage(persist_path) as storage:
+        storage.pop('shards', None)
+
+
+def run_worker(target, **kwargs):
+    """Runs a worker process' target, with default signal handling.
+
+    Forked workers would otherwise inherit the supervisor's SIGTERM handler until their
+    own is installed, ignoring SIGTERM meanwhile.
+    """
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    target(**kwargs)
+
+
+class Supervisor(object):  # pylint: disable=R0902
+    """Runs boards synchronisation over several worker processes.
+
+    Boards are assigned to workers by consistent hashing of their id, each worker owning
+    its own HTTP clients and persistence file. Workers are restarted when they crash, and
+    only those whose boards changed are restarted when boards or the number of workers do.
+    """
+
+    def __init__(self, target, config_path, persist_path,  # pylint: disable=R0913
+                 debug=False, lease=None):
+        self.target = target
+        self.config_path = config_path
+        self.persist_path = persist_path
+        self.debug = debug
+        self.lease = lease
+
+        self.assignment = dict()
+        self.processes = dict()
+        self.started_at = dict()
+        self.crashes = dict()
+        self.restart_at = dict()
+        self.stopping = False
+
+    def request_stop(self, *_):
+        """Requests supervision to stop, suitable as a signal handler."""
+
+        logging.info("Stop requested, stopping workers")
+        self.stopping = True
+
+    def _start(self, shard):
+        """Starts the worker process of a given shard."""
+
+        process = multiprocessing.Process(
+            target=run_worker,
+            name='triscord-shard{}'.format(shard),
+            args=(self.target, ),
+            kwargs={
+                'config_path': self.config_path,
+                'persist_path': shard_persist_path(self.persist_path, shard),
+                'debug': self.debug,
+                'daemon': True,
+                'board_ids': self.assignment[shard],
+                'rate_state_path': self.persist_path + '.ratelimit',
+            },
+        )
+        process.start()
+        self.processes[shard] = process
+        self.started_at[shard] = time.monotonic()
+        logging.info("Started worker %d for boards %s", shard, ', '.join(self.assignment[shard]))
+
+    def _stop(self, shard):
+        """Stops the worker process of a given shard."""
+
+        process = self.processes.pop(shard)
+        process.terminate()
+        process.join()
+
+    def rebalance(self, board_ids, workers):
+        """Assigns boards to workers, restarting only workers whose boards changed."""
+
+        assignment = assign(board_ids, workers)
+        changed = set(
+            shard
+            for shard in set(assignment) | set(self.assignment)
+            if assignment.get(shard) != self.assignment.get(shard)
+        )
+        for shard in changed & set(self.processes):
+            self._stop(shard)
+
+        # Boards without a previous shard were synchronised without workers
+        previous_shards = load_shards(self.persist_path)
+        shards = {board_id: shard for shard in assignment for board_id in assignment[shard]}
+        for board_id, shard in shards.items():
+            previous_shard = previous_shards.get(board_id)
+            if previous_shard != shard:
+                migrate_board_state(self.persist_path, board_id, previous_shard, shard)
+        with persistence.persistent_storage(self.persist_path) as storage:
+            storage['shards'] = shards
+
+        self.assignment = assignment
+        for shard in changed & set(assignment):
+            self.crashes.pop(shard, None)
+            self._start(shard)
+
+    def check_workers(self):
+        """Restarts crashed workers, backing off on repeated crashes."""
+
+        now = time.monotonic()
+        for shard in list(self.processes):
+            process = self.processes[shard]
+            if process.is_alive():
+                continue
+            if shard not in self.restart_at:
+                if now - self.started_at[shard] > STABLE_RUN_DURATION:
+                    self.crashes[shard] = 0
+                self.crashes[shard] = self.crashes.get(shard, 0) + 1
+                delay = min(2 ** (self.crashes[shard] - 1), 60)
+                logging.error("Worker %d exited with code %s, restarting in %ds",
+                              shard, process.exitcode, delay)
+                self.restart_at[shard] = now + delay
+            if now >= self.restart_at[shard]:
+                del self.restart_at[shard]
+                self._start(shard)
+
+    def run(self, current_settings, check_interval=1):
+        """Supervises workers until SIGTERM, applying configuration changes upon SIGHUP.
+
+        Workers are then all sent SIGTERM at once, delivering their pending messages within
+        their shutdown grace period in parallel.
+        """
+
+        watcher = settings.SettingsWatcher(self.config_path, current_settings)
+        signal.signal(signal.SIGTERM, self.request_stop)
+        signal.signal(signal.SIGHUP, watcher.request_reload)
+        try:
+            while not self.stopping:
+                board_ids = [board.board_id for board in current_settings.boards]
+                if assign(board_ids, current_settings.workers) != self.assignment:
+                    self.rebalance(board_ids, current_settings.workers)
+                self.check_workers()
+                if self.lease is not None:
+                    self.lease.heartbeat()
+                time.sleep(check_interval)
+                new_settings = watcher.poll()
+                if new_settings is not None and not new_settings.workers:
+                    logging.error("Setting [Daemon] workers to 0 requires a restart, keeping "
+                                  "%d workers", current_settings.workers)
+                    new_settings = new_settings._replace(workers=current_settings.workers)
+                current_settings = new_settings or current_settings
+        finally:
+            processes = [self.processes.pop(shard) for shard in list(self.processes)]
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.join()
+
+#  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :
@@ -3,19 +3,60 @@
 """Trello interactions module."""
 
 import logging
+import urllib.parse
 
-import arrow
-import requests
+from . import dates
+from . import network
+from . import ratelimit
+
+BATCH_MAX_ROUTES = 10
+
+# See https://developers.trello.com/docs/rate-limits
+QUOTA_PERIOD = 10
+KEY_QUOTA = 300
+TOKEN_QUOTA = 100
+QUOTA_LIMITER = ratelimit.SlidingWindowLimiter(period=QUOTA_PERIOD)
+
+# Largest page of actions Trello returns, see https://developers.trello.com/reference#actions
+PAGE_SIZE = 1000
+# Only the parts of an action Action.from_json reads are requested
+ACTION_FIELDS = {
+    'fields': 'id,type,date,data',
+    'memberCreator_fields': 'username',
+    'member_fields': 'username',
+    'display': 'true',
+}
 
 
 class TrelloAPI(object):  # pylint: disable=R0903
     """Provides an abstraction to Trello's Web authentication-restricted API."""
 
-    def __init__(self, key, token, base_url="https://api.trello.com/1"):
+    def __init__(self,  # pylint: disable=R0913
+                 key,
+                 token,
+                 base_url="https://api.trello.com/1",
+                 limiter=None,
+                 transport=None):
         self.key = key
         self.token = token
         self.base_url = base_url
 
+        if limiter is None:
+            limiter = QUOTA_LIMITER
+        self.limiter = limiter
+
+        if transport is None:
+            transport = network.Transport()
+        self.transport = transport
+
+    @property
+    def _quotas(self):
+        """Contains the (limiter key, limit) pairs every request counts against."""
+        return (
+            (('key', self.key), KEY_QUOTA),
+            (('token', self.token), TOKEN_QUOTA),
+        )
+
     @property
     def _base_payload(self):
         """Contains the authentication credentials required for a request."""
@@ -25,7 +66,11 @@ class TrelloAPI(object):  # pylint: disable=R0903
         }
 
     def _method(self, name, endpoint, *args, **kwargs):
-        """Injects authentication, executes the request and verify response status code."""
+        """Injects authentication, executes the request and verify response status code.
+
+        Requests are delayed to stay within Trello's API key and token quotas, and retried
+        once the delay advertised by a 429 response is over.
+        """
 
         payload_key_name = 'params' if name == 'get' else 'data'
         if payload_key_name not in kwargs:
@@ -33,7 +78,18 @@ class TrelloAPI(object):  # pylint: disable=R0903
         kwargs[payload_key_name].update(self._base_payload)
 
         url = self.base_url + endpoint
-        response = requests.__dict__[name](url, *args, **kwargs)
+        while True:
+            self.limiter.acquire(self._quotas)
+            response = self.transport.request(name, url, *args, **kwargs)
+            if response.status_code != 429:
+                break
+            retry_after = int(response.headers.get('Retry-After', QUOTA_PERIOD))
+            logging.warning("TrelloAPI.%s(%s): Rate limited, retrying in %ds",
+                            name, endpoint, retry_after)
+            deadline = self.transport.deadline
+            if deadline is not None and retry_after > deadline.remaining:
+                raise network.DeadlineExceeded('Trello quota reset is past the cycle deadline')
+            self.limiter.block([key for key, _ in self._quotas], retry_after)
         response.raise_for_status()
         logging.debug("TrelloAPI.%s(%s): %s", name, endpoint, response)
         return response
@@ -43,6 +99,127 @@ class TrelloAPI(object):  # pylint: disable=R0903
 
         return self._method('get', endpoint, *args, **kwargs)
 
+    @staticmethod
+    def route(endpoint, params=None):
+        """Returns a batchable route string for a given endpoint and GET parameters."""
+
+        if not params:
+            return endpoint
+        return endpoint + '?' + urllib.parse.urlencode(params)
+
+    def batch(self, routes):
+        """Executes several GET routes using as few `GET /batch` requests as possible.
+
+        See https://developers.trello.com/reference#batch
+
+        Returns a list holding, for each route in order, either its decoded JSON response or
+        None if Trello reported an error for this specific route.
+        """
+
+        results = []
+        for index in range(0, len(routes), BATCH_MAX_ROUTES):
+            chunk = routes[index:index + BATCH_MAX_ROUTES]
+            response = self.get('/batch', params={'urls': ','.join(chunk)})
+            for route, result in zip(chunk, response.json()):
+                if '200' in result:
+                    results.append(result['200'])
+                else:
+                    logging.warning("TrelloAPI.batch: route %s failed: %s", route, result)
+                    results.append(None)
+        return results
+
+
+class Action(object):  # pylint: disable=R0902,R0903
+    """Trello action, parsed once out of the API's raw JSON.
+
+    Only the fields used by filters and formatters are kept. `old` holds the names of the
+    fields changed by an `updateCard` action, and `new` their updated values.
+    See https://developers.trello.com/reference#action-types
+    """
+
+    __slots__ = (
+        'id',
+        'type',
+        'date',
+        'board_id',
+        'creator',
+        'card_id',
+        'card_name',
+        'list_name',
+        'list_before',
+        'list_after',
+        'old',
+        'new',
+        'comment',
+        'member_id',
+        'member',
+        'checkitem',
+        'checkitem_state',
+    )
+
+    def __init__(  # pylint: disable=R0913,R0914,W0622
+            self, *, id=None, type=None, date=None, board_id=None, creator=None,
+            card_id=None, card_name=None, list_name=None, list_before=None, list_after=None,
+            old=(), new=None, comment=None, member_id=None, member=None, checkitem=None,
+            checkitem_state=None):
+        self.id = id  # pylint: disable=C0103
+        self.type = type
+        self.date = date
+        self.board_id = board_id
+        self.creator = creator
+        self.card_id = card_id
+        self.card_name = card_name
+        self.list_name = list_name
+        self.list_before = list_before
+        self.list_after = list_after
+        self.old = old
+        self.new = dict() if new is None else new
+        self.comment = comment
+        self.member_id = member_id
+        self.member = member
+        self.checkitem = checkitem
+        self.checkitem_state = checkitem_state
+
+    def __repr__(self):
+        return '<Action {} {} {}>'.format(self.type, self.id, self.date)
+
+    def replace(self, **changes):
+        """Returns a copy of the action with some fields replaced."""
+
+        fields = {name: getattr(self, name) for name in self.__slots__}
+        fields.update(changes)
+        return Action(**fields)
+
+    @classmethod
+    def from_json(cls, raw):
+        """Parses an action out of its raw JSON representation, as returned by Trello."""
+
+        data = raw.get('data', {})
+        entities = raw.get('display', {}).get('entities', {})
+        card = data.get('card', {})
+        member = raw.get('member', {})
+        checkitem = entities.get('checkitem', {})
+        old = tuple(data.get('old', {}).keys())
+        return cls(
+            id=raw.get('id'),
+            type=raw['type'],
+            date=raw.get('date'),
+            board_id=data.get('board', {}).get('id'),
+            creator=entities.get('memberCreator', raw.get('memberCreator', {})).get('username'),
+            card_id=card.get('id'),
+            card_name=entities.get('card', {}).get('text', card.get('name')),
+            list_name=data.get('list', {}).get('name', entities.get('list', {}).get('text')),
+            list_before=data.get('listBefore', {}).get('name'),
+            list_after=data.get('listAfter', {}).get('name'),
+            old=old,
+            new={field: card.get(field) for field in old},
+            comment=entities.get('comment', {}).get('text'),
+            member_id=member.get('id'),
+            member=member.get('username'),
+            checkitem=checkitem.get('text'),
+            checkitem_state=checkitem.get('state'),
+        )
+
 
 class TrelloActivityFeed(object):
     """Provides an interface for fetching all actions that happened in a Trello board."""
@@ -55,7 +232,9 @@ class TrelloActivityFeed(object):
                  muted_action_types=None,
                  muted_update_fields=None,
                  muted_update_lists=None,
-                 last_update=None):
+                 last_update=None,
+                 last_action_id=None,
+                 action_log=None):
 
         self.api = api
         self.board_id = board_id
@@ -73,8 +252,10 @@ class TrelloActivityFeed(object):
         self.muted_update_lists = set(muted_update_lists)
 
         if last_update is None:
-            last_update = arrow.now()
+            last_update = dates.now()
         self.last_update = last_update
+        self.last_action_id = last_action_id
+        self.action_log = action_log
 
     @classmethod
     def action_formatter(cls, action_type):
@@ -89,108 +270,202 @@ class TrelloActivityFeed(object):
 
         return decorator
 
+    @property
+    def requested_action_types(self):
+        """Action types the feed renders, i.e. supported and not muted."""
+
+        return set(self.action_formatters.keys()) - self.muted_action_types
+
+    @property
+    def actions_request(self):
+        """Endpoint and GET parameters of the request listing eligible actions.
+
+        Actions are listed since the last known action id when there is one, its date
+        otherwise, as Trello accepts both, by pages of PAGE_SIZE actions. Muted action types
+        are left out of the request rather than filtered out once downloaded.
+        """
+
+        params = dict(
+            ACTION_FIELDS,
+            since=self.last_action_id or self.last_update.isoformat(),
+            filter=','.join(sorted(self.requested_action_types)),
+            limit=PAGE_SIZE,
+        )
+        return "/boards/{board_id}/actions".format(board_id=self.board_id), params
+
+    def fetch_actions(self):
+        """Requests the board's actions list and returns Trello's raw response, newest first."""
+
+        endpoint, params = self.actions_request
+        raw_actions = self.fetch_pages(self.api.get(endpoint, params=params).json())
+        self.mark_fetched(raw_actions, dates.now())
+        return raw_actions
+
+    def fetch_pages(self, raw_actions):
+        """Completes the first page of the board's actions list with the following ones.
+
+        Pages are requested before the oldest action of the previous one until one comes
+        back short. Returns all raw actions, newest first.
+        """
+
+        endpoint, params = self.actions_request
+        page = raw_actions
+        while len(page) >= PAGE_SIZE:
+            params['before'] = page[-1]['id']
+            page = self.api.get(endpoint, params=params).json()
+            raw_actions.extend(page)
+        return raw_actions
+
+    def mark_fetched(self, raw_actions, fetched_at):
+        """Moves the feed's cursor past a freshly fetched raw actions list."""
+
+        self.last_update = fetched_at
+        if raw_actions:
+            self.last_action_id = raw_actions[0]['id']
+
     @property
     def actions(self):
         """Generator which yields any action that is eligible to be synchronized."""
 
-        requested_action_types = set(self.action_formatters.keys()) - self.muted_action_types
-        params = {
-            'since': self.last_update.isoformat(),
-            'filter': ','.join(requested_action_types),
-            'display': 'true',
-        }
-        response = self.api.get(
-            "/boards/{board_id}/actions".format(**self.__dict__),
-            params=params,
-        )
-        self.last_update = arrow.now()
-
-        # Reverse actions order to sort them chronologically
-        actions = response.json()
-        actions.reverse()
-
-        for action in actions:
-            if action['type'] == 'updateCard':
-                for field_name in self.muted_update_fields:
-                    action['data']['old'].pop(field_name, None)
-                if 'listAfter' in action['data'] \
-                    and action['data']['listAfter']['name'] in self.muted_update_lists:
+        yield from self.process_actions(self.fetch_actions())
+
+    def process_actions(self, actions):
+        """Generator parsing and filtering a raw Trello actions list, yielding Action instances
+        chronologically.
+
+        Raw actions are consumed from the list as they get parsed, once recorded into the
+        feed's actionlog.ActionLog if any.
+        """
+
+        if self.action_log is not None and actions:
+            try:
+                self.action_log.append(self.board_id, reversed(actions))
+            except OSError as exc:
+                logging.error("Could not log board %s actions: %s", self.board_id, exc)
+
+        # Trello lists actions newest first, pop them from the end to sort them chronologically
+        return self.filter_actions(_pop_all(actions))
+
+    def filter_actions(self, raw_actions):
+        """Generator parsing and filtering chronologically ordered raw actions."""
+
+        for raw_action in raw_actions:
+            action = Action.from_json(raw_action)
+            if action.type in self.muted_action_types or \
+                    action.type not in self.action_formatters:
+                continue
+            if action.type == 'updateCard':
+                if self.muted_update_fields:
+                    action.old = tuple(
+                        field for field in action.old if field not in self.muted_update_fields
+                    )
+                if action.list_after in self.muted_update_lists:
                     continue
-                if not any(action['data']['old'].keys()):
+                if not action.old:
                     continue
             yield action
 
     def format_action(self, action):
-        """Returns a human-readable representation of an action"""
+        """Returns a human-readable representation of an action, raw or parsed."""
+
+        if not isinstance(action, Action):
+            action = Action.from_json(action)
+        return self.action_formatters[action.type](action)
+
+
+def _pop_all(items):
+    """Generator consuming a list from its end."""
+
+    while items:
+        yield items.pop()
+
+
+def fetch_feeds_actions(api, feeds):
+    """Fetches several feeds' actions through batched requests.
+
+    Returns a list of (feed, actions generator) pairs. Feeds whose route failed within the
+    batch are fetched again through an individual request.
+    """
+
+    routes = [TrelloAPI.route(*feed.actions_request) for feed in feeds]
+    results = api.batch(routes)
+    fetched_at = dates.now()
 
-        return self.action_formatters[action['type']](action)
+    feeds_actions = []
+    for feed, raw_actions in zip(feeds, results):
+        if raw_actions is None:
+            logging.warning("Batched fetch failed for board %s, falling back", feed.board_id)
+            raw_actions = feed.fetch_actions()
+        else:
+            feed.mark_fetched(feed.fetch_pages(raw_actions), fetched_at)
+        feeds_actions.append((feed, feed.process_actions(raw_actions)))
+    return feeds_actions
 
 
 @TrelloActivityFeed.action_formatter('createCard')
 def card_create_formatter(action):
     """Formatter for the `createCard` action."""
 
-    return "`{display[entities][memberCreator][username]}` created card " \
-           "`{display[entities][card][text]}` in list " \
-           "`{display[entities][list][text]}`.".format(**action)
+    return "`{action.creator}` created card " \
+           "`{action.card_name}` in list " \
+           "`{action.list_name}`.".format(action=action)
 
 
 @TrelloActivityFeed.action_formatter('moveCardToBoard')
 def card_import_formatter(action):
     """Formatter for the `moveCardToBoard` action."""
 
-    return "`{display[entities][memberCreator][username]}` imported card " \
-           "`{display[entities][card][text]}` to list " \
-           "`{data[list][name]}` from another board.".format(**action)
+    return "`{action.creator}` imported card " \
+           "`{action.card_name}` to list " \
+           "`{action.list_name}` from another board.".format(action=action)
 
 
 @TrelloActivityFeed.action_formatter('addMemberToCard')
 def member_join_formatter(action):
     """Formatter for the `addMemberToCard` action."""
 
-    return "`{member[username]}` joined card " \
-           "`{display[entities][card][text]}`.".format(**action)
+    return "`{action.member}` joined card " \
+           "`{action.card_name}`.".format(action=action)
 
 
 @TrelloActivityFeed.action_formatter('removeMemberFromCard')
 def member_leave_formatter(action):
     """Formatter for the `removeMemberFromCard` action."""
 
-    return "`{member[username]}` left card " \
-           "`{display[entities][card][text]}`.".format(**action)
+    return "`{action.member}` left card " \
+           "`{action.card_name}`.".format(action=action)
 
 
 @TrelloActivityFeed.action_formatter('commentCard')
 def card_comment_formatter(action):
     """Formatter for the `commentCard` action."""
 
-    return "`{display[entities][memberCreator][username]}` commented card " \
-           "`{display[entities][card][text]}`: " \
-           "{display[entities][comment][text]}.".format(**action)
+    return "`{action.creator}` commented card " \
+           "`{action.card_name}`: " \
+           "{action.comment}.".format(action=action)
 
 
 @TrelloActivityFeed.action_formatter('updateCheckItemStateOnCard')
 def checklist_item_mark_formatter(action):
     """Formatter for the `updateCheckItemStateOnCard` action."""
 
-    return "`{display[entities][memberCreator][username]}` marked item " \
-           "`{display[entities][checkitem][text]}` as {display[entities][checkitem][state]} " \
-           "in card `{display[entities][card][text]}`.".format(**action)
+    return "`{action.creator}` marked item " \
+           "`{action.checkitem}` as {action.checkitem_state} " \
+           "in card `{action.card_name}`.".format(action=action)
 
 
 @TrelloActivityFeed.action_formatter('updateCard')
 def card_update_formatter(action):
     """Formatter for the `updateCard` action."""
 
-    updated_fields = list(action['data']['old'].keys())
-    updated_field, dropped_fields = updated_fields[0], updated_fields[1:]
+    updated_field, dropped_fields = action.old[0], action.old[1:]
     if any(dropped_fields):  # pragma: no cover
         logging.warning('updateCard: extraneous fields dropped: %s', dropped_fields)
 
-    output = "`{display[entities][memberCreator][username]}`"
+    output = "`{action.creator}`"
     if updated_field == 'idList':
-        output = output + " moved card `{display[entities][card][text]}` " \
-            "to list `{data[listAfter][name]}`."
+        output = output + " moved card `{action.card_name}` " \
+            "to list `{action.list_after}`."
     elif updated_field == 'idMembers':
         # Duplicates with addMemberToCard, ignore
         return None
@@ -198,13 +473,13 @@ def card_update_formatter(action):
         # Inconsistent data, not always generated. May be related to the api key's owner.
         return None
     else:
-        updated_value = action['data']['card'][updated_field]
-        output = output + " updated the card `{display[entities][card][text]}`'s" + \
-            " {updated_field} to `{updated_value}`.".format(
-                updated_field=updated_field,
-                updated_value=updated_value,
-            )
-
-    return output.format(**action)
+        output = output + " updated the card `{action.card_name}`'s" \
+            " {updated_field} to `{updated_value}`."
+
+    return output.format(
+        action=action,
+        updated_field=updated_field,
+        updated_value=action.new.get(updated_field),
+    )
 
 #  vim: set tabstop=4 shiftwidth=4 expandtab autoindent :